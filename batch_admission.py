@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""Admission control for the batch jobs submitted by create_test.
+
+create_test submits one batch job per test. Launching a large suite all
+at once can exceed the per-user limits of the batch queue, and the
+extra jobs are held or rejected. Instead, the suite is split into waves
+of a few tests, and the next wave is only released when the jobs of
+this run that are still queued or running leave room for it under
+max_batch_jobs.
+
+The batch system is queried through a small adapter for each
+scheduler. The 'local' adapter does not talk to a scheduler at all, it
+treats every case in the test root that has not finished as an active
+job, which is useful for testing and on machines without a batch
+system.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import getpass
+import os
+import re
+import subprocess
+import time
+
+
+# seconds between queries of the batch system.
+DEFAULT_POLL_INTERVAL = 60.0
+
+# number of tests released in each wave.
+DEFAULT_WAVE_SIZE = 10
+
+
+class BatchQuery(object):
+    """Base class for batch system adapters. Subclasses implement
+    jobs(), returning a list of (job name, active) for the user's jobs,
+    where active is True for queued, held or running jobs.
+
+    """
+
+    def __init__(self, user=None):
+        self.user = user
+        if self.user is None:
+            self.user = getpass.getuser()
+
+    def jobs(self):
+        raise NotImplementedError
+
+    def _run(self, command):
+        """Run a query command and return its output lines.
+        """
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(command, stderr=devnull)
+        return output.decode('utf-8', 'replace').splitlines()
+
+
+class PBSQuery(BatchQuery):
+    """PBS Pro and Torque, e.g. cheyenne.
+    """
+
+    def jobs(self):
+        job_ids = self._run(['qselect', '-u', self.user])
+        job_ids = [j.strip() for j in job_ids if j.strip()]
+        if not job_ids:
+            return []
+        jobs = []
+        name = None
+        for line in self._run(['qstat', '-f'] + job_ids):
+            line = line.strip()
+            if line.startswith('Job_Name ='):
+                name = line.split('=', 1)[1].strip()
+            elif line.startswith('job_state =') and name is not None:
+                state = line.split('=', 1)[1].strip()
+                jobs.append((name, state in ('Q', 'H', 'R', 'W', 'T', 'B')))
+                name = None
+        return jobs
+
+
+class SlurmQuery(BatchQuery):
+    """Slurm, e.g. edison.
+    """
+
+    def jobs(self):
+        jobs = []
+        for line in self._run(['squeue', '-h', '-u', self.user,
+                               '-o', '%j|%T']):
+            if '|' not in line:
+                continue
+            name, state = line.rsplit('|', 1)
+            jobs.append((name.strip(), state.strip() in (
+                'PENDING', 'RUNNING', 'CONFIGURING', 'SUSPENDED',
+                'COMPLETING')))
+        return jobs
+
+
+class LSFQuery(BatchQuery):
+    """LSF, e.g. yellowstone.
+    """
+
+    def jobs(self):
+        jobs = []
+        # JOBID USER STAT QUEUE FROM_HOST EXEC_HOST JOB_NAME SUBMIT_TIME
+        for line in self._run(['bjobs', '-w', '-u', self.user])[1:]:
+            fields = line.split()
+            if len(fields) < 6:
+                continue
+            state = fields[2]
+            # pending jobs do not have an exec host
+            name = fields[5] if state == 'PEND' else fields[6]
+            jobs.append((name, state in ('PEND', 'RUN', 'PSUSP', 'USUSP',
+                                         'SSUSP')))
+        return jobs
+
+
+class LocalQuery(BatchQuery):
+    """Stand-in for a batch system: every case directory in the test
+    root is a job, active until its TestStatus reports a final status.
+
+    """
+
+    def __init__(self, test_root, user=None):
+        super(LocalQuery, self).__init__(user)
+        self.test_root = test_root
+
+    def jobs(self):
+        jobs = []
+        if not os.path.isdir(self.test_root):
+            return jobs
+        for case_dir in sorted(os.listdir(self.test_root)):
+            if not os.path.isdir(os.path.join(self.test_root, case_dir)):
+                continue
+            status = None
+            status_file = os.path.join(self.test_root, case_dir,
+                                       "TestStatus")
+            if os.path.isfile(status_file):
+                with open(status_file, 'r') as status_lines:
+                    fields = status_lines.readline().split()
+                    if fields:
+                        status = fields[0]
+            jobs.append((case_dir, status in (None, 'GEN', 'PEND', 'RUN')))
+        return jobs
+
+
+BATCH_QUERIES = {
+    "pbs": PBSQuery,
+    "slurm": SlurmQuery,
+    "lsf": LSFQuery,
+}
+
+
+def get_batch_query(name, test_root):
+    """Create the batch query adapter named in the machine config.
+    """
+    if name == "local":
+        return LocalQuery(test_root)
+    if name not in BATCH_QUERIES:
+        raise RuntimeError("Unknown batch_query '{0}', expected one of: "
+                           "{1}".format(name, ", ".join(
+                               sorted(list(BATCH_QUERIES) + ["local"]))))
+    return BATCH_QUERIES[name]()
+
+
+class AdmissionController(object):
+    """Decide when the next create_test launch of a run may start.
+
+    Jobs belong to this run when their name contains the testid of one
+    of its launches. Each launch is registered with its testid and
+    number of tests. A launch that is still running may submit all of
+    its jobs at any moment, so all of its tests count against the
+    limit. Once it has finished, only its jobs that are still active in
+    the batch queue count, as seen by a query made after it exited; the
+    queue is queried as soon as a launch finishes. Until such a query
+    succeeds, the finished launch counts all of its tests. The next
+    launch is admitted when it fits under max_jobs, or when nothing from
+    this run is in flight.
+
+    Used as the admission hook of a ProcessSupervisor.
+
+    """
+
+    def __init__(self, query, max_jobs, poll_interval=DEFAULT_POLL_INTERVAL,
+                 stream=None):
+        self._query = query
+        self._max_jobs = max_jobs
+        self._poll_interval = poll_interval
+        self._stream = stream
+        if self._stream is None:
+            self._stream = sys.stdout
+        self._launches = {}
+        self._started = []
+        # logfile : time the launch was seen to have exited.
+        self._finished = {}
+        self._active = {}
+        # time of the last successful query, and of the last attempt.
+        self._last_query = None
+        self._last_attempt = None
+        self._in_flight = 0
+        self._query_failed = False
+
+    def add(self, logfile, testid, num_jobs):
+        """Register a launch by its log file.
+        """
+        self._launches[logfile] = (testid, num_jobs)
+
+    def admit(self, cmd, running):
+        """Return True if cmd may be started now. running is the list of
+        commands that have not exited yet.
+
+        """
+        testid, num_jobs = self._launches.get(cmd.logfile, (None, 0))
+        running_logs = set(r.logfile for r in running)
+        now = time.time()
+        newly_finished = [logfile for logfile in self._started
+                          if logfile not in running_logs and
+                          logfile not in self._finished]
+        for logfile in newly_finished:
+            self._finished[logfile] = now
+        if newly_finished:
+            # the jobs of a finished launch are only known from a query
+            # made after it exited.
+            self._refresh(force=True)
+        elif self._finished:
+            self._refresh()
+
+        in_flight = 0
+        for logfile in self._started:
+            started_testid, started_jobs = self._launches[logfile]
+            if (logfile in running_logs or self._last_query is None or
+                    self._last_query < self._finished[logfile]):
+                in_flight += started_jobs
+            else:
+                in_flight += self._active.get(started_testid, 0)
+        self._in_flight = in_flight
+
+        if in_flight > 0 and in_flight + num_jobs > self._max_jobs:
+            return False
+        if in_flight > 0:
+            print("batch admission : releasing {0} tests, {1} of {2} jobs "
+                  "in flight".format(num_jobs, in_flight, self._max_jobs),
+                  file=self._stream)
+        self._started.append(cmd.logfile)
+        return True
+
+    def describe(self):
+        """Short status for the progress line.
+        """
+        return "batch {0}/{1}".format(self._in_flight, self._max_jobs)
+
+    def _refresh(self, force=False):
+        """Count the active jobs of each started launch, at most once per
+        poll interval unless forced. A failed query keeps the counts of
+        the last successful one.
+
+        """
+        now = time.time()
+        if (not force and self._last_attempt is not None and
+                now - self._last_attempt < self._poll_interval):
+            return
+        self._last_attempt = now
+        try:
+            jobs = self._query.jobs()
+        except (OSError, subprocess.CalledProcessError) as error:
+            # fail closed: launches that finished after the last
+            # successful query keep counting all of their tests.
+            if not self._query_failed:
+                print("WARNING: batch admission : could not query the batch "
+                      "system, counting finished launches as in flight : "
+                      "{0}".format(error), file=self._stream)
+                self._query_failed = True
+            return
+        self._query_failed = False
+        self._last_query = now
+        active = {}
+        for logfile in self._started:
+            testid = self._launches[logfile][0]
+            # wave testids share a prefix, e.g. ...-lmi1 and ...-lmi12
+            testid_re = re.compile(re.escape(testid) + r"(?!\d)")
+            active[testid] = sum(1 for name, is_active in jobs
+                                 if is_active and testid_re.search(name))
+        self._active = active
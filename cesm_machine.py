@@ -17,15 +17,11 @@ if sys.hexversion < 0x02070000:
     sys.exit(1)
 
 import getpass
+import json
 import os
 import os.path
 import platform
 
-try:
-    import lxml.etree as etree
-except:
-    import xml.etree.ElementTree as etree
-
 if sys.version_info[0] == 2:
     from ConfigParser import SafeConfigParser as config_parser
 else:
@@ -58,29 +54,148 @@ def get_machine(config):
 
 
 def find_src_root(current_dir):
-    """Recursively walk up the directory tree and try to find the root of
-    the src directory. The root of the src tree is defined as the
-    directory that contains a cime directory and components directory.
+    """Walk up the directory tree and try to find the root of the src
+    directory. The root of the src tree is defined as the directory
+    that contains a cime directory and components directory. Returns
+    None if we reach the file system root without finding it.
 
     NOTE: assme we will never start outside a cesm sandbox. But may
     eventually want to support cime standalone testing....
 
     """
-    #print("current_dir = {0}".format(current_dir))
+    current_dir = os.path.abspath(current_dir)
+    while True:
+        #print("current_dir = {0}".format(current_dir))
+        if is_src_root(current_dir):
+            return current_dir
+        parent_dir = os.path.dirname(current_dir)
+        if parent_dir == current_dir:
+            return None
+        current_dir = parent_dir
+
+
+def is_src_root(directory):
+    """Check for the required directories with stat instead of listing
+    the directory, which is much cheaper on parallel file systems.
+
+    """
     required_dirs = ['cime', 'components']
-    current_list = os.listdir(current_dir)
-    found_src_root = True
     for required in required_dirs:
-        if not (required in current_list):
-            found_src_root = False
+        if not os.path.isdir(os.path.join(directory, required)):
+            return False
+    return True
 
-    src_root = None
-    if found_src_root:
-        src_root = current_dir
-    else:
-        src_root = find_src_root(os.path.abspath(os.path.join(current_dir, '..')))
 
-    return src_root
+SANDBOX_CACHE_VERSION = 1
+
+
+def get_sandbox_cache_file():
+    """Location of the cache of sandbox discovery results.
+    """
+    home_dir = os.path.expanduser("~")
+    return "{0}/.cime/sandbox-cache.json".format(home_dir)
+
+
+class SandboxCache(object):
+    """Cache of the slow per-sandbox discovery steps: the source root for
+    a starting directory, the machines directory and values derived
+    from sandbox files, e.g. the cime version. Every cached result is
+    validated with a few stat calls before it is used.
+
+    """
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = get_sandbox_cache_file()
+        self._filename = filename
+        self._cache = _read_json_cache(
+            filename, {"version": SANDBOX_CACHE_VERSION, "start_dirs": {},
+                       "sandboxes": {}})
+        self._changed = False
+
+    def _sandbox(self, src_root):
+        if src_root not in self._cache["sandboxes"]:
+            self._cache["sandboxes"][src_root] = {}
+            self._changed = True
+        return self._cache["sandboxes"][src_root]
+
+    def find_src_root(self, start_dir):
+        """Cached version of find_src_root(start_dir).
+        """
+        start_dir = os.path.abspath(start_dir)
+        src_root = self._cache["start_dirs"].get(start_dir)
+        if src_root is None:
+            # any known sandbox containing start_dir, innermost first.
+            for root in sorted(self._cache["sandboxes"], key=len,
+                               reverse=True):
+                if start_dir == root or start_dir.startswith(root + os.sep):
+                    src_root = root
+                    break
+        if src_root is not None and is_src_root(src_root):
+            return src_root
+
+        src_root = find_src_root(start_dir)
+        if src_root:
+            self._cache["start_dirs"][start_dir] = src_root
+            self._sandbox(src_root)
+            self._changed = True
+        return src_root
+
+    def get_machines_dir(self, src_root):
+        """Cached version of get_machines_dir(src_root).
+        """
+        sandbox = self._sandbox(src_root)
+        machines_dir = sandbox.get("machines_dir")
+        if machines_dir and os.path.isdir(machines_dir):
+            return machines_dir
+        machines_dir = get_machines_dir(src_root)
+        sandbox["machines_dir"] = machines_dir
+        self._changed = True
+        return machines_dir
+
+    def get_value(self, src_root, key, depends_on):
+        """Return a cached value derived from the file depends_on, or None
+        if it is not cached or the file has changed.
+
+        """
+        entry = self._sandbox(src_root).get(key)
+        if entry is None:
+            return None
+        try:
+            signature = _file_signature(depends_on)
+        except OSError:
+            return None
+        if (entry["file"] != depends_on or
+                entry["mtime"] != signature["mtime"] or
+                entry["size"] != signature["size"]):
+            return None
+        return entry["value"]
+
+    def set_value(self, src_root, key, depends_on, value):
+        """Cache a value derived from the file depends_on.
+        """
+        signature = _file_signature(depends_on)
+        self._sandbox(src_root)[key] = {"file": depends_on,
+                                        "mtime": signature["mtime"],
+                                        "size": signature["size"],
+                                        "value": value}
+        self._changed = True
+
+    def save(self):
+        """Write the cache if anything changed. Sandboxes that have been
+        removed are dropped.
+
+        """
+        if not self._changed:
+            return
+        for src_root in list(self._cache["sandboxes"]):
+            if not is_src_root(src_root):
+                del self._cache["sandboxes"][src_root]
+        for start_dir in list(self._cache["start_dirs"]):
+            if self._cache["start_dirs"][start_dir] not in self._cache["sandboxes"]:
+                del self._cache["start_dirs"][start_dir]
+        _write_json_cache(self._filename, self._cache)
+        self._changed = False
 
 
 def get_machines_dir(src_root):
@@ -100,23 +215,16 @@ def get_machines_dir(src_root):
     if not machines_dir:
         print("Could not find machines directory in on of the expected locations:")
         for directory in possible_machines_dirs:
-            print("  {0}".foramt(os.path.join(src_root, directory)))
+            print("  {0}".format(os.path.join(src_root, directory)))
         raise RuntimeError("Could not find machines directory.")
 
     return os.path.join(src_root, machines_dir)
 
 
-def read_machine_config(cime_version, cfg_file, config_machines_xml):
-    """Read the configuration file and convert machine info into a dict. Expected format:
-
-
-    [yellowstone]
-    host = yslogin
-    batch = execca
-    background = true|false
-    clm_compilers = intel, pgi
-
-    Note that we skip any section that doesn't have a 'host' keyword.
+def read_machine_sections(cfg_file):
+    """Read every machine section of the configuration file into a dict
+    of dicts keyed by machine name. Sections without a 'host' keyword
+    are skipped.
 
     """
     print("Reading machine configuration file : {0}".format(cfg_file))
@@ -136,6 +244,24 @@ def read_machine_config(cime_version, cfg_file, config_machines_xml):
             key = i[0]
             value = i[1]
             config_dict[section][key] = value
+    return config_dict
+
+
+def read_machine_config(cime_version, cfg_file, config_machines_xml):
+    """Read the configuration file and convert machine info into a dict. Expected format:
+
+
+    [yellowstone]
+    host = yslogin
+    batch = execca
+    background = true|false
+    max_parallel = 3
+    clm_compilers = intel, pgi
+
+    Note that we skip any section that doesn't have a 'host' keyword.
+
+    """
+    config_dict = read_machine_sections(cfg_file)
     machine = get_machine(config_dict)
     machine_config = config_dict[machine]
     print("{0} configuration :".format(machine))
@@ -151,53 +277,169 @@ def read_machine_config(cime_version, cfg_file, config_machines_xml):
     return machine, machine_config
 
 
+# machine fields we need from config_machines.xml. Each key lists the
+# xml element names used by different cime versions, in order of
+# preference.
+MACHINE_XML_FIELDS = {
+    "scratch_dir": ["CESMSCRATCHROOT", "CIME_OUTPUT_ROOT"],
+    "compilers": ["COMPILERS"],
+    "cprnc": ["CCSM_CPRNC"],
+    "baseline_root": ["CCSM_BASELINE", "BASELINE_ROOT"],
+    "cesm_inputdata": ["DIN_LOC_ROOT"],
+}
+
+MACHINE_CACHE_VERSION = 1
+
+
+def get_machine_cache_file():
+    """Location of the cache of machine info extracted from
+    config_machines.xml files.
+
+    """
+    home_dir = os.path.expanduser("~")
+    return "{0}/.cime/machine-cache.json".format(home_dir)
+
+
+def _read_json_cache(cache_file, empty_cache):
+    """Load a json cache file, returning empty_cache if it does not
+    exist, can not be read or has a different version.
+
+    """
+    cache = empty_cache
+    try:
+        with open(cache_file, 'r') as cfile:
+            data = json.load(cfile)
+        if data.get("version") == empty_cache["version"]:
+            cache = data
+    except (IOError, OSError, ValueError):
+        pass
+    return cache
+
+
+def _write_json_cache(cache_file, cache):
+    """Atomically replace a json cache file. Caches are only an
+    optimization, so failures are ignored.
+
+    """
+    tmp_file = "{0}.{1}.tmp".format(cache_file, os.getpid())
+    try:
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_file, 'w') as cfile:
+            json.dump(cache, cfile, indent=2, sort_keys=True)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+
+
+def _file_signature(filename):
+    """Cheap check that a cached entry is still valid.
+    """
+    stat = os.stat(filename)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def scan_config_machines_xml(config_machines_xml, machine):
+    """Stream through config_machines.xml and stop at the requested
+    machine. Returns a dict of the raw (unexpanded) MACHINE_XML_FIELDS,
+    or None if the machine is not in the file.
+
+    """
+    # imported here because startup only needs xml on a cache miss.
+    try:
+        import lxml.etree as etree
+    except:
+        import xml.etree.ElementTree as etree
+
+    machine_xml = None
+    for junk_event, element in etree.iterparse(config_machines_xml,
+                                               events=("end", )):
+        if element.tag != "machine":
+            continue
+        if element.get("MACH") != machine:
+            # discard machines we don't care about as we go.
+            element.clear()
+            continue
+        machine_xml = {}
+        for key in MACHINE_XML_FIELDS:
+            for tag in MACHINE_XML_FIELDS[key]:
+                child = element.find(tag)
+                if child is not None and child.text is not None:
+                    machine_xml[key] = child.text.strip()
+                    break
+        break
+    return machine_xml
+
+
+def lookup_config_machines_xml(config_machines_xml, machine, cache):
+    """Find the raw machine fields in a config_machines.xml file, using
+    the cache when the file path, mtime and size are unchanged.
+
+    Returns (machine_xml or None, cache_changed).
+
+    """
+    signature = _file_signature(config_machines_xml)
+    key = os.path.abspath(config_machines_xml)
+    entry = cache["files"].get(key)
+    if (entry is None or entry["mtime"] != signature["mtime"] or
+            entry["size"] != signature["size"]):
+        entry = {"mtime": signature["mtime"], "size": signature["size"],
+                 "machines": {}}
+        cache["files"][key] = entry
+    if machine in entry["machines"]:
+        return entry["machines"][machine], False
+
+    print("Reading : {0}".format(config_machines_xml))
+    machine_xml = scan_config_machines_xml(config_machines_xml, machine)
+    # cache misses too, so we don't rescan the user file every time.
+    entry["machines"][machine] = machine_xml
+    return machine_xml, True
+
+
 def read_config_machines_xml(cime_version, machine, config_machines_xml):
-    """Read the cesm config_machines.xml file to extract info we need
+    """Read the cesm config_machines.xml file to extract info we need.
+    The user's ~/.cesm/config_machines.xml takes precedence over the
+    sandbox version. Results are cached in ~/.cime/machine-cache.json.
+
     """
-    machine_xml = {}
-    mach_xml_tree = None
+    cache_file = get_machine_cache_file()
+    cache = _read_json_cache(cache_file, {"version": MACHINE_CACHE_VERSION,
+                                          "files": {}})
+    cache_changed = False
+
+    machine_xml = None
     user_config_xml = "{0}/.cesm/config_machines.xml".format(os.environ["HOME"])
+    search_files = [config_machines_xml]
     if os.path.isfile(user_config_xml):
-        print("Reading : {0}".format(user_config_xml))
-        xml_tree = etree.parse(user_config_xml)
-        mach_xml_tree = xml_tree.findall("./machine[@MACH='{machine}']".format(machine=machine))
-        if len(mach_xml_tree) == 0:
-            mach_xml_tree = None
-            print("    Could not find '{0}' in {1}".format(machine, user_config_xml))
-        else:
-            mach_xml_tree = mach_xml_tree[0]
-
-    if mach_xml_tree is None:
-        # didn't find the machine in the user xml file, check the standard scripts location.
-        print("Reading : {0}".format(config_machines_xml))
-        xml_tree = etree.parse(config_machines_xml)
-        mach_xml_tree = xml_tree.findall("./machine[@MACH='{machine}']".format(machine=machine))
-        if len(mach_xml_tree) == 0:
-            mach_xml_tree = None
-            print("    Could not find '{0}' in {1}".format(machine, config_machines_xml))
-        else:
-            mach_xml_tree = mach_xml_tree[0]
-
-    if mach_xml_tree is None:
+        search_files.insert(0, user_config_xml)
+    for xml_file in search_files:
+        machine_xml, changed = lookup_config_machines_xml(xml_file, machine,
+                                                          cache)
+        cache_changed = cache_changed or changed
+        if machine_xml is not None:
+            break
+        print("    Could not find '{0}' in {1}".format(machine, xml_file))
+
+    if cache_changed:
+        # drop sandboxes that have been removed
+        for xml_file in list(cache["files"]):
+            if not os.path.isfile(xml_file):
+                del cache["files"][xml_file]
+        _write_json_cache(cache_file, cache)
+
+    if machine_xml is None:
         raise RuntimeError("Could not find machine '{0}' in any known config_machines.xml files!".format(machine))
 
-    # print(mach_xml_tree)
-    scratch_root = mach_xml_tree.findall("CESMSCRATCHROOT")
-    if not scratch_root:
-        scratch_root = mach_xml_tree.findall("CIME_OUTPUT_ROOT")
-    machine_xml["scratch_dir"] = scratch_root[0].text
-        
-#X#     if (cime_version["major"] == 5 and cime_version["minor"] >= 2):
-#X#         machine_xml["scratch_dir"] = mach_xml_tree.findall("CIME_OUTPUT_ROOT")[0].text
-#X#     else:
-#X#         machine_xml["scratch_dir"] = mach_xml_tree.findall("CESMSCRATCHROOT")[0].text
-    machine_xml["compilers"] = mach_xml_tree.findall("COMPILERS")[0].text
-    machine_xml["cprnc"] = mach_xml_tree.findall("CCSM_CPRNC")[0].text
-    baseline_root = mach_xml_tree.findall("CCSM_BASELINE")
-    if not baseline_root:
-        baseline_root = mach_xml_tree.findall("BASELINE_ROOT")
-    machine_xml['baseline_root'] = baseline_root[0].text
-    machine_xml['cesm_inputdata'] = mach_xml_tree.findall("DIN_LOC_ROOT")[0].text
+    machine_xml = dict(machine_xml)
+    for key in MACHINE_XML_FIELDS:
+        if key not in machine_xml:
+            raise RuntimeError("Could not find any of {0} for machine '{1}' "
+                               "in config_machines.xml".format(
+                                   ", ".join(MACHINE_XML_FIELDS[key]),
+                                   machine))
+
     # setup some variables to substitute into the xml data
     home_dir = os.path.expanduser("~")
     user_name = getpass.getuser()
@@ -206,6 +448,8 @@ def read_config_machines_xml(cime_version, machine, config_machines_xml):
         cesm_data_root = os.environ['CESMDATAROOT']
 
     for v in machine_xml:
+        # json caches return unicode on python 2
+        machine_xml[v] = str(machine_xml[v])
         machine_xml[v] = machine_xml[v].replace("$ENV{HOME}", home_dir)
         machine_xml[v] = machine_xml[v].replace("$USER", user_name)
         machine_xml[v] = machine_xml[v].replace("$ENV{CESMDATAROOT}", cesm_data_root)
@@ -8,7 +8,8 @@ TODO(bja, 2015-08) change --component to --suite
 
 TODO(bja, 2015-08) config file is getting kind of ucky, section
 key-value pairs aren't working well any more, need to convert to a
-sqlite database.
+sqlite database. Launch history is already kept in sqlite, see
+cime_history.py.
 
 """
 
@@ -27,14 +28,17 @@ if sys.hexversion < 0x02070000:
     sys.exit(1)
 
 # python standard library
+import time
+module_start_time = time.time()
+
 import argparse
 import datetime
+import glob
 import os
 import os.path
 import re
 from string import Template
 import subprocess
-import time
 import traceback
 
 if sys.version_info[0] == 2:
@@ -43,9 +47,13 @@ else:
     from configparser import ConfigParser as config_parser
 
 
-# local packages
-from cesm_machine import read_machine_config, find_src_root, get_machines_dir
+# local packages. Modules only needed by some commands (history,
+# testlists, sharding) are imported where they are used to keep startup
+# fast.
+from cesm_machine import read_machine_config, read_machine_sections
+from cesm_machine import SandboxCache
 from fortran_cprnc import build_cprnc
+from process_supervisor import ProcessSupervisor
 
 
 # ------------------------------------------------------------------------------
@@ -74,6 +82,21 @@ $generate $baseline \
 -testid  $testid
 """)
 
+create_test_cmd_cime5_testfile = Template("""
+$batch ./create_test $nobatch $project \
+--testfile $testfile \
+$generate $baseline \
+--test-root $test_root \
+--test-id  $testid
+""")
+
+create_test_cmd_cime4_testfile = Template("""
+$batch ./create_test $nobatch -testlist $testfile \
+$generate $baseline \
+-testroot $test_root \
+-testid  $testid
+""")
+
 # ------------------------------------------------------------------------------
 #
 #  process user input
@@ -89,6 +112,11 @@ def commandline_options():
     parser = argparse.ArgumentParser(
         description='python program to automate launching cime test suites.')
 
+    parser.add_argument('--affected-only', action='store_true', default=False,
+                        help='only launch the tests affected by the changes '
+                        'in the sandbox. Falls back to the full suite if the '
+                        'changes can not be mapped to specific testmods.')
+
     parser.add_argument('--backtrace', action='store_true',
                         help='show exception backtraces as extra debugging '
                         'output')
@@ -96,6 +124,11 @@ def commandline_options():
     parser.add_argument('--baseline', '-b', nargs=1, required=True,
                         help='baseline tag name')
 
+    parser.add_argument('--base-revision', nargs=1, default=[None],
+                        help='git or svn revision to diff the sandbox '
+                        'against for --affected-only. Default: uncommitted '
+                        'changes only.')
+
     parser.add_argument('--test-suite', nargs=1, required=True,
                         help='component to test: clm, clm_short, pop')
 
@@ -108,9 +141,55 @@ def commandline_options():
     parser.add_argument('--dry-run', action='store_true', default=False,
                         help='just setup commands to run tests, don\'t launch jobs')
 
+    parser.add_argument('--estimate', action='store_true', default=False,
+                        help='expand the suite into its tests and print the '
+                        'estimated pe-hours and wall clock time for each '
+                        'machine and compiler in the config file, based on '
+                        'previous runs or the test names. No tests are '
+                        'launched.')
+
     parser.add_argument('--generate', '-g', nargs=1, default=[''],
                         help='generate new baseline for the given tag name')
 
+    parser.add_argument('--plan-shards', action='store_true', default=False,
+                        help='split the suite across all machines in the '
+                        'config file that can run it, balancing the '
+                        'estimated cost, and write a shard plan to the '
+                        'scratch directory instead of launching tests.')
+
+    parser.add_argument('--shard', nargs=1, default=[None],
+                        help='path to a shard plan directory. Only launch '
+                        'the tests assigned to this machine.')
+
+    parser.add_argument('--rerun-from', nargs=1, default=[None],
+                        help='path to a previous test root. Only relaunch '
+                        'its tests that are still RUN or PEND, failed to '
+                        'build (CFAIL), or failed unexpectedly, using the '
+                        'baseline of the original launch.')
+
+    parser.add_argument('--schedule', nargs=1, default=['config'],
+                        choices=['config', 'longest-first'],
+                        help='order to launch suite and compiler '
+                        'combinations: config file order, or longest '
+                        'expected duration first based on previous runs.')
+
+    parser.add_argument('--no-history', action='store_true', default=False,
+                        help='do not record this launch in the run history '
+                        'database, ~/.cime/cime-history.db')
+
+    parser.add_argument('--timing', action='store_true', default=False,
+                        help='report the time spent in each startup and '
+                        'launch phase.')
+
+    parser.add_argument('--timeout', nargs=1, type=float, default=[None],
+                        help='wall clock limit in minutes for each '
+                        'foreground create_test command. Commands still '
+                        'running after this time are terminated.')
+
+    parser.add_argument('--follow-logs', action='store_true', default=False,
+                        help='echo the create_test log files to the screen '
+                        'as they grow for foreground launches.')
+
     options = parser.parse_args()
 
     return options
@@ -173,10 +252,15 @@ def list_to_dict(input_list, upper_case=False):
     return output_dict
 
 
-def run_command(command, logfile, background=False, dry_run=False):
+def run_command(command, logfile, background=False, dry_run=False,
+                timeout=None, follow_log=False):
     """Generic function to run a shell command, with timout limit, and
     append output to a log file.
 
+    Foreground commands are watched by a ProcessSupervisor, so we
+    return as soon as the command exits, or terminate it after timeout
+    seconds of wall clock time.
+
     """
     cmd_status = 0
     print("# ", end="")
@@ -184,6 +268,11 @@ def run_command(command, logfile, background=False, dry_run=False):
     print(" ".join(command))
     if dry_run:
         return cmd_status
+    if not background:
+        supervisor = ProcessSupervisor(max_parallel=1, timeout=timeout,
+                                       echo_logs=follow_log)
+        supervisor.add(command, logfile)
+        return supervisor.run()[0]
     try:
         with open(logfile, 'w') as run_stdout:
             proc = subprocess.Popen(command,
@@ -192,10 +281,6 @@ def run_command(command, logfile, background=False, dry_run=False):
                                     stderr=subprocess.STDOUT)
             print("\nstarted as pid : {0}".format(proc.pid), file=run_stdout)
             print("\nstarted as pid : {0}".format(proc.pid))
-            if not background:
-                while proc.poll() is None:
-                    time.sleep(10.0)
-                cmd_status = abs(proc.returncode)
     except Exception as error:
         print("ERROR: Running command :\n    '{0}'".format(" ".join(command)))
         print(error)
@@ -203,6 +288,373 @@ def run_command(command, logfile, background=False, dry_run=False):
     return cmd_status
 
 
+def run_commands_concurrently(jobs, max_parallel, dry_run=False,
+                              timeout=None, follow_logs=False,
+                              admission=None):
+    """Run a list of (command, logfile) jobs with at most max_parallel
+    processes in flight. Each command writes to its own log file. Blocks
+    until all commands have finished and returns a combined status: zero
+    if every command succeeded, otherwise the number of failed commands,
+    and the list of SupervisedCommands with the timing of each job.
+
+    An optional batch admission controller holds back each job until
+    the batch queue has room for its tests.
+
+    """
+    if dry_run or len(jobs) == 0:
+        for command, logfile in jobs:
+            run_command(command, logfile, background=False, dry_run=dry_run)
+        return 0, []
+
+    num_workers = max(1, min(max_parallel, len(jobs)))
+    print("Launching {0} commands with at most {1} running concurrently.".format(
+        len(jobs), num_workers))
+
+    supervisor = ProcessSupervisor(max_parallel=num_workers, timeout=timeout,
+                                   echo_logs=follow_logs, admission=admission)
+    for command, logfile in jobs:
+        print("# ", end="")
+        print("-" * 76)
+        print(" ".join(command))
+        supervisor.add(command, logfile)
+    job_status = supervisor.run()
+    commands = supervisor.commands()
+
+    failed = []
+    for job, status in zip(jobs, job_status):
+        if status != 0:
+            failed.append((job[1], status))
+
+    print("# ", end="")
+    print("-" * 76)
+    print("Finished {0} commands, {1} failed.".format(len(jobs), len(failed)))
+    for logfile, status in failed:
+        print("  status {0} : {1}".format(status, logfile))
+    return len(failed), commands
+
+
+def get_max_parallel(config):
+    """Get the maximum number of concurrent create_test processes from
+    the machine config. Returns zero if concurrent launches are not
+    requested.
+
+    """
+    max_parallel = 0
+    if "max_parallel" in config:
+        try:
+            max_parallel = int(config["max_parallel"])
+        except ValueError:
+            raise RuntimeError("machine config 'max_parallel' must be an "
+                               "integer, received '{0}'".format(
+                                   config["max_parallel"]))
+        if max_parallel < 0:
+            raise RuntimeError("machine config 'max_parallel' must be >= 0.")
+    return max_parallel
+
+
+def get_batch_admission(config):
+    """Get the batch queue admission control settings from the machine
+    config. Returns None unless max_batch_jobs is set:
+
+        max_batch_jobs : jobs from this run allowed in the queue at once
+        batch_query : pbs, slurm, lsf or local
+        batch_wave_size : tests per create_test launch, default 10
+        batch_poll_interval : seconds between queue queries, default 60
+
+    """
+    if "max_batch_jobs" not in config:
+        return None
+    from batch_admission import DEFAULT_POLL_INTERVAL, DEFAULT_WAVE_SIZE
+    admission = {"query": config.get("batch_query", "local").strip()}
+    for key, name, default, convert in (
+            ("max_jobs", "max_batch_jobs", None, int),
+            ("wave_size", "batch_wave_size", DEFAULT_WAVE_SIZE, int),
+            ("poll_interval", "batch_poll_interval", DEFAULT_POLL_INTERVAL,
+             float)):
+        try:
+            admission[key] = convert(config.get(name, default))
+        except ValueError:
+            raise RuntimeError("machine config '{0}' must be a number, "
+                               "received '{1}'".format(name, config[name]))
+        if admission[key] <= 0:
+            raise RuntimeError("machine config '{0}' must be > 0.".format(
+                name))
+    return admission
+
+
+def get_launch_durations(scratch_dir, suite_name, machine, history=None):
+    """Find how long create_test took for each (suite, compiler) in
+    previous launches of this suite on this machine. The run history
+    database is used when it has any records. Otherwise fall back to the
+    log files of earlier launches in the scratch directory: the start
+    time is the timestamp in the log file name, and the end time is the
+    last modification of the log file.
+
+    Returns a dict of (suite, compiler) : list of durations in seconds,
+    ordered from oldest to newest launch.
+
+    """
+    if history is not None:
+        durations = history.launch_durations(machine, suite_name)
+        if durations:
+            return durations
+
+    durations = {}
+    pattern = os.path.join(scratch_dir, "tests-{0}-*".format(suite_name),
+                           "*.{0}.tests.out".format(suite_name))
+    for logfile in sorted(glob.glob(pattern)):
+        # {timestamp}.{suite}.{machine}.{compiler}.{suite_name}.tests.out
+        fields = os.path.basename(logfile).split('.')
+        if len(fields) != 7 or fields[2] != machine:
+            continue
+        try:
+            start = datetime.datetime.strptime(fields[0], "%Y%m%d-%H%M")
+            end = datetime.datetime.fromtimestamp(os.path.getmtime(logfile))
+        except (ValueError, OSError):
+            continue
+        seconds = (end - start).total_seconds()
+        if seconds <= 0.0:
+            continue
+        key = (fields[1], fields[3])
+        durations.setdefault(key, []).append(seconds)
+    return durations
+
+
+def expected_duration(durations, max_runs=10):
+    """Median duration of the most recent max_runs launches, or None if
+    there is no history.
+
+    """
+    if not durations:
+        return None
+    from cime_history import median
+    return median(durations[-max_runs:])
+
+
+def order_longest_first(launches, durations):
+    """Reorder the launches so that the (suite, compiler) combinations
+    expected to take the longest start first. Combinations without any
+    history might be the slowest of all, so they go first, in config
+    file order.
+
+    """
+    unknown = []
+    known = []
+    for launch in launches:
+        seconds = expected_duration(durations.get(
+            (launch["suite"], launch["compiler"])))
+        launch["expected"] = seconds
+        if seconds is None:
+            unknown.append(launch)
+        else:
+            known.append(launch)
+    known.sort(key=lambda launch: launch["expected"], reverse=True)
+    ordered = unknown + known
+
+    print("Launch order, longest expected duration first:")
+    for launch in ordered:
+        expected = "unknown"
+        if launch["expected"] is not None:
+            expected = "{0:.1f} min".format(launch["expected"] / 60.0)
+        print("  {0} {1} : {2}".format(launch["suite"], launch["compiler"],
+                                       expected))
+    return ordered
+
+
+def get_sandbox_affected_testmods(src_root, base_revision):
+    """Determine which testmods are affected by the changes in the
+    sandbox. Returns None if some changes could affect any test, so the
+    whole suite must be run.
+
+    """
+    from cime_testlist import get_changed_files, get_affected_testmods
+
+    changed_files = get_changed_files(src_root, base_revision)
+    print("Sandbox changes relative to {0} :".format(
+        base_revision or "the working copy base"))
+    for changed in changed_files:
+        print("  {0}".format(changed))
+
+    testmods, unmapped = get_affected_testmods(src_root, changed_files)
+    if unmapped:
+        print("Changes may affect any test, running the full suite :")
+        for changed in unmapped[:10]:
+            print("  {0}".format(changed))
+        if len(unmapped) > 10:
+            print("  ... {0} more".format(len(unmapped) - 10))
+        return None
+
+    print("Affected testmods :")
+    for mod in sorted(testmods):
+        print("  {0}".format(mod))
+    return testmods
+
+
+def get_rerun_tests(rerun_from, suite_list, history=None):
+    """Select the tests of a previous test root that need to be rerun.
+
+    Returns (tests, launches) where tests is a dict of (suite,
+    compiler) : list of test names and launches are the original
+    launches from the test root manifest or the history, if known.
+
+    """
+    from cime_rerun import read_test_root, select_rerun_tests
+    from cime_xfail import find_expected_fails_files, read_expected_fails
+    from cime_manifest import read_launch_manifest
+
+    cimeroot, statuses = read_test_root(rerun_from)
+    xfail_files = find_expected_fails_files(cimeroot)
+    print("ExpectedTestFails file list :")
+    for xfail in xfail_files:
+        print("  {0}".format(xfail))
+    rerun = select_rerun_tests(statuses, read_expected_fails(xfail_files))
+    print("Rerunning {0} of {1} tests from {2} :".format(
+        len(rerun), len(statuses), rerun_from))
+
+    launches = []
+    manifest = read_launch_manifest(rerun_from)
+    if manifest is not None:
+        launches = [dict(launch, baseline=manifest["baseline"],
+                         generate=manifest["generate"])
+                    for launch in manifest["launches"]]
+    elif history is not None:
+        launches = history.test_root_launches(rerun_from)
+    launch_suites = dict((l["testid"], l["suite"]) for l in launches)
+
+    tests = {}
+    for test_name in sorted(rerun):
+        print("  {0} : {1}".format(rerun[test_name], test_name))
+        compiler = test_name.split('.')[3].rsplit('_', 1)[-1]
+        testid = statuses[test_name]["testid"]
+        suite = launch_suites.get(testid)
+        if suite is None:
+            # not in the history, match the testid format used by
+            # run_test_suites: <timestamp>-<suite[-2:]><compiler[0]>[wave]
+            for candidate in suite_list:
+                if re.search(r"-{0}{1}\d*$".format(
+                        re.escape(candidate[-2:]), re.escape(compiler[0])),
+                        testid):
+                    suite = candidate
+                    break
+            else:
+                suite = suite_list[0]
+        tests.setdefault((suite, compiler), []).append(test_name)
+    return tests, launches
+
+
+def write_test_file(filename, test_names, dry_run):
+    """Write an explicit list of test names for create_test.
+    """
+    print("Test list file : {0}".format(filename))
+    for name in test_names:
+        print("  {0}".format(name))
+    if not dry_run:
+        with open(filename, 'w') as test_file:
+            for name in test_names:
+                print(name, file=test_file)
+
+
+def plan_shards(src_root, cfg_file, machine, config, suite_list, suite_name,
+                baseline_tag, generate_tag, timestamp, history=None):
+    """Expand the suite into its tests on this machine and split them
+    across every configured machine that can run the suite. Writes the
+    shard plan into the scratch directory and returns its path.
+
+    """
+    from cime_shard import get_suite_machines, assign_tests, write_shard_plan
+    from cime_estimate import estimate_test_cost
+    from cime_testlist import get_suite_tests
+
+    machines = get_suite_machines(read_machine_sections(cfg_file), suite_name)
+    if not machines:
+        raise RuntimeError("No machines in the config file can run test "
+                           "suite '{0}'".format(suite_name))
+    print("Machines for suite {0} :".format(suite_name))
+    for mach in sorted(machines):
+        print("  {0} : {1}".format(mach, ", ".join(machines[mach])))
+
+    xml_machine = config.get("{0}_xml_machine".format(suite_name),
+                             machine).strip()
+    compilers = set()
+    for mach in machines:
+        compilers.update(machines[mach])
+
+    tests = []
+    for suite in suite_list:
+        for compiler in sorted(compilers):
+            xml_compiler = config.get("{0}_xml_compiler".format(suite_name),
+                                      compiler).strip()
+            for test in get_suite_tests(src_root, suite, xml_machine,
+                                        xml_compiler):
+                test.compiler = compiler
+                tests.append((suite, test))
+    print("Found {0} tests to shard.".format(len(tests)))
+
+    def test_cost(test):
+        return estimate_test_cost(test, machine, test.compiler, history)[0]
+
+    shards = assign_tests(tests, machines, test_cost)
+    plan_dir = os.path.join(config["scratch_dir"], "shards-{0}-{1}".format(
+        suite_name, timestamp))
+    manifest = write_shard_plan(plan_dir, suite_name, suite_list,
+                                baseline_tag, generate_tag, shards)
+    print("Shard plan :")
+    for mach in sorted(shards):
+        print("  {0} : {1} tests : estimated cost {2:.1f}".format(
+            mach, len(shards[mach]["tests"]), shards[mach]["cost"]))
+    print("Wrote shard manifest : {0}".format(manifest))
+    print("On each machine run : cime-tests.py --test-suite {0} "
+          "--baseline {1} --shard {2}".format(suite_name, baseline_tag,
+                                             plan_dir))
+    return plan_dir
+
+
+def estimate_suite(src_root, cfg_file, suite_list, suite_name,
+                   affected_testmods=None, history=None, debug=False):
+    """Expand the suite into its tests for every configured machine and
+    compiler that runs it, and print the estimated cost of each
+    combination without launching anything.
+
+    """
+    from cime_estimate import estimate_test_cost, SuiteEstimate
+    from cime_estimate import print_suite_estimates
+    from cime_shard import get_suite_machines
+    from cime_testlist import get_suite_tests, select_affected_tests
+
+    machine_configs = read_machine_sections(cfg_file)
+    machines = get_suite_machines(machine_configs, suite_name)
+    if not machines:
+        raise RuntimeError("No machines in the config file can run test "
+                           "suite '{0}'".format(suite_name))
+
+    estimates = []
+    for mach in sorted(machines):
+        mach_config = machine_configs[mach]
+        xml_machine = mach_config.get("{0}_xml_machine".format(suite_name),
+                                      mach).strip()
+        for compiler in machines[mach]:
+            xml_compiler = mach_config.get(
+                "{0}_xml_compiler".format(suite_name), compiler).strip()
+            suite_estimate = SuiteEstimate(mach, compiler)
+            for suite in suite_list:
+                tests = get_suite_tests(src_root, suite, xml_machine,
+                                        xml_compiler)
+                if affected_testmods is not None:
+                    tests = select_affected_tests(tests, affected_testmods)
+                for test in tests:
+                    pe_hours, wall_seconds, source = estimate_test_cost(
+                        test, mach, compiler, history)
+                    name = test.name(mach, compiler)
+                    if debug:
+                        print("  {0} : {1:.2f} pe-hours : {2:.2f} h : "
+                              "{3}".format(name, pe_hours,
+                                           wall_seconds / 3600.0, source))
+                    suite_estimate.add(name, pe_hours, wall_seconds, source)
+            estimates.append(suite_estimate)
+    print_suite_estimates(estimates, debug)
+    return estimates
+
+
 def get_timestamp(now):
     timestamp = now.strftime("%Y%m%d-%H%M")
     timestamp_short = now.strftime("%m%d%H%M")
@@ -212,8 +664,54 @@ def get_timestamp(now):
 
 # -----------------------------------------------------------------------------
 
+def get_create_test_command(cime_version, config, nobatch, project, machine,
+                            xml_machine, compiler, xml_compiler, suite,
+                            baseline, generate, test_root, testid, logfile,
+                            test_names=None, dry_run=False):
+    """Build the create_test command for one launch. With an explicit
+    list of test names, the names are written to a test list file next
+    to the log file instead of selecting the tests by xml category.
+
+    """
+    if test_names is not None:
+        testfile = "{0}.testlist".format(logfile[:-len(".tests.out")])
+        write_test_file(testfile, test_names, dry_run)
+        if cime_version["major"] == 4:
+            command = create_test_cmd_cime4_testfile.substitute(
+                config, nobatch=nobatch, testfile=testfile,
+                baseline=baseline, generate=generate,
+                test_root=test_root, testid=testid)
+        else:  # cime_major_version == 5:
+            command = create_test_cmd_cime5_testfile.substitute(
+                config, nobatch=nobatch, project=project,
+                testfile=testfile,
+                baseline=baseline, generate=generate,
+                test_root=test_root, testid=testid)
+    elif cime_version["major"] == 4:
+        command = create_test_cmd_cime4.substitute(
+            config, nobatch=nobatch,
+            machine=machine, xml_machine=xml_machine,
+            compiler=compiler, xml_compiler=xml_compiler,
+            suite=suite,
+            baseline=baseline, generate=generate,
+            test_root=test_root, testid=testid)
+    else:  # cime_major_version == 5:
+        command = create_test_cmd_cime5.substitute(
+            config, nobatch=nobatch, project=project,
+            machine=machine, xml_machine=xml_machine,
+            compiler=compiler, xml_compiler=xml_compiler,
+            suite=suite,
+            baseline=baseline, generate=generate,
+            test_root=test_root, testid=testid)
+    return command
+
+
 def run_test_suites(cime_version, machine, config, suite_list, timestamp, timestamp_short,
-                    suite_name, baseline_tag, generate_tag, dry_run):
+                    suite_name, baseline_tag, generate_tag, dry_run,
+                    timeout=None, follow_logs=False, schedule='config',
+                    history=None, src_root=None, affected_testmods=None,
+                    shard_dir=None, rerun_from=None, rerun_tests=None,
+                    timer=None):
 
     suite_compilers = "{0}_compilers".format(suite_name)
     if suite_compilers in config:
@@ -282,6 +780,10 @@ def run_test_suites(cime_version, machine, config, suite_list, timestamp, timest
     if config["background"].lower().find('t') == 0:
         background = True
 
+    # concurrent launches wait for all create_test processes, so they
+    # take the place of background launches.
+    max_parallel = get_max_parallel(config)
+
     # machines requiring special variables that live in the shell but get purged
     # cime....
     env_project = ''
@@ -292,6 +794,20 @@ def run_test_suites(cime_version, machine, config, suite_list, timestamp, timest
             env_project = '--project {0}'.format(os.environ["PROJECT"])
         
         
+    # batch queue admission control needs the explicit list of tests to
+    # split each launch into waves.
+    admission = get_batch_admission(config)
+
+    shard_tests = None
+    if shard_dir is not None:
+        from cime_shard import get_machine_shard, record_shard_launch
+        shard_tests = get_machine_shard(shard_dir, machine)
+    elif affected_testmods is not None:
+        from cime_testlist import get_suite_tests, select_affected_tests
+    elif rerun_tests is None and admission is not None:
+        from cime_testlist import get_suite_tests
+
+    launches = []
     for suite in suite_list:
         for compiler in compilers:
             testid = "{timestamp}-{suite}{compiler}".format(
@@ -303,27 +819,203 @@ def run_test_suites(cime_version, machine, config, suite_list, timestamp, timest
             else:
                 xml_compiler = compiler
 
-            if cime_version["major"] == 4:
-                command = create_test_cmd_cime4.substitute(
-                    config, nobatch=nobatch,
-                    machine=machine, xml_machine=xml_machine,
-                    compiler=compiler, xml_compiler=xml_compiler,
-                    suite=suite,
-                    baseline=baseline, generate=generate,
-                    test_root=test_root, testid=testid)
-            else:  # cime_major_version == 5:
-                command = create_test_cmd_cime5.substitute(
-                    config, nobatch=nobatch, project=env_project,
-                    machine=machine, xml_machine=xml_machine,
-                    compiler=compiler, xml_compiler=xml_compiler,
-                    suite=suite,
-                    baseline=baseline, generate=generate,
-                    test_root=test_root, testid=testid)
             logfile = "{test_root}/{timestamp}.{suite}.{machine}.{compiler}.{suite_name}.tests.out".format(
                 test_root=test_root, timestamp=timestamp,
                 suite_name=suite_name, suite=suite,
                 machine=machine, compiler=compiler)
-            run_command(command.split(), logfile, background, dry_run)
+
+            test_names = None
+            if shard_tests is not None:
+                test_names = shard_tests.get((suite, compiler), [])
+                if not test_names:
+                    print("No tests in {0} {1} assigned to {2} by the shard "
+                          "plan.".format(suite, compiler, machine))
+                    continue
+            elif rerun_tests is not None:
+                test_names = rerun_tests.get((suite, compiler), [])
+                if not test_names:
+                    continue
+            elif affected_testmods is not None:
+                tests = get_suite_tests(src_root, suite, xml_machine,
+                                        xml_compiler)
+                tests = select_affected_tests(tests, affected_testmods)
+                if not tests:
+                    print("No tests in {0} {1} affected by sandbox "
+                          "changes.".format(suite, compiler))
+                    continue
+                test_names = [t.name(machine, compiler) for t in tests]
+            elif admission is not None:
+                tests = get_suite_tests(src_root, suite, xml_machine,
+                                        xml_compiler)
+                test_names = [t.name(machine, compiler) for t in tests]
+                if not test_names:
+                    continue
+
+            waves = [test_names]
+            if admission is not None:
+                wave_size = admission["wave_size"]
+                waves = [test_names[i:i + wave_size]
+                         for i in range(0, len(test_names), wave_size)]
+
+            for wave, wave_names in enumerate(waves):
+                wave_testid = testid
+                wave_logfile = logfile
+                if len(waves) > 1:
+                    # each wave is a separate create_test launch.
+                    wave_testid = "{0}{1}".format(testid, wave + 1)
+                    wave_logfile = "{0}.w{1}.tests.out".format(
+                        logfile[:-len(".tests.out")], wave + 1)
+                command = get_create_test_command(
+                    cime_version, config, nobatch, env_project, machine,
+                    xml_machine, compiler, xml_compiler, suite, baseline,
+                    generate, test_root, wave_testid, wave_logfile,
+                    wave_names, dry_run)
+                launches.append({"suite": suite, "compiler": compiler,
+                                 "xml_machine": xml_machine,
+                                 "xml_compiler": xml_compiler,
+                                 "testid": wave_testid,
+                                 "command": command.split(),
+                                 "logfile": wave_logfile,
+                                 "tests": wave_names})
+
+    if shard_dir is not None and not dry_run:
+        testids = {}
+        for launch in launches:
+            # admission waves are launched with their own testids.
+            testids.setdefault("{0}.{1}".format(
+                launch["suite"], launch["compiler"]), []).append(
+                    launch["testid"])
+        record_shard_launch(shard_dir, machine, os.path.abspath(test_root),
+                            testids)
+
+    if rerun_from is not None:
+        from cime_rerun import write_rerun_record
+        for suite, compiler in rerun_tests:
+            if compiler not in compilers:
+                print("WARNING: compiler '{0}' is not configured for suite "
+                      "'{1}', not rerunning : {2}".format(
+                          compiler, suite_name,
+                          ", ".join(rerun_tests[(suite, compiler)])))
+        if not dry_run:
+            rerun_names = []
+            for launch in launches:
+                rerun_names.extend(launch["tests"])
+            write_rerun_record(test_root, rerun_from, rerun_names)
+
+    if schedule == 'longest-first':
+        durations = get_launch_durations(config["scratch_dir"], suite_name,
+                                         machine, history)
+        launches = order_longest_first(launches, durations)
+
+    if dry_run:
+        history = None
+
+    manifest = None
+    if not dry_run:
+        from cime_manifest import write_launch_manifest
+        manifest = {
+            "machine": machine, "suite_name": suite_name,
+            "suites": suite_list, "compilers": compilers,
+            "cime_version": cime_version, "src_root": src_root,
+            "test_root": os.path.abspath(test_root),
+            "scratch_dir": config["scratch_dir"],
+            "baseline_root": config.get("baseline_root"),
+            "baseline": baseline_tag, "generate": generate_tag,
+            "timestamp": timestamp, "rerun_from": rerun_from,
+            "shard_dir": shard_dir,
+            "affected_testmods": (sorted(affected_testmods)
+                                  if affected_testmods is not None else None),
+            "launches": [{"suite": launch["suite"],
+                          "compiler": launch["compiler"],
+                          "xml_machine": launch["xml_machine"],
+                          "xml_compiler": launch["xml_compiler"],
+                          "testid": launch["testid"],
+                          "logfile": launch["logfile"],
+                          "command": " ".join(launch["command"]),
+                          "tests": launch["tests"],
+                          "status": None, "start_time": None,
+                          "end_time": None} for launch in launches],
+            "phases": timer.phases() if timer is not None else [],
+        }
+        write_launch_manifest(test_root, manifest)
+
+    def record_launch(launch, start_time=None):
+        if history is None:
+            return None
+        return history.record_launch(
+            machine, suite_name, launch["suite"], launch["compiler"],
+            launch["testid"], baseline_tag, generate_tag,
+            os.path.abspath(test_root), launch["logfile"], start_time)
+
+    status = 0
+    results = []
+    if max_parallel == 0 and admission is None:
+        for launch in launches:
+            launch_id = record_launch(launch)
+            start_time = time.time()
+            cmd_status = run_command(launch["command"], launch["logfile"],
+                                     background, dry_run, timeout,
+                                     follow_logs)
+            if background:
+                # still running, the exit status is not known.
+                results.append((None, start_time, None))
+            else:
+                results.append((cmd_status, start_time, time.time()))
+                if cmd_status:
+                    # failed or killed by the timeout, the same as
+                    # run_commands_concurrently.
+                    status += 1
+            if launch_id is not None and not background:
+                history.finish_launch(launch_id, cmd_status)
+    else:
+        controller = None
+        if admission is not None:
+            from batch_admission import AdmissionController, get_batch_query
+            controller = AdmissionController(
+                get_batch_query(admission["query"], test_root),
+                admission["max_jobs"], admission["poll_interval"])
+            for launch in launches:
+                controller.add(launch["logfile"], launch["testid"],
+                               len(launch["tests"]))
+        jobs = [(launch["command"], launch["logfile"]) for launch in launches]
+        status, commands = run_commands_concurrently(
+            jobs, max(1, max_parallel), dry_run, timeout, follow_logs,
+            controller)
+        for launch, cmd in zip(launches, commands):
+            results.append((cmd.status, cmd.start_time, cmd.end_time))
+            # recorded after the run so the duration does not include
+            # the time spent waiting for max_parallel or admission.
+            launch_id = record_launch(launch, cmd.start_time)
+            if launch_id is not None:
+                history.finish_launch(launch_id, cmd.status, cmd.end_time)
+
+    if timer is not None:
+        timer.mark("launch")
+    if manifest is not None:
+        for entry, result in zip(manifest["launches"], results):
+            entry["status"], entry["start_time"], entry["end_time"] = result
+        if timer is not None:
+            manifest["phases"] = timer.phases()
+        write_launch_manifest(test_root, manifest)
+    return status
+
+
+def get_cime_version(src_root, sandbox_cache):
+    """Cached version of determine_cime_version. The cached value is
+    reused until SVN_EXTERNAL_DIRECTORIES changes.
+
+    """
+    svn_external_directories = os.path.join(src_root, "SVN_EXTERNAL_DIRECTORIES")
+    version = sandbox_cache.get_value(src_root, "cime_version",
+                                      svn_external_directories)
+    if version is None:
+        version = determine_cime_version(src_root)
+        sandbox_cache.set_value(src_root, "cime_version",
+                                svn_external_directories, version)
+    else:
+        print("Cime version = {0}.{1}.{2}".format(
+            version["major"], version["minor"], version["patch"]))
+    return version
 
 
 def determine_cime_version(src_root):
@@ -361,6 +1053,37 @@ def determine_cime_version(src_root):
     return version
 
 
+class PhaseTimer(object):
+    """Record the wall clock time spent in each phase of a launch.
+    """
+
+    def __init__(self, start_time=None):
+        if start_time is None:
+            start_time = time.time()
+        self._start = start_time
+        self._last = start_time
+        self._phases = []
+
+    def mark(self, phase):
+        """End the current phase, giving it the name phase.
+        """
+        now = time.time()
+        self._phases.append((phase, now - self._last))
+        self._last = now
+
+    def phases(self):
+        return list(self._phases)
+
+    def report(self):
+        print("# ", end="")
+        print("-" * 76)
+        print("Timing :")
+        for phase, seconds in self._phases:
+            print("  {0:<24} : {1:8.3f} s".format(phase, seconds))
+        print("  {0:<24} : {1:8.3f} s".format("total",
+                                              self._last - self._start))
+
+
 # -----------------------------------------------------------------------------
 #
 # main
@@ -368,19 +1091,24 @@ def determine_cime_version(src_root):
 # -----------------------------------------------------------------------------
 
 def main(options):
+    timer = PhaseTimer(module_start_time)
+    timer.mark("imports")
     now = datetime.datetime.now()
     timestamp, timestamp_short = get_timestamp(now)
     orig_working_dir = os.getcwd()
 
-    src_root = find_src_root(os.path.abspath(os.getcwd()))
+    sandbox_cache = SandboxCache()
+    src_root = sandbox_cache.find_src_root(os.getcwd())
     if not src_root:
         raise RuntimeError("Could not determine source directory root.")
     else:
         print("Found source root = {0}".format(src_root))
+    timer.mark("source root")
 
-    machines_dir = get_machines_dir(src_root)
+    machines_dir = sandbox_cache.get_machines_dir(src_root)
     if options.debug:
         print("Found machines dir = {0}".format(machines_dir))
+    timer.mark("machines dir")
 
     config_machines_xml = os.path.join(machines_dir, 'config_machines.xml')
 
@@ -389,27 +1117,114 @@ def main(options):
         home_dir = os.path.expanduser("~")
         cfg_file = "{0}/.cime/cime-tests.cfg".format(home_dir)
     suite_list = read_suite_config(cfg_file, options.test_suite[0])
+    timer.mark("suite config")
 
-    cime_version = determine_cime_version(src_root)
+    cime_version = get_cime_version(src_root, sandbox_cache)
+    sandbox_cache.save()
+    timer.mark("cime version")
 
     machine, config = read_machine_config(cime_version, cfg_file,
                                           config_machines_xml)
-
-    build_cprnc(config["cprnc"])
+    timer.mark("machine config")
 
     scripts_dir = os.path.join(src_root, 'cime', 'scripts')
     if options.debug:
         print("Using cime scripts dir = {0}".format(scripts_dir))
 
+    if not options.estimate:
+        build_cprnc(config["cprnc"], scripts_dir)
+        timer.mark("cprnc")
+
+    shard_dir = options.shard[0]
+    if shard_dir:
+        shard_dir = os.path.abspath(shard_dir)
+        if options.affected_only:
+            raise RuntimeError("--shard and --affected-only can not be "
+                               "combined.")
+
+    rerun_from = options.rerun_from[0]
+    if rerun_from:
+        rerun_from = os.path.abspath(rerun_from)
+        if shard_dir or options.affected_only:
+            raise RuntimeError("--rerun-from can not be combined with "
+                               "--shard or --affected-only.")
+
+    affected_testmods = None
+    if options.affected_only:
+        affected_testmods = get_sandbox_affected_testmods(
+            src_root, options.base_revision[0])
+        timer.mark("affected tests")
+
+    # dry runs only need the history to read from it.
+    history = None
+    use_history = (not options.dry_run or options.plan_shards or
+                   options.estimate or rerun_from or
+                   options.schedule[0] == 'longest-first')
+    if not options.no_history and use_history:
+        from cime_history import open_history
+        history = open_history()
+        timer.mark("history")
+
+    if options.estimate:
+        estimate_suite(src_root, cfg_file, suite_list, options.test_suite[0],
+                       affected_testmods, history, options.debug)
+        timer.mark("estimate")
+        if history is not None:
+            history.close()
+        if options.timing:
+            timer.report()
+        return 0
+
+    if options.plan_shards:
+        plan_shards(src_root, cfg_file, machine, config, suite_list,
+                    options.test_suite[0], options.baseline[0],
+                    options.generate[0], timestamp, history)
+        timer.mark("plan shards")
+        if history is not None:
+            history.close()
+        if options.timing:
+            timer.report()
+        return 0
+
+    baseline_tag = options.baseline[0]
+    generate_tag = options.generate[0]
+    rerun_tests = None
+    if rerun_from:
+        rerun_tests, prior_launches = get_rerun_tests(rerun_from, suite_list,
+                                                      history)
+        if prior_launches:
+            # rerun with the settings of the original launch.
+            if prior_launches[-1]["baseline"] != baseline_tag:
+                print("Using baseline '{0}' from the original launch.".format(
+                    prior_launches[-1]["baseline"]))
+            if (prior_launches[-1]["generate"] or '') != generate_tag:
+                print("Using generate tag '{0}' from the original "
+                      "launch.".format(prior_launches[-1]["generate"]))
+            baseline_tag = prior_launches[-1]["baseline"]
+            generate_tag = prior_launches[-1]["generate"] or ''
+        timer.mark("rerun tests")
+
+    timeout = None
+    if options.timeout[0]:
+        timeout = 60.0 * options.timeout[0]
+
     os.chdir(scripts_dir)
-    run_test_suites(cime_version, machine, config, suite_list, timestamp,
-                    timestamp_short, options.test_suite[0],
-                    options.baseline[0], options.generate[0],
-                    options.dry_run)
+    status = run_test_suites(cime_version, machine, config, suite_list,
+                             timestamp, timestamp_short, options.test_suite[0],
+                             baseline_tag, generate_tag,
+                             options.dry_run, timeout, options.follow_logs,
+                             options.schedule[0], history, src_root,
+                             affected_testmods, shard_dir, rerun_from,
+                             rerun_tests, timer)
         
     os.chdir(orig_working_dir)
+    if history is not None:
+        history.close()
+
+    if options.timing:
+        timer.report()
 
-    return 0
+    return status
 
 
 if __name__ == "__main__":
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+"""Index the cases of a cime baseline tag.
+
+A baseline tag, <baseline_root>/<tag>, has one directory per case with
+the baseline history files and a CaseDocs directory with the
+namelists:
+
+    clm4_5_36/ERS_D.f10_f10.ICLM45BGC.yellowstone_intel.clm-default/
+        clm2.h0.nc
+        cpl.hi.nc
+        CaseDocs/lnd_in
+
+On a parallel filesystem stat'ing these paths one test at a time is
+slow, so the tag is scanned once by a pool of threads and the case
+names, CaseDocs files, history files and their sizes are saved in a
+compact json index, baseline-index.json in the tag directory, or
+~/.cime/baseline-index/ when the tag is read only. The index records
+the modification time of each case and CaseDocs directory. Using it
+only needs a listing of the tag directory and a stat of those
+directories; cases that were added, removed or regenerated in place
+are rescanned. To rescan the whole tag:
+
+    cime_baseline.py --baseline-dir BASELINE_ROOT/TAG --rebuild
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+#
+# built-in modules
+#
+import argparse
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import traceback
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='index the cases, CaseDocs and history files of a cime '
+        'baseline tag.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--baseline-dir', nargs=1, required=True,
+                        help='path to the baseline tag, '
+                        'BASELINE_ROOT/TAG')
+
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rescan the baseline tag even if the index is '
+                        'up to date')
+
+    parser.add_argument('--threads', nargs=1, type=int,
+                        default=[DEFAULT_NUM_THREADS],
+                        help='number of case directories to scan at once')
+
+    options = parser.parse_args()
+    return options
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+
+INDEX_NAME = "baseline-index.json"
+
+INDEX_VERSION = 2
+
+DEFAULT_NUM_THREADS = 16
+
+CASEDOCS_DIR = "CaseDocs"
+
+HISTORY_SUFFIX = ".nc"
+
+# indexes loaded by this process, keyed by baseline directory.
+_indexes = {}
+
+
+def get_user_index_file(baseline_dir):
+    """Location of the index in the user's ~/.cime, for read only
+    baseline tags.
+
+    """
+    home_dir = os.path.expanduser("~")
+    name = os.path.abspath(baseline_dir).strip(os.sep).replace(os.sep, "_")
+    return "{0}/.cime/baseline-index/{1}.json".format(home_dir, name)
+
+
+def _list_dir(path):
+    """Return a list of (name, is directory, size) for the entries of a
+    directory, using os.scandir where it is available so only the files
+    need a stat call.
+
+    """
+    entries = []
+    if hasattr(os, "scandir"):
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                entries.append((entry.name, True, 0))
+            elif entry.is_file():
+                entries.append((entry.name, False, entry.stat().st_size))
+        return entries
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+        if os.path.isdir(full_path):
+            entries.append((name, True, 0))
+        elif os.path.isfile(full_path):
+            entries.append((name, False, os.path.getsize(full_path)))
+    return entries
+
+
+def case_mtimes(case_path):
+    """[case directory, CaseDocs directory] modification times of a
+    baseline case, None for a directory that does not exist. Adding or
+    removing files changes them.
+
+    """
+    mtimes = []
+    for path in (case_path, os.path.join(case_path, CASEDOCS_DIR)):
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def scan_case(case_path):
+    """Index one baseline case directory. Returns a dict with the
+    CaseDocs and history file names and sizes, and the directory
+    modification times.
+
+    """
+    case = {"casedocs": {}, "history": {}, "mtimes": case_mtimes(case_path)}
+    try:
+        entries = _list_dir(case_path)
+    except OSError:
+        return case
+    for name, is_dir, size in entries:
+        if is_dir:
+            if name == CASEDOCS_DIR:
+                for doc, doc_is_dir, doc_size in _list_dir(
+                        os.path.join(case_path, name)):
+                    if not doc_is_dir:
+                        case["casedocs"][doc] = doc_size
+        elif name.endswith(HISTORY_SUFFIX):
+            case["history"][name] = size
+    return case
+
+
+def list_cases(baseline_dir):
+    """Sorted names of the case directories in a baseline tag.
+    """
+    return sorted(name for name, is_dir, size in _list_dir(baseline_dir)
+                  if is_dir)
+
+
+def _map_cases(function, baseline_dir, case_names, num_threads):
+    """Call function on the path of each case with a pool of threads.
+    """
+    pool = ThreadPool(max(1, num_threads))
+    try:
+        return pool.map(function, [os.path.join(baseline_dir, name)
+                                   for name in case_names])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def scan_baseline(baseline_dir, case_names=None,
+                  num_threads=DEFAULT_NUM_THREADS):
+    """Scan every case directory of a baseline tag. Returns the index
+    dict.
+
+    """
+    if case_names is None:
+        case_names = list_cases(baseline_dir)
+    cases = _map_cases(scan_case, baseline_dir, case_names, num_threads)
+    return {"version": INDEX_VERSION,
+            "baseline_dir": os.path.abspath(baseline_dir),
+            "cases": dict(zip(case_names, cases))}
+
+
+def update_index(index, baseline_dir, case_names,
+                 num_threads=DEFAULT_NUM_THREADS):
+    """Bring a saved index up to date with the tag: drop removed cases
+    and rescan the cases that are new or whose directories changed.
+    Returns the number of cases that were removed or rescanned.
+
+    """
+    cases = index["cases"]
+    removed = set(cases) - set(case_names)
+    for name in removed:
+        del cases[name]
+    known = [name for name in case_names if name in cases]
+    mtimes = _map_cases(case_mtimes, baseline_dir, known, num_threads)
+    stale = [name for name, mtime in zip(known, mtimes)
+             if cases[name].get("mtimes") != mtime]
+    stale.extend(name for name in case_names if name not in cases)
+    if stale:
+        cases.update(zip(stale, _map_cases(scan_case, baseline_dir, stale,
+                                           num_threads)))
+    return len(removed) + len(stale)
+
+
+def _read_index(index_file):
+    """Load a saved index, None if it is missing or from another
+    version.
+
+    """
+    try:
+        with open(index_file, 'r') as ifile:
+            index = json.load(ifile)
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION or "cases" not in index:
+        return None
+    return index
+
+
+def _write_index(index_file, index):
+    """Atomically write the index, returns False if the directory is not
+    writable.
+
+    """
+    tmp_file = "{0}.{1}.tmp".format(index_file, os.getpid())
+    try:
+        index_dir = os.path.dirname(index_file)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        with open(tmp_file, 'w') as ifile:
+            json.dump(index, ifile, separators=(',', ':'), sort_keys=True)
+        os.rename(tmp_file, index_file)
+    except (IOError, OSError):
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        return False
+    return True
+
+
+class BaselineIndex(object):
+    """Lookup of the cases and files in a baseline tag.
+    """
+
+    def __init__(self, index):
+        self.baseline_dir = index["baseline_dir"]
+        self._cases = index["cases"]
+
+    def __len__(self):
+        return len(self._cases)
+
+    def __contains__(self, case):
+        return case in self._cases
+
+    def cases(self):
+        return sorted(self._cases)
+
+    def find_case(self, test_name):
+        """Return the baseline case for a test or status line name, the
+        longest dot separated prefix of the name that is a baseline
+        case, e.g. the case name without the test id and comparison
+        suffixes. None if there is no baseline for the test.
+
+        """
+        fields = test_name.split('.')
+        for end in range(len(fields), 0, -1):
+            case = '.'.join(fields[:end])
+            if case in self._cases:
+                return case
+        return None
+
+    def casedocs(self, case):
+        """dict of CaseDocs file name : size for a case.
+        """
+        return self._cases.get(case, {}).get("casedocs", {})
+
+    def history(self, case):
+        """dict of history file name : size for a case.
+        """
+        return self._cases.get(case, {}).get("history", {})
+
+    def casedocs_file(self, case, name):
+        """Path of a CaseDocs file of a case, None if it is not in the
+        baseline. A file missing from the index is looked for on disk.
+
+        """
+        path = os.path.join(self.baseline_dir, case, CASEDOCS_DIR, name)
+        if name not in self.casedocs(case) and not os.path.isfile(path):
+            return None
+        return path
+
+    def history_file(self, case, name):
+        """Path of a history file of a case, None if it is not in the
+        baseline. A file missing from the index is looked for on disk.
+
+        """
+        path = os.path.join(self.baseline_dir, case, name)
+        if name not in self.history(case) and not os.path.isfile(path):
+            return None
+        return path
+
+
+def get_baseline_index(baseline_dir, rebuild=False,
+                       num_threads=DEFAULT_NUM_THREADS):
+    """Return the BaselineIndex of a baseline tag, from the saved index
+    with any changed cases rescanned, otherwise scanning the whole tag.
+    A new or updated index is saved. Indexes are kept in memory for
+    the rest of the process.
+
+    """
+    baseline_dir = os.path.abspath(baseline_dir)
+    if not rebuild and baseline_dir in _indexes:
+        return _indexes[baseline_dir]
+
+    case_names = list_cases(baseline_dir)
+    index_files = [os.path.join(baseline_dir, INDEX_NAME),
+                   get_user_index_file(baseline_dir)]
+    index = None
+    num_changed = None
+    if not rebuild:
+        for index_file in index_files:
+            index = _read_index(index_file)
+            if index is not None:
+                num_changed = update_index(index, baseline_dir,
+                                             case_names, num_threads)
+                break
+    if index is None:
+        index = scan_baseline(baseline_dir, case_names, num_threads)
+    if num_changed != 0:
+        for index_file in index_files:
+            if _write_index(index_file, index):
+                break
+    baseline_index = BaselineIndex(index)
+    _indexes[baseline_dir] = baseline_index
+    return baseline_index
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+
+def main(options):
+    baseline_dir = options.baseline_dir[0]
+    if not os.path.isdir(baseline_dir):
+        raise RuntimeError("ERROR: baseline directory does not exist: "
+                           "{0}".format(baseline_dir))
+    index = get_baseline_index(baseline_dir, rebuild=options.rebuild,
+                               num_threads=options.threads[0])
+    num_casedocs = 0
+    num_history = 0
+    missing_casedocs = []
+    for case in index.cases():
+        num_casedocs += len(index.casedocs(case))
+        num_history += len(index.history(case))
+        if not index.casedocs(case):
+            missing_casedocs.append(case)
+    print("Baseline : {0}".format(index.baseline_dir))
+    print("  cases : {0}".format(len(index)))
+    print("  CaseDocs files : {0}".format(num_casedocs))
+    print("  history files : {0}".format(num_history))
+    if options.debug:
+        for case in missing_casedocs:
+            print("  no CaseDocs : {0}".format(case))
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
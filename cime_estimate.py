@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""Estimate the cost of a cime test suite before it is launched.
+
+Each test is predicted from the run history when possible: first the
+same test on the same machine and compiler, then the same test,
+grid and compset anywhere. Tests that have never been run fall back
+to a simple model based on the fields of the test name:
+
+    ERS_D_P15x2_Ld3.f10_f10.ICLM45BGC.yellowstone_intel.clm-default
+
+    test type (ERS) : number of model runs
+    _D : debug build, runs much slower
+    _P15x2 : pe layout, tasks x threads
+    _Ld3, _Lm1, _Ly3, _Ln9 : run length in days, months, years, steps
+    grid (f10_f10) : number of columns of the atmosphere/land grid
+    compset (ICLM45BGC) : active components, from the first letter
+
+The model only gives order of magnitude numbers, but that is enough to
+see that a suite will cost 50 or 5000 pe-hours. Estimates do not
+include build time or time spent waiting in the queue.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import re
+
+
+# number of model runs relative to a single run of the requested length.
+TEST_TYPE_RUNS = {
+    "SMS": 1.0,
+    "ERS": 1.5,
+    "ERP": 1.5,
+    "ERB": 1.5,
+    "ERH": 1.5,
+    "ERT": 1.5,
+    "ERI": 2.0,
+    "ERR": 1.5,
+    "PET": 2.0,
+    "PEA": 2.0,
+    "PEM": 2.0,
+    "NCK": 2.0,
+    "CME": 2.0,
+    "LII": 2.0,
+    "SSP": 2.0,
+    "PFS": 1.0,
+}
+DEFAULT_TEST_TYPE_RUNS = 1.5
+
+# default test length used by cime when the test name does not set one.
+DEFAULT_RUN_DAYS = 5.0
+
+# approximate number of columns for the first component of the grid name.
+GRID_COLUMNS = {
+    "1x1": 1,
+    "5x5": 25,
+    "f45": 3312,
+    "f10": 456,
+    "f19": 13824,
+    "f09": 55296,
+    "f05": 221184,
+    "f02": 884736,
+    "hcru": 259200,
+    "360x720cru": 259200,
+    "T31": 4608,
+    "T42": 8192,
+    "T62": 18048,
+    "T85": 32768,
+    "ne16": 13826,
+    "ne30": 48602,
+    "ne60": 194402,
+    "ne120": 777602,
+}
+DEFAULT_GRID_COLUMNS = 13824
+
+# relative cost of the active components, by the first letter of the
+# compset alias. Land only 'I' compsets are the reference.
+COMPSET_FACTORS = {
+    "A": 0.1,
+    "S": 0.1,
+    "X": 0.5,
+    "I": 1.0,
+    "C": 5.0,
+    "G": 10.0,
+    "F": 20.0,
+    "B": 40.0,
+    "E": 40.0,
+}
+DEFAULT_COMPSET_FACTOR = 10.0
+
+# pe-hours per column per simulated day for a land only compset.
+PE_HOURS_PER_COLUMN_DAY = 6.0e-6
+
+# debug builds turn off optimization and turn on run time checks.
+DEBUG_FACTOR = 3.0
+
+# initialization and finalization time per run, seconds.
+RUN_OVERHEAD_SECONDS = 120.0
+
+LENGTH_RE = re.compile(r"^L([dmysnh])(\d+)$")
+PES_RE = re.compile(r"^P(\d+)(x(\d+))?$")
+
+
+def parse_test_options(test):
+    """Extract the run length, debug flag and pe layout from the test
+    field of the test name, e.g. ERS_D_P15x2_Ld3.
+
+    """
+    fields = test.split("_")
+    options = {"type": fields[0], "days": DEFAULT_RUN_DAYS, "debug": False,
+               "pes": None}
+    for field in fields[1:]:
+        if field == "D":
+            options["debug"] = True
+            continue
+        if field == "Mmpi-serial":
+            options["pes"] = 1
+            continue
+        match = LENGTH_RE.match(field)
+        if match:
+            units, count = match.group(1), float(match.group(2))
+            if units == "d":
+                options["days"] = count
+            elif units == "m":
+                options["days"] = 30.0 * count
+            elif units == "y":
+                options["days"] = 365.0 * count
+            elif units == "h":
+                options["days"] = count / 24.0
+            else:
+                # steps or seconds, assume a half hour time step.
+                options["days"] = count / 48.0
+            continue
+        match = PES_RE.match(field)
+        if match:
+            tasks = int(match.group(1))
+            threads = 1
+            if match.group(3):
+                threads = int(match.group(3))
+            options["pes"] = tasks * threads
+    return options
+
+
+def grid_columns(grid):
+    """Approximate number of columns for a grid alias like f19_g16.
+    """
+    component_grid = grid.split("_")[0]
+    return GRID_COLUMNS.get(component_grid, DEFAULT_GRID_COLUMNS)
+
+
+def compset_factor(compset):
+    """Relative cost of the active components of a compset alias.
+    """
+    letters = compset.lstrip("0123456789")
+    if not letters:
+        return DEFAULT_COMPSET_FACTOR
+    return COMPSET_FACTORS.get(letters[0], DEFAULT_COMPSET_FACTOR)
+
+
+def default_pes(columns):
+    """Rough guess at the default pe layout for a grid.
+    """
+    if columns <= 25:
+        return 1
+    return max(16, min(1024, int(round(columns / 400.0))))
+
+
+def model_test_cost(test):
+    """Predict (pe-hours, wall seconds) for a CimeTest from its name.
+    """
+    options = parse_test_options(test.test)
+    columns = grid_columns(test.grid)
+    runs = TEST_TYPE_RUNS.get(options["type"], DEFAULT_TEST_TYPE_RUNS)
+    pes = options["pes"]
+    if pes is None:
+        pes = default_pes(columns)
+
+    run_pe_hours = (PE_HOURS_PER_COLUMN_DAY * columns * options["days"] *
+                    compset_factor(test.compset))
+    if options["debug"]:
+        run_pe_hours *= DEBUG_FACTOR
+    pe_hours = runs * (run_pe_hours + pes * RUN_OVERHEAD_SECONDS / 3600.0)
+    wall_seconds = pe_hours * 3600.0 / pes
+    return pe_hours, wall_seconds
+
+
+def estimate_test_cost(test, machine, compiler, history=None):
+    """Estimate (pe-hours, wall seconds, source) for a test run on
+    machine with compiler. source is 'history', 'similar' or 'model'.
+
+    """
+    if history is not None:
+        timing = history.median_test_timing(test.name(machine, compiler))
+        if timing is not None:
+            return timing[0], timing[1], "history"
+        prefix = "{0}.{1}.{2}.".format(test.test, test.grid, test.compset)
+        timing = history.median_test_timing(prefix, prefix=True)
+        if timing is not None:
+            return timing[0], timing[1], "similar"
+    pe_hours, wall_seconds = model_test_cost(test)
+    return pe_hours, wall_seconds, "model"
+
+
+class SuiteEstimate(object):
+    """Running totals for one (machine, compiler) combination.
+    """
+
+    def __init__(self, machine, compiler):
+        self.machine = machine
+        self.compiler = compiler
+        self.num_tests = 0
+        self.pe_hours = 0.0
+        self.serial_seconds = 0.0
+        self.longest_seconds = 0.0
+        self.longest_test = None
+        self.sources = {"history": 0, "similar": 0, "model": 0}
+
+    def add(self, test_name, pe_hours, wall_seconds, source):
+        self.num_tests += 1
+        self.pe_hours += pe_hours
+        self.serial_seconds += wall_seconds
+        if wall_seconds > self.longest_seconds:
+            self.longest_seconds = wall_seconds
+            self.longest_test = test_name
+        self.sources[source] += 1
+
+
+def print_suite_estimates(estimates, debug=False):
+    """Print the totals per machine and compiler, and per machine.
+    estimates is a list of SuiteEstimate.
+
+    """
+    print("# ", end="")
+    print("-" * 76)
+    print("Estimated cost (build and queue time not included) :")
+    print("  {0:<12} {1:<8} {2:>6} {3:>10} {4:>10} {5:>10}  {6}".format(
+        "machine", "compiler", "tests", "pe-hours", "serial h", "longest h",
+        "history/similar/model"))
+    machines = {}
+    for est in estimates:
+        print("  {0:<12} {1:<8} {2:>6} {3:>10.1f} {4:>10.2f} {5:>10.2f}  "
+              "{6}/{7}/{8}".format(
+                  est.machine, est.compiler, est.num_tests, est.pe_hours,
+                  est.serial_seconds / 3600.0, est.longest_seconds / 3600.0,
+                  est.sources["history"], est.sources["similar"],
+                  est.sources["model"]))
+        if debug and est.longest_test:
+            print("      longest test : {0}".format(est.longest_test))
+        totals = machines.setdefault(est.machine, [0, 0.0, 0.0, 0.0])
+        totals[0] += est.num_tests
+        totals[1] += est.pe_hours
+        totals[2] += est.serial_seconds
+        totals[3] = max(totals[3], est.longest_seconds)
+
+    print("\n  Machine totals :")
+    for machine in sorted(machines):
+        totals = machines[machine]
+        print("  {0:<12} {1:<8} {2:>6} {3:>10.1f} {4:>10.2f} {5:>10.2f}".format(
+            machine, "all", totals[0], totals[1], totals[2] / 3600.0,
+            totals[3] / 3600.0))
+    print("\n  serial h : wall clock hours if the tests run one at a time.")
+    print("  longest h : wall clock hours of the longest test, the lower "
+          "bound if\n              every test runs at the same time.")
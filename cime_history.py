@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+"""Persistent sqlite history of cime test suite launches and results.
+
+Every launch by cime-tests.py is recorded with its machine, suite,
+compiler, testid, baseline and start/end times. The final status and
+timing of each test are harvested from the TestStatus and timing/
+files in the test root with:
+
+    cime_history.py --record-test-root ${SCRATCH}/tests-clm-20150910-1723
+
+Schedulers, cost estimates and reports can then ask questions like
+"how long did X take the last 10 times" without walking old scratch
+directories.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+#
+# built-in modules
+#
+import argparse
+import os
+import re
+import time
+import traceback
+
+try:
+    import sqlite3
+except ImportError:
+    # some site pythons are built without sqlite, history is optional.
+    sqlite3 = None
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='record and query the history of cime test suite runs.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--history-file', nargs=1,
+                        default=[None],
+                        help='path to the history database. Default: '
+                        '~/.cime/cime-history.db')
+
+    parser.add_argument('--record-test-root', nargs='+', default=[],
+                        help='harvest test status and timing from the '
+                        'given test root directories.')
+
+    parser.add_argument('--test-durations', nargs=1, default=[None],
+                        help='show the wall clock time of the last runs of '
+                        'the given test name.')
+
+    parser.add_argument('--limit', nargs=1, type=int, default=[10],
+                        help='number of previous runs to show.')
+
+    options = parser.parse_args()
+    return options
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS launches (
+    id INTEGER PRIMARY KEY,
+    machine TEXT NOT NULL,
+    suite_name TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    compiler TEXT NOT NULL,
+    testid TEXT NOT NULL,
+    baseline TEXT,
+    generate TEXT,
+    test_root TEXT NOT NULL,
+    logfile TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    status INTEGER
+);
+CREATE INDEX IF NOT EXISTS launches_by_suite
+    ON launches (machine, suite_name, suite, compiler, start_time);
+CREATE INDEX IF NOT EXISTS launches_by_test_root
+    ON launches (test_root);
+
+CREATE TABLE IF NOT EXISTS test_results (
+    id INTEGER PRIMARY KEY,
+    launch_id INTEGER REFERENCES launches (id),
+    test_root TEXT NOT NULL,
+    case_dir TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    status TEXT,
+    status_time REAL,
+    init_seconds REAL,
+    run_seconds REAL,
+    final_seconds REAL,
+    wall_seconds REAL,
+    model_cost REAL,
+    model_throughput REAL,
+    pe_count INTEGER,
+    UNIQUE (test_root, case_dir)
+);
+CREATE INDEX IF NOT EXISTS test_results_by_name
+    ON test_results (test_name, status_time);
+"""
+
+
+def default_history_file():
+    """The history database lives next to the user config file.
+    """
+    home_dir = os.path.expanduser("~")
+    return "{0}/.cime/cime-history.db".format(home_dir)
+
+
+class RunHistory(object):
+    """Thin wrapper around the sqlite history database.
+    """
+
+    def __init__(self, filename=None):
+        """Open (and create if necessary) the history database.
+        """
+        if sqlite3 is None:
+            raise RuntimeError("python sqlite3 module is not available, "
+                               "can not record run history.")
+        if filename is None:
+            filename = default_history_file()
+        self._filename = filename
+        history_dir = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(history_dir):
+            os.makedirs(history_dir)
+        self._db = sqlite3.connect(filename, timeout=30.0)
+        self._db.executescript(HISTORY_SCHEMA)
+        self._db.commit()
+
+    def filename(self):
+        return self._filename
+
+    def close(self):
+        self._db.close()
+
+    def record_launch(self, machine, suite_name, suite, compiler, testid,
+                      baseline, generate, test_root, logfile, start_time=None):
+        """Record the start of a create_test launch. Returns the launch id
+        used to record the end of the launch.
+
+        """
+        if start_time is None:
+            start_time = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO launches (machine, suite_name, suite, compiler, "
+            "testid, baseline, generate, test_root, logfile, start_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (machine, suite_name, suite, compiler, testid, baseline,
+             generate, test_root, logfile, start_time))
+        self._db.commit()
+        return cursor.lastrowid
+
+    def finish_launch(self, launch_id, status, end_time=None):
+        """Record the end time and exit status of a launch.
+        """
+        if end_time is None:
+            end_time = time.time()
+        self._db.execute(
+            "UPDATE launches SET end_time = ?, status = ? WHERE id = ?",
+            (end_time, status, launch_id))
+        self._db.commit()
+
+    def launch_durations(self, machine, suite_name, limit=10):
+        """Wall clock seconds of the most recent finished launches of a
+        suite on a machine.
+
+        Returns a dict of (suite, compiler) : list of durations, ordered
+        from oldest to newest launch.
+
+        """
+        rows = self._db.execute(
+            "SELECT suite, compiler, end_time - start_time FROM launches "
+            "WHERE machine = ? AND suite_name = ? AND end_time IS NOT NULL "
+            "ORDER BY start_time DESC",
+            (machine, suite_name))
+        durations = {}
+        for suite, compiler, seconds in rows:
+            key = (suite, compiler)
+            if key not in durations:
+                durations[key] = []
+            if len(durations[key]) < limit and seconds > 0.0:
+                durations[key].insert(0, seconds)
+        return durations
+
+    def test_root_launches(self, test_root):
+        """The launches that wrote into a test root, oldest first. Each
+        entry is a dict keyed by column name.
+
+        """
+        cursor = self._db.execute(
+            "SELECT machine, suite_name, suite, compiler, testid, baseline, "
+            "generate, logfile, start_time, end_time, status FROM launches "
+            "WHERE test_root = ? ORDER BY start_time",
+            (os.path.abspath(test_root), ))
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def test_durations(self, test_name, limit=10):
+        """Status and timing of the last limit runs of a test, newest
+        first. Each entry is a dict keyed by column name.
+
+        """
+        cursor = self._db.execute(
+            "SELECT test_root, case_dir, status, status_time, wall_seconds, "
+            "model_cost, model_throughput, pe_count FROM test_results "
+            "WHERE test_name = ? ORDER BY status_time DESC LIMIT ?",
+            (test_name, limit))
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def median_test_timing(self, test_name, limit=10, prefix=False):
+        """Median (pe-hours, wall seconds) of the last limit runs of a
+        test that have timing information, or None if there is no
+        history. With prefix=True, test_name is a name prefix, e.g.
+        'ERS_Ld5.f10_f10.ICLM45BGC.' matches the test on every machine,
+        compiler and testmod.
+
+        """
+        if prefix:
+            # range query so the test name index is used.
+            upper = test_name[:-1] + chr(ord(test_name[-1]) + 1)
+            where = "test_name >= ? AND test_name < ?"
+            args = (test_name, upper, limit)
+        else:
+            where = "test_name = ?"
+            args = (test_name, limit)
+        rows = self._db.execute(
+            "SELECT wall_seconds * pe_count / 3600.0, wall_seconds "
+            "FROM test_results WHERE " + where + " AND wall_seconds IS NOT NULL "
+            "AND pe_count IS NOT NULL ORDER BY status_time DESC LIMIT ?",
+            args).fetchall()
+        if not rows:
+            return None
+        return (median([row[0] for row in rows]),
+                median([row[1] for row in rows]))
+
+    def record_test_root(self, test_root, debug=False):
+        """Harvest the TestStatus and timing files of every case in a test
+        root. Cases are matched to their launch by testid. Launches
+        that did not wait for create_test (background launches) get
+        their end time from the newest TestStatus file.
+
+        Returns the number of cases recorded.
+
+        """
+        test_root = os.path.abspath(test_root)
+        launches = self._db.execute(
+            "SELECT id, testid, end_time FROM launches WHERE test_root = ?",
+            (test_root, )).fetchall()
+
+        num_recorded = 0
+        last_status_time = {}
+        for case_dir in sorted(os.listdir(test_root)):
+            status_file = os.path.join(test_root, case_dir, "TestStatus")
+            if not os.path.isfile(status_file):
+                continue
+            launch_id = None
+            test_name = case_dir
+            for lid, testid, junk in launches:
+                if case_dir.endswith(".{0}".format(testid)):
+                    launch_id = lid
+                    test_name = case_dir[:-len(testid) - 1]
+                    break
+            test_name = strip_case_suffix(test_name)
+
+            status = read_test_status(status_file)
+            status_time = os.path.getmtime(status_file)
+            timing = read_timing_dir(os.path.join(test_root, case_dir,
+                                                  "timing"))
+            if debug:
+                print("  {0} : {1} : {2}".format(case_dir, status, timing))
+            self._db.execute(
+                "INSERT OR REPLACE INTO test_results (launch_id, test_root, "
+                "case_dir, test_name, status, status_time, init_seconds, "
+                "run_seconds, final_seconds, wall_seconds, model_cost, "
+                "model_throughput, pe_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (launch_id, test_root, case_dir, test_name, status,
+                 status_time, timing.get("init_seconds"),
+                 timing.get("run_seconds"), timing.get("final_seconds"),
+                 timing.get("wall_seconds"), timing.get("model_cost"),
+                 timing.get("model_throughput"), timing.get("pe_count")))
+            num_recorded += 1
+            if launch_id is not None:
+                last_status_time[launch_id] = max(
+                    status_time, last_status_time.get(launch_id, 0.0))
+
+        for lid, testid, end_time in launches:
+            if end_time is None and lid in last_status_time:
+                self._db.execute(
+                    "UPDATE launches SET end_time = ? WHERE id = ?",
+                    (last_status_time[lid], lid))
+        self._db.commit()
+        return num_recorded
+
+
+def open_history(filename=None):
+    """Open the history database, or return None with a warning if it is
+    not available. History is never allowed to stop a test launch.
+
+    """
+    try:
+        return RunHistory(filename)
+    except Exception as error:
+        print("WARNING: run history disabled : {0}".format(error))
+        return None
+
+
+def median(values):
+    """Median of a non-empty list of numbers.
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return 0.5 * (values[middle - 1] + values[middle])
+
+
+def strip_case_suffix(case_name):
+    """Remove the cime4 '.C' / '.G' case suffix from a test name.
+    """
+    for suffix in (".C", ".G"):
+        if case_name.endswith(suffix):
+            return case_name[:-len(suffix)]
+    return case_name
+
+
+def read_test_status(status_file):
+    """Return the overall test status, the first word of the first line
+    of the TestStatus file, the same as cs.status reports.
+
+    """
+    status = None
+    with open(status_file, 'r') as status_lines:
+        for line in status_lines:
+            line = line.split()
+            if line:
+                status = line[0]
+                break
+    return status
+
+
+TIMING_PATTERNS = {
+    "model_cost": re.compile(r"Model Cost:\s*([\d.]+)", re.IGNORECASE),
+    "model_throughput": re.compile(r"Model Throughput:\s*([\d.]+)",
+                                   re.IGNORECASE),
+    "init_seconds": re.compile(r"Init Time\s*:\s*([\d.]+)"),
+    "run_seconds": re.compile(r"^\s+Run Time\s*:\s*([\d.]+)"),
+    "final_seconds": re.compile(r"Final Time\s*:\s*([\d.]+)"),
+    "pe_count": re.compile(r"pe count for cost estimate\s*:\s*(\d+)"),
+}
+
+
+def read_timing_dir(timing_dir):
+    """Extract cost and timing information from the cesm timing file in
+    a case timing directory, using the same fields as 'cs.status -cost'.
+    Returns an empty dict if there is no timing file.
+
+    """
+    timing = {}
+    if not os.path.isdir(timing_dir):
+        return timing
+    # same selection as cs.status: timing files end in a date stamp.
+    timing_files = [f for f in sorted(os.listdir(timing_dir))
+                    if f[-1:].isdigit()]
+    for timing_file in timing_files:
+        with open(os.path.join(timing_dir, timing_file), 'r') as tfile:
+            for line in tfile:
+                for key in TIMING_PATTERNS:
+                    if key in timing:
+                        continue
+                    match = TIMING_PATTERNS[key].search(line)
+                    if match:
+                        timing[key] = float(match.group(1))
+    if "pe_count" in timing:
+        timing["pe_count"] = int(timing["pe_count"])
+    if ("init_seconds" in timing and "run_seconds" in timing and
+            "final_seconds" in timing):
+        timing["wall_seconds"] = (timing["init_seconds"] +
+                                  timing["run_seconds"] +
+                                  timing["final_seconds"])
+    return timing
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+
+def main(options):
+    history = RunHistory(options.history_file[0])
+    print("Using run history : {0}".format(history.filename()))
+    for test_root in options.record_test_root:
+        num_cases = history.record_test_root(test_root, options.debug)
+        print("Recorded {0} cases from {1}".format(num_cases, test_root))
+
+    if options.test_durations[0]:
+        test_name = options.test_durations[0]
+        print("Last {0} runs of {1} :".format(options.limit[0], test_name))
+        for run in history.test_durations(test_name, options.limit[0]):
+            print("  {0} : {1} : {2} seconds : {3}".format(
+                time.strftime("%Y-%m-%d %H:%M",
+                              time.localtime(run["status_time"])),
+                run["status"], run["wall_seconds"], run["test_root"]))
+    history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
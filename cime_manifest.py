@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Machine readable record of a cime-tests.py launch.
+
+cime-tests.py writes launch-manifest.json into every test root it
+creates, so status, filtering, cleanup and reporting tools can load
+everything about the launch in one read instead of re-deriving it from
+config files and directory scans:
+
+    machine, suite_name, suites, compilers, cime_version
+    src_root, test_root, scratch_dir, baseline_root
+    baseline, generate, timestamp
+    rerun_from, shard_dir, affected_testmods : how tests were selected
+    launches : one entry per create_test command with its suite,
+        compiler, xml_machine, xml_compiler, testid, logfile, command,
+        explicit test list (or null for the full suite), exit status
+        and start and end times
+    phases : [phase, seconds] wall clock time of each launch phase
+
+The manifest is written when the launches start and rewritten with the
+results when they finish.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import json
+import os
+
+
+MANIFEST_NAME = "launch-manifest.json"
+
+MANIFEST_VERSION = 1
+
+
+def get_manifest_file(test_root):
+    return os.path.join(test_root, MANIFEST_NAME)
+
+
+def write_launch_manifest(test_root, manifest):
+    """Atomically write the manifest into the test root.
+    """
+    manifest["version"] = MANIFEST_VERSION
+    manifest_file = get_manifest_file(test_root)
+    tmp_file = "{0}.{1}.tmp".format(manifest_file, os.getpid())
+    with open(tmp_file, 'w') as mfile:
+        json.dump(manifest, mfile, indent=2, sort_keys=True)
+    os.rename(tmp_file, manifest_file)
+    return manifest_file
+
+
+def read_launch_manifest(test_root):
+    """Load the manifest of a test root, or None if the test root was
+    not created by a version of cime-tests.py that writes one.
+
+    """
+    manifest_file = get_manifest_file(test_root)
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, 'r') as mfile:
+        manifest = json.load(mfile)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
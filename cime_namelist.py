@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""Parse and compare Fortran namelist files, e.g. lnd_in and drv_in.
+
+    &clm_inparm
+     fsurdat = '/glade/p/cesmdata/surfdata_10x15_simyr2000.nc'
+     hist_nhtfrq = 0, -24
+     use_cn = .true.
+    /
+
+Namelists are compared semantically: group and variable names are case
+insensitive, the order of groups and variables, comments, white space,
+line breaks and quoting style are ignored, and values are compared
+after normalizing logicals (T, .t., .TRUE.) and numbers (1, 1.0,
+1.d0). Parsed files are cached by path, modification time and size, so
+a baseline file shared by many tests is only parsed once.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import os
+import re
+
+# namelist files in a run or CaseDocs directory.
+NAMELIST_FILE_RE = re.compile(r"_in[_\d]{0,4}$")
+
+# variables that always differ between two cases, by file.
+IGNORED_VARIABLES = {
+    "drv_in": ("case_name", "case_desc", "hostname", "username",
+               "model_version"),
+}
+
+LOGICALS = {
+    "t": ".true.", ".t.": ".true.", ".true.": ".true.", "true": ".true.",
+    "f": ".false.", ".f.": ".false.", ".false.": ".false.",
+    "false": ".false.",
+}
+
+NUMBER_RE = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)([eEdD][-+]?\d+)?$")
+
+# parsed files, keyed by path : ((mtime, size), namelist).
+_namelists = {}
+
+
+def _tokenize(text):
+    """Split namelist text into tokens, dropping comments. Quoted
+    strings are returned whole, including their quotes. Commas, '=',
+    '&' group starts and '/' group ends are separate tokens.
+
+    """
+    tokens = []
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if char in " \t\r\n":
+            i += 1
+        elif char == '!':
+            end = text.find('\n', i)
+            i = length if end < 0 else end
+        elif char in "'\"":
+            # doubled quotes are an escaped quote.
+            j = i + 1
+            while j < length:
+                if text[j] == char:
+                    if j + 1 < length and text[j + 1] == char:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            tokens.append(text[i:j + 1])
+            i = j + 1
+        elif char in ",=/":
+            tokens.append(char)
+            i += 1
+        elif char in "&$":
+            j = i + 1
+            while j < length and text[j] not in " \t\r\n,/!":
+                j += 1
+            tokens.append(text[i:j])
+            i = j
+        else:
+            j = i
+            while j < length and text[j] not in " \t\r\n,=/!'\"":
+                j += 1
+            tokens.append(text[i:j])
+            i = j
+    return tokens
+
+
+def normalize_value(token):
+    """Normalize a single value so equivalent spellings compare equal.
+    """
+    if token[0] in "'\"":
+        quote = token[0]
+        return "'{0}'".format(token[1:-1].replace(quote * 2, quote).strip())
+    lower = token.lower()
+    if lower in LOGICALS:
+        return LOGICALS[lower]
+    if NUMBER_RE.match(token):
+        number = float(lower.replace('d', 'e'))
+        if number.is_integer() and abs(number) < 1.0e15:
+            return str(int(number))
+        return repr(number)
+    return lower
+
+
+def parse_namelist(text):
+    """Parse namelist text into a dict of group : dict of variable :
+    tuple of normalized values. Group and variable names are lower
+    case.
+
+    """
+    namelist = {}
+    group = None
+    variable = None
+    tokens = _tokenize(text)
+    for index, token in enumerate(tokens):
+        if token[0] in "&$" and len(token) > 1 and group is None:
+            name = token[1:].lower()
+            if name == "end":
+                continue
+            group = namelist.setdefault(name, {})
+            variable = None
+        elif group is None:
+            # text outside of a group is ignored by fortran.
+            continue
+        elif token == '/' or token.lower() in ("&end", "$end"):
+            group = None
+            variable = None
+        elif token == '=':
+            continue
+        elif token == ',':
+            continue
+        elif index + 1 < len(tokens) and tokens[index + 1] == '=':
+            variable = token.lower()
+            group[variable] = ()
+        elif variable is not None:
+            group[variable] = group[variable] + (normalize_value(token), )
+    return namelist
+
+
+def read_namelist(filename):
+    """Parse a namelist file, reusing the parsed result while the file is
+    unchanged.
+
+    """
+    stat = os.stat(filename)
+    key = (stat.st_mtime, stat.st_size)
+    cached = _namelists.get(filename)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(filename, 'r') as nlfile:
+        namelist = parse_namelist(nlfile.read())
+    _namelists[filename] = (key, namelist)
+    return namelist
+
+
+def diff_namelists(baseline, test, ignored=()):
+    """Compare two parsed namelists. Returns a sorted list of (group,
+    variable, baseline value, test value) for every difference. The
+    variable is None for a group that is only in one of the files, and
+    a missing value is None.
+
+    """
+    differences = []
+    for group in sorted(set(baseline) | set(test)):
+        if group not in test or group not in baseline:
+            differences.append((group, None,
+                                "present" if group in baseline else None,
+                                "present" if group in test else None))
+            continue
+        base_group = baseline[group]
+        test_group = test[group]
+        for variable in sorted(set(base_group) | set(test_group)):
+            if variable in ignored:
+                continue
+            base_value = base_group.get(variable)
+            test_value = test_group.get(variable)
+            if base_value != test_value:
+                differences.append((group, variable, base_value, test_value))
+    return differences
+
+
+def format_value(value):
+    if value is None:
+        return "(missing)"
+    if isinstance(value, tuple):
+        return ", ".join(value)
+    return value
+
+
+def diff_namelist_files(baseline_file, test_file):
+    """Semantic differences between two namelist files, see
+    diff_namelists.
+
+    """
+    ignored = IGNORED_VARIABLES.get(os.path.basename(test_file), ())
+    return diff_namelists(read_namelist(baseline_file),
+                          read_namelist(test_file), ignored)
+
+
+def find_namelist_files(directory):
+    """Names of the namelist files, *_in, in a run or CaseDocs
+    directory.
+
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if NAMELIST_FILE_RE.search(name) and
+                  os.path.isfile(os.path.join(directory, name)))
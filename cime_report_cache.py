@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Cache of the results of the previous filter-test-results.py report
+for a test root, so the report can be rerun cheaply while a suite is
+still finishing.
+
+Everything is keyed by the modification time and size of each case's
+TestStatus file. A case whose TestStatus has not changed since the
+last report reuses its status lines and the text of its detailed
+diagnostics, e.g. the rerun of a failed build or the cprnc summary of
+a history comparison failure. Only the cases that changed are read and
+diagnosed again. The list of ExpectedTestFails.xml files is reused
+while none of them changed, instead of walking the source tree.
+
+The cache is saved in the test root as
+.filter-test-results.<name>.json, one per test info file.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import json
+import os
+
+CACHE_VERSION = 1
+
+
+def get_report_cache_file(test_root, name):
+    """Location of the report cache for a test info file.
+    """
+    return os.path.join(test_root, ".filter-test-results.{0}.json".format(
+        name))
+
+
+def file_key(filename):
+    """[mtime, size] of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+class ReportCache(object):
+    """Status lines and diagnostics of the cases in a test root from the
+    previous report.
+
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._cache = {"version": CACHE_VERSION, "cases": {},
+                       "diagnostics": {}, "xfail_files": {}}
+        try:
+            with open(filename, 'r') as cfile:
+                data = json.load(cfile)
+            if data.get("version") == CACHE_VERSION:
+                self._cache = data
+        except (IOError, OSError, ValueError):
+            pass
+        # what this report used, saved for the next one. Cases and
+        # diagnostics that are no longer reported are dropped.
+        self._new = {"version": CACHE_VERSION, "cases": {},
+                     "diagnostics": {}, "xfail_files": {}}
+        # TestStatus keys of this report, each case is stat'ed once.
+        self._keys = {}
+
+    def case_key(self, case_path):
+        """[mtime, size] of the case's TestStatus file in this report.
+        """
+        if case_path not in self._keys:
+            self._keys[case_path] = file_key(
+                os.path.join(case_path, "TestStatus"))
+        return self._keys[case_path]
+
+    def refresh_case_key(self, case_path):
+        """Stat TestStatus again, e.g. after a diagnostic reran part of
+        the test and rewrote it.
+
+        """
+        self._keys.pop(case_path, None)
+
+    def case_records(self, case_path):
+        """Status records of a case from the previous report as lists of
+        fields, or None if the case changed since.
+
+        """
+        key = self.case_key(case_path)
+        cached = self._cache["cases"].get(case_path)
+        if key is None or cached is None or cached["key"] != key:
+            return None
+        self._new["cases"][case_path] = cached
+        return cached["records"]
+
+    def set_case_records(self, case_path, records):
+        key = self.case_key(case_path)
+        if key is None:
+            return
+        self._new["cases"][case_path] = {"key": key,
+                                         "records": [list(r) for r in records]}
+
+    def diagnostic(self, section, test, case_path):
+        """Text of the detailed diagnostics of a test from the previous
+        report, or None if they have to be regenerated.
+
+        """
+        if case_path is None:
+            return None
+        cached = self._cache["diagnostics"].get(section, {}).get(test)
+        if cached is None or cached["key"] != self.case_key(case_path):
+            return None
+        self._new["diagnostics"].setdefault(section, {})[test] = cached
+        return cached["text"]
+
+    def set_diagnostic(self, section, test, case_path, text):
+        if case_path is None or self.case_key(case_path) is None:
+            return
+        self._new["diagnostics"].setdefault(section, {})[test] = {
+            "key": self.case_key(case_path), "text": text}
+
+    def xfail_files(self, cimeroot):
+        """The ExpectedTestFails.xml files found for cimeroot by the
+        previous report, or None if any of them changed.
+
+        """
+        cached = self._cache["xfail_files"]
+        if not cached or cached.get("cimeroot") != cimeroot:
+            return None
+        for xfail_file, key in cached["files"].items():
+            if file_key(xfail_file) != key:
+                return None
+        self._new["xfail_files"] = cached
+        return sorted(cached["files"])
+
+    def set_xfail_files(self, cimeroot, xfail_files):
+        self._new["xfail_files"] = {
+            "cimeroot": cimeroot,
+            "files": dict((f, file_key(f)) for f in xfail_files)}
+
+    def save(self):
+        """Atomically replace the cache file. The cache is only an
+        optimization, so failures are ignored.
+
+        """
+        tmp_file = "{0}.{1}.tmp".format(self._filename, os.getpid())
+        try:
+            with open(tmp_file, 'w') as cfile:
+                json.dump(self._new, cfile, separators=(',', ':'),
+                          sort_keys=True)
+            os.rename(tmp_file, self._filename)
+        except (IOError, OSError):
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""Rerun the unfinished and failed tests of a cime test suite.
+
+cime-tests.py --rerun-from TEST_ROOT reads the testspec and TestStatus
+files of a previous test root and launches only the tests that did not
+finish or failed unexpectedly:
+
+    RUN : still running, or killed while running
+    PEND : never ran, e.g. the job was removed from the queue
+    CFAIL : configure or build failure
+    FAIL : failures that are not listed in an ExpectedTestFails.xml
+    (no TestStatus) : the case was never created
+
+The tests are launched into a new test root, which records where they
+came from in rerun.json. The combined status, the newest result of
+every test across the original test root and all of its reruns, is
+shown with:
+
+    cime_rerun.py --status NEW_TEST_ROOT
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+#
+# built-in modules
+#
+import argparse
+from collections import defaultdict
+import glob
+import json
+import os
+import re
+import traceback
+
+try:
+    import lxml.etree as etree
+except:
+    import xml.etree.ElementTree as etree
+
+#
+# other modules in this package
+#
+from cime_history import read_test_status, strip_case_suffix
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='show the combined status of a cime test root and the '
+        'test roots it was rerun from.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--status', nargs=1, required=True,
+                        help='path to the newest test root')
+
+    options = parser.parse_args()
+    return options
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+
+RERUN_NAME = "rerun.json"
+
+# overall test status that is always rerun. FAIL is only rerun when it
+# is not an expected failure.
+RERUN_STATUSES = ("RUN", "PEND", "CFAIL")
+
+# reported for cases in the testspec without a TestStatus file.
+MISSING_STATUS = "MISSING"
+
+TESTSPEC_RE = re.compile(r"^testspec\.(.+)\.([^.]+)\.xml$")
+
+
+def read_testspec(testspec):
+    """Return (testid, cimeroot, list of case directory names) from a
+    create_test testspec.<testid>.<machine>.xml file.
+
+    """
+    match = TESTSPEC_RE.match(os.path.basename(testspec))
+    if not match:
+        raise RuntimeError("Could not determine the testid of {0}".format(
+            testspec))
+    root = etree.parse(testspec).getroot()
+    cimeroot = root.findtext(".//cimeroot")
+    if cimeroot is not None:
+        cimeroot = cimeroot.strip()
+    cases = [os.path.basename(test.get('case'))
+             for test in root.iter('test') if test.get('case')]
+    return match.group(1), cimeroot, cases
+
+
+def read_test_root(test_root):
+    """Read every testspec in a test root and the TestStatus of its
+    cases. Returns (cimeroot, statuses) where statuses is a dict of
+    test name : {"status", "case_dir", "testid"}.
+
+    """
+    testspecs = sorted(glob.glob(os.path.join(test_root, "testspec*.xml")))
+    if not testspecs:
+        raise RuntimeError("No testspec xml files found in {0}".format(
+            test_root))
+    cimeroot = None
+    statuses = {}
+    for testspec in testspecs:
+        testid, spec_cimeroot, cases = read_testspec(testspec)
+        if cimeroot is None:
+            cimeroot = spec_cimeroot
+        for case_dir in cases:
+            test_name = case_dir
+            if test_name.endswith(".{0}".format(testid)):
+                test_name = test_name[:-len(testid) - 1]
+            test_name = strip_case_suffix(test_name)
+            status_file = os.path.join(test_root, case_dir, "TestStatus")
+            status = MISSING_STATUS
+            if os.path.isfile(status_file):
+                status = read_test_status(status_file) or MISSING_STATUS
+            statuses[test_name] = {"status": status, "case_dir": case_dir,
+                                   "testid": testid}
+    return cimeroot, statuses
+
+
+def select_rerun_tests(statuses, expected_fails):
+    """Return a dict of test name : status for the tests that should be
+    rerun. expected_fails is a cime_xfail.ExpectedFails index.
+
+    """
+    rerun = {}
+    for test_name in statuses:
+        status = statuses[test_name]["status"]
+        if status in RERUN_STATUSES or status == MISSING_STATUS:
+            rerun[test_name] = status
+        elif (status == "FAIL" and
+              not expected_fails.is_expected("FAIL", test_name)):
+            rerun[test_name] = status
+    return rerun
+
+
+def write_rerun_record(test_root, rerun_from, tests):
+    """Record which test root a rerun came from and the names of the
+    tests that were rerun.
+
+    """
+    rerun_file = os.path.join(test_root, RERUN_NAME)
+    with open(rerun_file, 'w') as rfile:
+        json.dump({"rerun_from": os.path.abspath(rerun_from),
+                   "tests": sorted(tests)}, rfile, indent=2, sort_keys=True)
+    return rerun_file
+
+
+def merge_rerun_status(test_root):
+    """Combine the status of a test root with the test roots it was
+    rerun from. The newest result of each test wins.
+
+    Returns a dict of test name : (status, test root).
+
+    """
+    chain = []
+    seen = set()
+    while test_root is not None:
+        test_root = os.path.abspath(test_root)
+        if test_root in seen:
+            break
+        seen.add(test_root)
+        chain.insert(0, test_root)
+        rerun_file = os.path.join(test_root, RERUN_NAME)
+        test_root = None
+        if os.path.isfile(rerun_file):
+            with open(rerun_file, 'r') as rfile:
+                test_root = json.load(rfile)["rerun_from"]
+
+    results = {}
+    for root in chain:
+        junk, statuses = read_test_root(root)
+        for test_name in statuses:
+            results[test_name] = (statuses[test_name]["status"], root)
+    return results
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+
+def main(options):
+    results = merge_rerun_status(options.status[0])
+    totals = defaultdict(int)
+    for test in sorted(results):
+        status, test_root = results[test]
+        totals[status] += 1
+        if options.debug:
+            print("{0} {1} : {2}".format(status, test, test_root))
+        else:
+            print("{0} {1}".format(status, test))
+    print("\nTotals :")
+    for status in sorted(totals):
+        print("  {0} : {1}".format(status, totals[status]))
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
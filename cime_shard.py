@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""Split the tests of one cime test suite across several machines.
+
+cime-tests.py --plan-shards expands the suite into its tests and
+assigns each test to one of the machines in the config file that can
+run its compiler, balancing the estimated cost on each machine. The
+plan directory contains:
+
+    manifest.json : the merge manifest, all machines and their tests
+    <machine>.<suite>.<compiler>.testlist : create_test test lists
+
+Each host then runs its share with 'cime-tests.py --shard PLAN_DIR',
+which records where the tests were launched in
+<machine>.launch.json. The results are combined with:
+
+    cime_shard.py --report PLAN_DIR
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+#
+# built-in modules
+#
+import argparse
+from collections import defaultdict
+import json
+import os
+import traceback
+
+#
+# other modules in this package
+#
+from cime_history import read_test_status
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='combine the results of a cime test suite that was '
+        'sharded across several machines.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--report', nargs=1, required=True,
+                        help='path to the shard plan directory')
+
+    options = parser.parse_args()
+    return options
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+
+MANIFEST_NAME = "manifest.json"
+
+
+def get_suite_machines(machine_configs, suite_name):
+    """Return a dict of machine : list of compilers for every machine in
+    the config file that can run the suite.
+
+    """
+    suite_compilers = "{0}_compilers".format(suite_name)
+    machines = {}
+    for machine in sorted(machine_configs):
+        if suite_compilers in machine_configs[machine]:
+            compilers = machine_configs[machine][suite_compilers].split(',')
+            machines[machine] = [c.strip() for c in compilers if c.strip()]
+    return machines
+
+
+def assign_tests(tests, machines, cost_function):
+    """Greedy longest-processing-time assignment: take the tests from
+    most to least expensive and give each one to the least loaded
+    machine that supports its compiler.
+
+    tests : list of (suite, CimeTest)
+    machines : dict of machine : list of compilers
+
+    Returns a dict of machine : {"cost": total, "tests": [(suite, test, cost)]}
+
+    """
+    costed = [(cost_function(test), suite, test) for suite, test in tests]
+    costed.sort(key=lambda entry: entry[0], reverse=True)
+
+    shards = {}
+    for machine in machines:
+        shards[machine] = {"cost": 0.0, "tests": []}
+    for cost, suite, test in costed:
+        candidates = [m for m in machines if test.compiler in machines[m]]
+        if not candidates:
+            print("WARNING: no machine can run compiler '{0}', skipping "
+                  "{1}".format(test.compiler, test.name()))
+            continue
+        machine = min(candidates,
+                      key=lambda m: (shards[m]["cost"], m))
+        shards[machine]["cost"] += cost
+        shards[machine]["tests"].append((suite, test, cost))
+    return shards
+
+
+def write_shard_plan(plan_dir, suite_name, suite_list, baseline_tag,
+                     generate_tag, shards):
+    """Write the per machine test lists and the merge manifest.
+    """
+    if not os.path.isdir(plan_dir):
+        os.makedirs(plan_dir)
+
+    manifest = {"suite_name": suite_name,
+                "suites": suite_list,
+                "baseline": baseline_tag,
+                "generate": generate_tag,
+                "machines": {}}
+    for machine in sorted(shards):
+        launches = defaultdict(list)
+        for suite, test, cost in shards[machine]["tests"]:
+            launches[(suite, test.compiler)].append(
+                test.name(machine, test.compiler))
+        machine_plan = {"estimated_cost": shards[machine]["cost"],
+                        "launches": []}
+        for suite, compiler in sorted(launches):
+            testfile = os.path.join(plan_dir, "{0}.{1}.{2}.testlist".format(
+                machine, suite, compiler))
+            with open(testfile, 'w') as tests:
+                for name in launches[(suite, compiler)]:
+                    print(name, file=tests)
+            machine_plan["launches"].append(
+                {"suite": suite, "compiler": compiler, "testfile": testfile,
+                 "tests": launches[(suite, compiler)]})
+        manifest["machines"][machine] = machine_plan
+
+    manifest_file = os.path.join(plan_dir, MANIFEST_NAME)
+    with open(manifest_file, 'w') as mfile:
+        json.dump(manifest, mfile, indent=2, sort_keys=True)
+    return manifest_file
+
+
+def read_shard_manifest(plan_dir):
+    """Load the merge manifest of a shard plan.
+    """
+    manifest_file = os.path.join(plan_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_file):
+        raise RuntimeError("Could not find shard manifest: {0}".format(
+            manifest_file))
+    with open(manifest_file, 'r') as mfile:
+        return json.load(mfile)
+
+
+def get_machine_shard(plan_dir, machine):
+    """Return a dict of (suite, compiler) : list of test names assigned to
+    machine by the shard plan.
+
+    """
+    manifest = read_shard_manifest(plan_dir)
+    if machine not in manifest["machines"]:
+        raise RuntimeError("Machine '{0}' is not part of the shard plan in "
+                           "{1}".format(machine, plan_dir))
+    shard = {}
+    for launch in manifest["machines"][machine]["launches"]:
+        shard[(launch["suite"], launch["compiler"])] = launch["tests"]
+    return shard
+
+
+def record_shard_launch(plan_dir, machine, test_root, testids):
+    """Record where a machine launched its shard so the results can be
+    merged. testids is a dict of "suite.compiler" : list of testids, one
+    per create_test launch.
+
+    """
+    launch_file = os.path.join(plan_dir, "{0}.launch.json".format(machine))
+    with open(launch_file, 'w') as lfile:
+        json.dump({"machine": machine, "test_root": test_root,
+                   "testids": testids}, lfile, indent=2, sort_keys=True)
+
+
+def merge_shard_results(plan_dir):
+    """Combine the TestStatus of every test in the plan into a single
+    dict of test name : status. Tests on machines that have not been
+    launched, or that have not written a TestStatus yet, are reported as
+    NOT_LAUNCHED and MISSING.
+
+    """
+    manifest = read_shard_manifest(plan_dir)
+    results = {}
+    for machine in sorted(manifest["machines"]):
+        launch_file = os.path.join(plan_dir, "{0}.launch.json".format(machine))
+        launch = None
+        if os.path.isfile(launch_file):
+            with open(launch_file, 'r') as lfile:
+                launch = json.load(lfile)
+        for entry in manifest["machines"][machine]["launches"]:
+            key = "{0}.{1}".format(entry["suite"], entry["compiler"])
+            for test in entry["tests"]:
+                if launch is None or key not in launch["testids"]:
+                    results[test] = "NOT_LAUNCHED"
+                    continue
+                status = "MISSING"
+                testids = launch["testids"][key]
+                if not isinstance(testids, list):
+                    # launch files written before admission waves.
+                    testids = [testids]
+                case_dirs = []
+                for testid in testids:
+                    case_dirs.extend(["{0}.{1}".format(test, testid),
+                                      "{0}.C.{1}".format(test, testid)])
+                for case_dir in case_dirs:
+                    status_file = os.path.join(launch["test_root"], case_dir,
+                                               "TestStatus")
+                    if os.path.isfile(status_file):
+                        status = read_test_status(status_file)
+                        break
+                results[test] = status
+    return results
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+
+def main(options):
+    plan_dir = options.report[0]
+    results = merge_shard_results(plan_dir)
+    totals = defaultdict(int)
+    for test in sorted(results):
+        totals[results[test]] += 1
+        print("{0} {1}".format(results[test], test))
+    print("\nTotals :")
+    for status in sorted(totals):
+        print("  {0} : {1}".format(status, totals[status]))
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Collect the status of the cases in a cime test root without running
+cs.status.
+
+The testspec xml files list the case directories. Each case's
+TestStatus file gives one line per test phase or comparison:
+
+    PASS ERS_D.f10_f10.ICLM45BGC.yellowstone_intel.clm-default
+    PASS ERS_D.f10_f10.ICLM45BGC.yellowstone_intel.clm-default.memleak
+    FAIL ERS_D.f10_f10.ICLM45BGC.yellowstone_intel.clm-default.compare_hist
+
+and CASEBASEID comes from env_case.xml, instead of starting xmlquery
+in every case. The cases are read by a pool of threads and returned as
+StatusRecords in memory. With a ReportCache, only the cases whose
+TestStatus changed since the previous report are read.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+from collections import namedtuple
+import glob
+from multiprocessing.pool import ThreadPool
+import os
+
+try:
+    import lxml.etree as etree
+except:
+    import xml.etree.ElementTree as etree
+
+from cime_rerun import read_testspec
+
+
+# one "STATUS name" line of a TestStatus file.
+StatusRecord = namedtuple("StatusRecord",
+                          ["status", "test", "case_dir", "case_base_id"])
+
+DEFAULT_NUM_THREADS = 8
+
+
+def find_testspecs(test_root, testid=None):
+    """Return the testspec files to report on: the ones for testid, or a
+    list of testids, if given and present, otherwise the newest testspec
+    in the test root, the same default as cs.status.
+
+    """
+    if testid:
+        testids = testid if isinstance(testid, list) else [testid]
+        testspecs = []
+        for name in testids:
+            testspecs.extend(sorted(glob.glob(os.path.join(
+                test_root, "testspec.{0}.*.xml".format(name)))))
+        if testspecs:
+            return testspecs
+    testspecs = glob.glob(os.path.join(test_root, "testspec*.xml"))
+    if not testspecs:
+        raise RuntimeError("No testspec xml files found in {0}".format(
+            test_root))
+    return [max(testspecs, key=os.path.getmtime)]
+
+
+def read_case_base_id(case_path):
+    """CASEBASEID of a case from env_case.xml, or None.
+    """
+    env_case = os.path.join(case_path, "env_case.xml")
+    if not os.path.isfile(env_case):
+        return None
+    for entry in etree.parse(env_case).getroot().iter('entry'):
+        if entry.get('id') == "CASEBASEID":
+            return entry.get('value')
+    return None
+
+
+def read_case_status(case_path):
+    """Return the StatusRecords of one case, empty if it does not have a
+    TestStatus file yet.
+
+    """
+    status_file = os.path.join(case_path, "TestStatus")
+    if not os.path.isfile(status_file):
+        return []
+    case_dir = os.path.basename(case_path)
+    case_base_id = read_case_base_id(case_path)
+    records = []
+    with open(status_file, 'r') as status_lines:
+        for line in status_lines:
+            fields = line.split()
+            if len(fields) == 2:
+                records.append(StatusRecord(fields[0], fields[1], case_dir,
+                                            case_base_id))
+    return records
+
+
+def _read_cached_case_status(args):
+    """read_case_status, reusing the records from the report cache when
+    the case did not change. Returns (records, reused).
+
+    """
+    case_path, report_cache = args
+    if report_cache is not None:
+        cached = report_cache.case_records(case_path)
+        if cached is not None:
+            # json gives unicode strings on python 2.
+            return [StatusRecord(*[f if f is None else str(f)
+                                   for f in fields])
+                    for fields in cached], True
+    records = read_case_status(case_path)
+    if report_cache is not None:
+        report_cache.set_case_records(case_path, records)
+    return records, False
+
+
+def collect_test_status(testspecs, num_threads=DEFAULT_NUM_THREADS,
+                        report_cache=None):
+    """Read the status of every case listed in the testspec files.
+
+    Returns (cimeroot, records, number of cases reused from the
+    report_cache) with the records of each case in testspec order.
+
+    """
+    cimeroot = None
+    case_paths = []
+    for testspec in testspecs:
+        test_root = os.path.dirname(os.path.abspath(testspec))
+        junk, spec_cimeroot, case_dirs = read_testspec(testspec)
+        if cimeroot is None:
+            cimeroot = spec_cimeroot
+        case_paths.extend(os.path.join(test_root, case_dir)
+                          for case_dir in case_dirs)
+
+    pool = ThreadPool(max(1, num_threads))
+    try:
+        case_records = pool.map(_read_cached_case_status,
+                                [(case_path, report_cache)
+                                 for case_path in case_paths])
+    finally:
+        pool.close()
+        pool.join()
+    records = []
+    reused = 0
+    for case, case_reused in case_records:
+        records.extend(case)
+        reused += case_reused
+    return cimeroot, records, reused
+
+
+def remove_known_failures(records, expected_fails):
+    """Apply the ExpectedTestFails.xml entries the way cs.status does:
+    expected failures (KTF) are dropped, and passes of tests that are
+    expected to fail get the status UPASS.
+
+    Returns (records, known failures).
+
+    """
+    kept = []
+    known = []
+    for record in records:
+        xfail = expected_fails.match(record.status, record.test)
+        if xfail is None:
+            kept.append(record)
+        elif xfail.status == record.status:
+            if record.status in ("PASS", "DONE"):
+                kept.append(record)
+            else:
+                known.append(record)
+        elif record.status in ("PASS", "DONE"):
+            kept.append(record._replace(status="U" + record.status))
+        else:
+            kept.append(record)
+    return kept, known
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Scan the TestStatus.out log of a cime test case for its comparison
+blocks.
+
+TestStatus.out records each comparison the test made, e.g.
+
+    Comparing hist file with baseline hist file
+    ...
+    compare_hist: see .../cprnc.out
+    hist file comparison is FAIL
+
+The log is read once, line by line, and every block is returned with
+its kind, status, lines and the cprnc.out files it mentions:
+
+    baseline_hist : history files compared to the baseline
+    restart_hist : initial and second run (restart, threading, ...) history
+    memleak : memory leak check
+    memcomp : memory highwater compared to the baseline
+    tputcomp : throughput compared to the baseline
+    nlcomp : namelists compared to the baseline
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+from collections import namedtuple
+import os
+import re
+
+STATUS_OUT_NAME = "TestStatus.out"
+
+# kind, start of block. The first match wins.
+BLOCK_STARTS = (
+    ("baseline_hist",
+     re.compile(r"Comparing hist file with baseline hist file")),
+    ("restart_hist",
+     re.compile(r"Comparing initial hist file with second hist file")),
+    ("memleak", re.compile(r"memleak", re.IGNORECASE)),
+    ("memcomp", re.compile(r"memcomp|memory highwater", re.IGNORECASE)),
+    ("tputcomp", re.compile(r"tputcomp|throughput", re.IGNORECASE)),
+    ("nlcomp", re.compile(r"nlcomp|comparing namelist", re.IGNORECASE)),
+)
+
+FAIL_RE = re.compile(r"\bFAIL\b")
+PASS_RE = re.compile(r"\bPASS\b")
+CPRNC_RE = re.compile(r"(\S*cprnc\.out)\b")
+
+# one comparison from TestStatus.out. status is PASS, FAIL or None if
+# the block did not finish.
+ComparisonBlock = namedtuple("ComparisonBlock",
+                             ["kind", "status", "lines", "cprnc_files"])
+
+
+def _block_kind(line):
+    for kind, start_re in BLOCK_STARTS:
+        if start_re.search(line):
+            return kind
+    return None
+
+
+def scan_status_output(lines, case_dir=None):
+    """Return the ComparisonBlocks of an iterable of TestStatus.out
+    lines in the order they appear. Relative cprnc.out paths are
+    resolved against case_dir.
+
+    """
+    blocks = []
+    kind = None
+    block_lines = []
+    cprnc_files = []
+
+    def add_cprnc(line):
+        for match in CPRNC_RE.finditer(line):
+            cprnc_file = match.group(1)
+            if case_dir and not os.path.isabs(cprnc_file):
+                cprnc_file = os.path.join(case_dir, cprnc_file)
+            if cprnc_file not in cprnc_files:
+                cprnc_files.append(cprnc_file)
+
+    for line in lines:
+        line = line.rstrip()
+        if kind is None:
+            kind = _block_kind(line)
+            if kind is None:
+                continue
+            block_lines = []
+            cprnc_files = []
+        block_lines.append(line)
+        add_cprnc(line)
+        status = None
+        if FAIL_RE.search(line):
+            status = "FAIL"
+        elif PASS_RE.search(line):
+            status = "PASS"
+        if status is not None:
+            blocks.append(ComparisonBlock(kind, status, block_lines,
+                                          cprnc_files))
+            kind = None
+    if kind is not None:
+        blocks.append(ComparisonBlock(kind, None, block_lines, cprnc_files))
+    return blocks
+
+
+def read_status_output(case_dir):
+    """ComparisonBlocks of a case's TestStatus.out, None if the case does
+    not have one.
+
+    """
+    status_out = os.path.join(case_dir, STATUS_OUT_NAME)
+    if not os.path.isfile(status_out):
+        return None
+    with open(status_out, 'r') as status_lines:
+        return scan_status_output(status_lines, case_dir)
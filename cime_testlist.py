@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Reusable code to expand cime test suites into individual tests from
+the component testlist xml files, and to select the tests affected by
+the changes in a sandbox.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import glob
+import os
+import os.path
+import re
+import subprocess
+
+try:
+    import lxml.etree as etree
+except:
+    import xml.etree.ElementTree as etree
+
+
+# testlist files for the different cesm/cime layouts, relative to the
+# source root.
+TESTLIST_GLOBS = ['components/*/cime_config/testdefs/testlist*.xml',
+                  'cime/cime_config/*/allactive/testlist*.xml',
+]
+
+# testmods directories for the different cesm/cime layouts, relative to
+# the source root. Each contains component/testmod directories.
+TESTMODS_GLOBS = ['components/*/cime_config/testdefs/testmods_dirs',
+                  'components/*/cimetest/testmods_dirs',
+]
+
+TESTMODS_RE = re.compile(r"(^|/)testmods_dirs/([^/]+/[^/]+)/")
+
+# changes to these files never change test results.
+IGNORED_CHANGE_RE = re.compile(
+    r"(^|/)(README[^/]*|ChangeLog[^/]*|ChangeSum|[^/]+\.md|doc/.*)$")
+
+
+class CimeTest(object):
+    """A single test from a testlist.
+    """
+
+    def __init__(self, test, grid, compset, machine, compiler,
+                 category, testmods=None):
+        self.test = test
+        self.grid = grid
+        self.compset = compset
+        self.machine = machine
+        self.compiler = compiler
+        self.category = category
+        self.testmods = testmods
+
+    def name(self, machine=None, compiler=None):
+        """Full create_test name:
+        test.grid.compset.machine_compiler[.component-testmod]
+
+        The machine and compiler can be overridden for testlists stored
+        under a pseudo machine, e.g. xml_machine = ed.
+
+        """
+        if machine is None:
+            machine = self.machine
+        if compiler is None:
+            compiler = self.compiler
+        name = "{0}.{1}.{2}.{3}_{4}".format(self.test, self.grid,
+                                           self.compset, machine, compiler)
+        if self.testmods:
+            name += ".{0}".format(self.testmods.replace('/', '-'))
+        return name
+
+    def __repr__(self):
+        return self.name()
+
+
+def parse_test_name(test_name):
+    """Convert a full test name back into a CimeTest. The category is
+    not part of the name and is None.
+
+    """
+    fields = test_name.split('.')
+    if len(fields) < 4 or '_' not in fields[3]:
+        raise RuntimeError("Invalid test name '{0}'".format(test_name))
+    machine, compiler = fields[3].rsplit('_', 1)
+    testmods = None
+    if len(fields) > 4:
+        testmods = ".".join(fields[4:]).replace('-', '/', 1)
+    return CimeTest(fields[0], fields[1], fields[2], machine, compiler,
+                    None, testmods)
+
+
+def find_testlist_files(src_root):
+    """Return all the testlist xml files in the sandbox.
+    """
+    testlists = []
+    for pattern in TESTLIST_GLOBS:
+        testlists.extend(sorted(glob.glob(os.path.join(src_root, pattern))))
+    return testlists
+
+
+def read_testlist(filename):
+    """Read all tests from a testlist xml file. Supports the original
+    nested format:
+
+        <testlist>
+          <compset name=><grid name=><test name=>
+            <machine compiler= testtype= testmods=>yellowstone</machine>
+
+    and the version 2 format:
+
+        <testlist version="2.0">
+          <test name= grid= compset= testmods=>
+            <machines><machine name= compiler= category=/></machines>
+
+    """
+    tests = []
+    root = etree.parse(filename).getroot()
+    if root.get('version', '1').startswith('1'):
+        for compset in root.findall('compset'):
+            for grid in compset.findall('grid'):
+                for test in grid.findall('test'):
+                    for machine in test.findall('machine'):
+                        tests.append(CimeTest(
+                            test.get('name'), grid.get('name'),
+                            compset.get('name'), machine.text.strip(),
+                            machine.get('compiler'), machine.get('testtype'),
+                            machine.get('testmods')))
+    else:
+        for test in root.findall('test'):
+            for machine in test.findall('machines/machine'):
+                tests.append(CimeTest(
+                    test.get('name'), test.get('grid'), test.get('compset'),
+                    machine.get('name'), machine.get('compiler'),
+                    machine.get('category'), test.get('testmods')))
+    return tests
+
+
+def get_suite_tests(src_root, suite, machine, compiler):
+    """Expand a suite (testlist category) into the tests for one machine
+    and compiler.
+
+    """
+    tests = []
+    for testlist in find_testlist_files(src_root):
+        for test in read_testlist(testlist):
+            if (test.category == suite and test.machine == machine and
+                    test.compiler == compiler):
+                tests.append(test)
+    return tests
+
+
+def get_changed_files(src_root, base_revision=None):
+    """List the files changed in the sandbox relative to base_revision,
+    as paths relative to the source root. Uses git for git sandboxes and
+    svn otherwise. Without a base revision, only uncommitted changes are
+    reported.
+
+    """
+    if os.path.isdir(os.path.join(src_root, '.git')) or _in_git(src_root):
+        if base_revision is None:
+            base_revision = 'HEAD'
+        changed = _run(['git', 'diff', '--name-only', '--relative',
+                        base_revision], src_root)
+        changed += _run(['git', 'ls-files', '--others', '--exclude-standard'],
+                        src_root)
+    else:
+        if base_revision is None:
+            command = ['svn', 'status', '-q']
+        else:
+            command = ['svn', 'diff', '--summarize', '-r', base_revision]
+        changed = []
+        for line in _run(command, src_root):
+            if line[:1] and line[0] in 'ACDMR':
+                changed.append(line[8:].strip())
+    changed = [os.path.normpath(c.strip()) for c in changed if c.strip()]
+    return sorted(set(changed))
+
+
+def _in_git(directory):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            status = subprocess.call(['git', 'rev-parse', '--git-dir'],
+                                     cwd=directory, stdout=devnull,
+                                     stderr=devnull)
+    except OSError:
+        return False
+    return status == 0
+
+
+def _run(command, cwd):
+    """Run a version control command and return its output lines.
+    """
+    try:
+        output = subprocess.check_output(command, cwd=cwd)
+    except (OSError, subprocess.CalledProcessError) as error:
+        raise RuntimeError("ERROR: could not determine sandbox changes "
+                           "with '{0}' : {1}".format(" ".join(command),
+                                                     error))
+    return output.decode('utf-8', 'replace').splitlines()
+
+
+def get_testmods_dependents(src_root):
+    """Build a map from each testmod, e.g. 'clm/default', to the set of
+    testmods that include it directly or indirectly through
+    include_user_mods. Every testmod depends on itself.
+
+    """
+    includes = {}
+    for pattern in TESTMODS_GLOBS:
+        for testmods_dir in glob.glob(os.path.join(src_root, pattern)):
+            for mod_dir in glob.glob(os.path.join(testmods_dir, '*', '*')):
+                if not os.path.isdir(mod_dir):
+                    continue
+                mod = os.path.relpath(mod_dir, testmods_dir).replace(os.sep, '/')
+                includes.setdefault(mod, set())
+                include_file = os.path.join(mod_dir, 'include_user_mods')
+                if not os.path.isfile(include_file):
+                    continue
+                with open(include_file, 'r') as include:
+                    for line in include:
+                        line = line.strip()
+                        if not line or line.startswith('#'):
+                            continue
+                        parent = os.path.normpath(os.path.join(mod_dir, line))
+                        parent = os.path.relpath(parent, testmods_dir)
+                        includes[mod].add(parent.replace(os.sep, '/'))
+
+    dependents = {}
+    for mod in includes:
+        dependents.setdefault(mod, set()).add(mod)
+        # walk up the include chain of each mod
+        stack = list(includes[mod])
+        seen = set()
+        while stack:
+            parent = stack.pop()
+            if parent in seen:
+                continue
+            seen.add(parent)
+            dependents.setdefault(parent, set()).add(mod)
+            stack.extend(includes.get(parent, []))
+    return dependents
+
+
+def get_affected_testmods(src_root, changed_files):
+    """Map changed files to the testmods they affect.
+
+    Returns (testmods, unmapped) where testmods is the set of affected
+    testmods and unmapped is the list of changed files that could affect
+    any test, e.g. source code or compset definitions. If unmapped is
+    not empty, the whole suite has to be run.
+
+    """
+    dependents = None
+    testmods = set()
+    unmapped = []
+    for changed in changed_files:
+        changed = changed.replace(os.sep, '/')
+        if IGNORED_CHANGE_RE.search(changed):
+            continue
+        match = TESTMODS_RE.search(changed)
+        if match:
+            if dependents is None:
+                dependents = get_testmods_dependents(src_root)
+            mod = match.group(2)
+            testmods.update(dependents.get(mod, set([mod])))
+        else:
+            unmapped.append(changed)
+    return testmods, unmapped
+
+
+def select_affected_tests(tests, testmods):
+    """Return the subset of tests that use one of the affected testmods.
+    """
+    return [t for t in tests if t.testmods and t.testmods in testmods]
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+"""Watch the progress of a running cime test suite.
+
+    cime_watch.py --test-root ${SCRATCH}/tests-clm-20150910-1723
+
+prints the number of tests in each phase, and the tests that finished,
+every time something changes:
+
+    17:42:10  GEN 0  PEND 12  RUN 30  PASS 81  FAIL 2  : ETA 0:24:00
+
+Rerunning cs.status re-parses every testspec and opens every TestStatus
+file each time. Instead, the cases are kept in an in-memory index and a
+TestStatus file is only read again when its modification time or size
+changed. On linux, inotify reports which case directories were written
+to, so a refresh only looks at the cases that changed. Elsewhere, or
+when inotify watches run out, every TestStatus file is checked with a
+single stat call per refresh.
+
+The ETA is the longest expected remaining run time of the unfinished
+tests, from the run history or the cost model of cime_estimate.py. It
+does not include time waiting in the batch queue.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+#
+# built-in modules
+#
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import os
+import struct
+import time
+import traceback
+
+#
+# other modules in this package
+#
+from cime_history import open_history, read_test_status, strip_case_suffix
+from cime_rerun import TESTSPEC_RE, read_testspec
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='watch the progress of a running cime test suite.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--test-root', nargs=1, required=True,
+                        help='path to the test root of the suite')
+
+    parser.add_argument('--interval', nargs=1, type=float, default=[30.0],
+                        help='seconds between refreshes')
+
+    parser.add_argument('--once', action='store_true',
+                        help='print the current status and exit')
+
+    parser.add_argument('--no-history', action='store_true',
+                        help='estimate the ETA without the run history')
+
+    parser.add_argument('--no-inotify', action='store_true',
+                        help='always check the TestStatus files with stat')
+
+    options = parser.parse_args()
+    return options
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+
+STATUS_NAME = "TestStatus"
+
+# reported for cases in a testspec that do not have a TestStatus yet.
+GEN_STATUS = "GEN"
+
+# phases that are always shown, in order. Other statuses, e.g. CFAIL,
+# are shown after them when they occur.
+PHASES = ("GEN", "PEND", "RUN", "PASS", "FAIL")
+
+UNFINISHED_STATUSES = ("GEN", "PEND", "RUN")
+
+
+class Inotify(object):
+    """Minimal linux inotify interface through ctypes. read_events()
+    never blocks.
+
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        """Return the watch descriptor for path, or raise OSError, e.g.
+        when the user's watch limit is reached.
+
+        """
+        wd = self._libc.inotify_add_watch(self._fd, path.encode('utf-8'),
+                                          mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed",
+                          path)
+        return wd
+
+    def read_events(self):
+        """Return a list of (watch descriptor, mask, name) for all pending
+        events.
+
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, junk, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, name.decode('utf-8', 'replace')))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def get_inotify():
+    """Return an Inotify instance, or None where inotify is not
+    available.
+
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return Inotify()
+    except (OSError, AttributeError):
+        return None
+
+
+class CaseState(object):
+    """What is known about one case of the test root.
+    """
+
+    def __init__(self, test_name, case_dir):
+        self.test_name = test_name
+        self.case_dir = case_dir
+        self.status = GEN_STATUS
+        self.stat_key = None
+        # modification time of the TestStatus file when the current
+        # status was first seen.
+        self.status_time = None
+
+
+class TestStatusIndex(object):
+    """In-memory index of the overall status of every case in a test
+    root, kept up to date by refresh().
+
+    Cases come from the testspec files; each testspec is parsed once
+    when it appears. A TestStatus file is only re-read when the
+    (modification time, size) from stat changed. With inotify, only the
+    case directories that reported a write are stat'ed.
+
+    """
+
+    def __init__(self, test_root, inotify=None):
+        self.test_root = os.path.abspath(test_root)
+        self.cases = {}
+        self._testspecs = set()
+        self._inotify = inotify
+        self._watches = {}
+        self._watched = set()
+        # cases without an inotify watch, stat'ed on every refresh.
+        self._unwatched = set()
+        self._dirty = set()
+        self._new = []
+        self._scan_root = True
+        if self._inotify is not None:
+            self._inotify.add_watch(
+                self.test_root, Inotify.IN_CREATE | Inotify.IN_MOVED_TO |
+                Inotify.IN_CLOSE_WRITE)
+
+    def refresh(self):
+        """Bring the index up to date. Returns the list of cases that are
+        new or whose status changed.
+
+        """
+        if self._inotify is not None:
+            self._read_events()
+        else:
+            self._scan_root = True
+            self._dirty.update(self.cases)
+
+        if self._scan_root:
+            self._scan_root = False
+            self._read_testspecs()
+        self._dirty.update(self._unwatched)
+
+        changed, self._new = self._new, []
+        dirty, self._dirty = self._dirty, set()
+        for case_dir in dirty:
+            case = self.cases.get(case_dir)
+            if (case is not None and self._update_case(case) and
+                    case not in changed):
+                changed.append(case)
+        return changed
+
+    def counts(self):
+        """Number of cases in each status.
+        """
+        counts = {}
+        for case in self.cases.values():
+            counts[case.status] = counts.get(case.status, 0) + 1
+        return counts
+
+    def _read_events(self):
+        for wd, mask, name in self._inotify.read_events():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                # events were lost, check everything.
+                self._scan_root = True
+                self._dirty.update(self.cases)
+            elif wd in self._watches:
+                if name == STATUS_NAME:
+                    self._dirty.add(self._watches[wd])
+            elif TESTSPEC_RE.match(name):
+                self._scan_root = True
+            elif name in self.cases and mask & Inotify.IN_ISDIR:
+                # the case directory was created after its testspec.
+                self._watch_case(name)
+                self._dirty.add(name)
+
+    def _read_testspecs(self):
+        for name in sorted(os.listdir(self.test_root)):
+            if name in self._testspecs or not TESTSPEC_RE.match(name):
+                continue
+            try:
+                testid, junk, case_dirs = read_testspec(
+                    os.path.join(self.test_root, name))
+            except Exception:
+                # still being written, retry on the next event.
+                continue
+            self._testspecs.add(name)
+            for case_dir in case_dirs:
+                if case_dir in self.cases:
+                    continue
+                test_name = case_dir
+                if test_name.endswith(".{0}".format(testid)):
+                    test_name = test_name[:-len(testid) - 1]
+                self.cases[case_dir] = CaseState(
+                    strip_case_suffix(test_name), case_dir)
+                self._new.append(self.cases[case_dir])
+                self._watch_case(case_dir)
+                self._dirty.add(case_dir)
+
+    def _watch_case(self, case_dir):
+        if self._inotify is None or case_dir in self._watched:
+            return
+        path = os.path.join(self.test_root, case_dir)
+        if not os.path.isdir(path):
+            # the test root watch reports when it is created.
+            return
+        try:
+            wd = self._inotify.add_watch(
+                path, Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO |
+                Inotify.IN_CREATE)
+        except OSError:
+            self._unwatched.add(case_dir)
+            return
+        self._watches[wd] = case_dir
+        self._watched.add(case_dir)
+        self._unwatched.discard(case_dir)
+
+    def _update_case(self, case):
+        """Re-read the TestStatus of a case if it changed on disk. Returns
+        True if the status changed.
+
+        """
+        status_file = os.path.join(self.test_root, case.case_dir,
+                                   STATUS_NAME)
+        try:
+            stat = os.stat(status_file)
+        except OSError:
+            return False
+        stat_key = (stat.st_mtime, stat.st_size)
+        if stat_key == case.stat_key:
+            return False
+        case.stat_key = stat_key
+        status = read_test_status(status_file) or GEN_STATUS
+        if status == case.status:
+            return False
+        case.status = status
+        case.status_time = stat.st_mtime
+        return True
+
+
+def expected_wall_seconds(test_name, history=None):
+    """Expected wall clock time of a test from the run history, or from
+    the cost model when the test has never been run.
+
+    """
+    from cime_estimate import estimate_test_cost
+    from cime_testlist import parse_test_name
+    try:
+        test = parse_test_name(test_name)
+    except RuntimeError:
+        return None
+    junk, wall_seconds, junk = estimate_test_cost(test, test.machine,
+                                                  test.compiler, history)
+    return wall_seconds
+
+
+def estimate_remaining(cases, expected, now):
+    """Longest expected remaining run time of the unfinished cases, in
+    seconds. Running tests are credited with the time since their
+    TestStatus changed to RUN.
+
+    """
+    remaining = 0.0
+    for case in cases:
+        if case.status not in UNFINISHED_STATUSES:
+            continue
+        wall_seconds = expected.get(case.test_name)
+        if wall_seconds is None:
+            continue
+        if case.status == "RUN" and case.status_time is not None:
+            wall_seconds -= now - case.status_time
+        remaining = max(remaining, wall_seconds)
+    return remaining
+
+
+def format_counts(counts):
+    """One line summary of the number of cases in each phase.
+    """
+    phases = list(PHASES) + sorted(s for s in counts if s not in PHASES)
+    return "  ".join("{0} {1}".format(p, counts.get(p, 0)) for p in phases)
+
+
+def launches_finished(test_root):
+    """True if the launch manifest of the test root says every
+    create_test has exited, False if one is still running and None if
+    there is no manifest.
+
+    """
+    from cime_manifest import read_launch_manifest
+    manifest = read_launch_manifest(test_root)
+    if manifest is None:
+        return None
+    return all(launch["end_time"] is not None
+               for launch in manifest["launches"])
+
+
+def suite_finished(counts, test_root):
+    """The suite is finished when no test is pending or running and
+    create_test will not create any more cases. Cases that are still
+    missing once create_test has exited were never created.
+
+    """
+    if not counts or counts.get("PEND", 0) or counts.get("RUN", 0):
+        return False
+    finished = launches_finished(test_root)
+    if counts.get(GEN_STATUS, 0):
+        return finished is True
+    return finished is not False
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+
+def main(options):
+    test_root = options.test_root[0]
+    if not os.path.isdir(test_root):
+        raise RuntimeError("Test root does not exist: {0}".format(test_root))
+
+    inotify = None
+    if not options.no_inotify:
+        inotify = get_inotify()
+    history = None
+    if not options.no_history:
+        history = open_history()
+    if options.debug:
+        print("Watching {0} using {1}".format(
+            os.path.abspath(test_root), "inotify" if inotify else "stat"))
+
+    index = TestStatusIndex(test_root, inotify)
+    expected = {}
+    try:
+        while True:
+            changed = index.refresh()
+            for case in sorted(changed, key=lambda c: c.test_name):
+                if case.test_name not in expected:
+                    expected[case.test_name] = expected_wall_seconds(
+                        case.test_name, history)
+                if case.status not in UNFINISHED_STATUSES:
+                    print("{0} {1}".format(case.status, case.test_name))
+                elif options.debug:
+                    print("{0} {1}".format(case.status, case.test_name))
+
+            counts = index.counts()
+            unfinished = sum(counts.get(s, 0) for s in UNFINISHED_STATUSES)
+            if changed or options.once:
+                now = time.time()
+                line = "{0}  {1}".format(time.strftime("%H:%M:%S"),
+                                         format_counts(counts))
+                if unfinished:
+                    remaining = estimate_remaining(index.cases.values(),
+                                                   expected, now)
+                    line += "  : ETA {0}".format(
+                        datetime.timedelta(seconds=int(remaining)))
+                print(line)
+                sys.stdout.flush()
+
+            if options.once:
+                break
+            if suite_finished(counts, test_root):
+                print("All {0} tests finished.".format(len(index.cases)))
+                break
+            time.sleep(options.interval[0])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if inotify is not None:
+            inotify.close()
+        if history is not None:
+            history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Expected test failures, indexed for fast lookup.
+
+Expected failures are listed in ExpectedTestFails.xml files throughout
+the source tree, one status and test name per entry:
+
+    <entry bugz="1234">FAIL ERS_D.f10_f10.ICLM45BGC.yellowstone_intel.clm-default</entry>
+
+An entry covers a status line when its test name is the name on the
+line, or a prefix of it made of whole dot separated fields, e.g. the
+entry above also covers the comparison line
+
+    FAIL ERS_D.f10_f10.ICLM45BGC.yellowstone_intel.clm-default.compare_hist
+
+The entries are loaded once into a trie keyed by those fields, so a
+lookup costs one step per field of the test name no matter how many
+expected failures there are. cs.status uses the same matching rules.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import os
+
+try:
+    import lxml.etree as etree
+except:
+    import xml.etree.ElementTree as etree
+
+
+XFAIL_NAME = "ExpectedTestFails.xml"
+
+
+class ExpectedFail(object):
+    """A single expected failure.
+    """
+
+    def __init__(self, status, test_name, bugz=None):
+        self.status = status
+        self.test_name = test_name
+        self.bugz = bugz
+
+    def __repr__(self):
+        return "{0} {1}".format(self.status, self.test_name)
+
+
+class _TrieNode(object):
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children = {}
+        self.entries = []
+
+
+class ExpectedFails(object):
+    """Index of expected failures by the dot separated fields of the test
+    name.
+
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        """All expected failures, in the order they were added.
+        """
+        return list(self._entries)
+
+    def add(self, status, test_name, bugz=None):
+        xfail = ExpectedFail(status, test_name, bugz)
+        node = self._root
+        for field in test_name.split('.'):
+            node = node.children.setdefault(field, _TrieNode())
+        node.entries.append(xfail)
+        self._entries.append(xfail)
+        return xfail
+
+    def match(self, status, test_name):
+        """Return the expected failure covering a status line, or None.
+
+        An entry for exactly this test name matches whatever its status,
+        preferring one with the same status, so the caller can detect a
+        change of failure mode or an unexpected pass. An entry for a
+        prefix of the name only matches the same status, the longest
+        prefix wins.
+
+        """
+        node = self._root
+        found = None
+        fields = test_name.split('.')
+        for depth, field in enumerate(fields):
+            node = node.children.get(field)
+            if node is None:
+                break
+            if depth == len(fields) - 1:
+                if node.entries:
+                    for xfail in node.entries:
+                        if xfail.status == status:
+                            return xfail
+                    return node.entries[0]
+            else:
+                for xfail in node.entries:
+                    if xfail.status == status:
+                        found = xfail
+                        break
+        return found
+
+    def is_expected(self, status, test_name):
+        """True if the status of the test is an expected failure.
+        """
+        xfail = self.match(status, test_name)
+        return xfail is not None and xfail.status == status
+
+
+def find_expected_fails_files(cimeroot):
+    """Search the source tree containing cimeroot for expected failure
+    files, the same locations cs.status uses.
+
+    """
+    xfail_files = []
+    if not cimeroot:
+        return xfail_files
+    search_dir = os.path.abspath(os.path.join(cimeroot, os.pardir))
+    for root, dirs, files in os.walk(search_dir):
+        # skip version control metadata
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        if XFAIL_NAME in files:
+            xfail_files.append(os.path.join(root, XFAIL_NAME))
+    return sorted(xfail_files)
+
+
+def read_expected_fails(xfail_files, expected_fails=None):
+    """Read the expected failures from ExpectedTestFails.xml files into
+    an ExpectedFails index.
+
+    """
+    if expected_fails is None:
+        expected_fails = ExpectedFails()
+    for xfail_file in xfail_files:
+        root = etree.parse(xfail_file).getroot()
+        for entry in root.iter('entry'):
+            fields = (entry.text or '').split()
+            if len(fields) == 2:
+                expected_fails.add(fields[0], fields[1], entry.get('bugz'))
+    return expected_fails
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""Summarize cprnc.out, the output of the cprnc netcdf comparison tool.
+
+cprnc.out for high resolution history files can be hundreds of MB, so
+it is parsed in a single streaming pass that only keeps the fields
+that differ. For each field in a block like:
+
+  DIFFERENT  TSA  (lndgrid,time)  t_index =      1     1
+     1  4231  4231  1432  3.0E+02  2.1E+02  7.2E+01  2.9E+02  2.9E-01  2.2E+02
+        4231  4231  1432  3.0E+02  2.1E+02           2.1E+02           2.9E+02
+        (  3233)  (  3233)  (  4011)  (  4011)
+        avg abs field values:  2.5E+02  rms diff: 4.3E-03  avg rel diff(npos):  7.4E-03
+ RMS TSA                             4.3043E-03            NORMALIZED  1.6878E-02
+
+the summary keeps the name, dimensions, maximum difference, RMS,
+normalized RMS and the index line with the location of the maximum.
+Fields are sorted by severity, largest normalized RMS first.
+
+The summary is cached as cprnc.out.summary.json next to cprnc.out and
+reused until cprnc.out changes, so rerunning a report, or looking at
+the same file for the history and restart checks, does not parse it
+again.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import json
+import os
+import re
+
+SUMMARY_SUFFIX = ".summary.json"
+
+SUMMARY_VERSION = 1
+
+FLOAT_RE = re.compile(r"^[-+]?(\d+\.\d*|\.\d+|\d+)([eEdD][-+]?\d+)?$")
+DIFFERENT_RE = re.compile(r"^\s*DIFFERENT\s+(\S+)\s*(\([^)]*\))?")
+RMS_RE = re.compile(r"^\s*RMS\s+(\S+)\s+(\S+)\s+NORMALIZED\s+(\S+)")
+RMS_DIFF_RE = re.compile(r"rms diff:\s*(\S+)")
+FILE_RE = re.compile(r"^\s*file\s*\d\s*=\s*(.+)$")
+VERDICT_RE = re.compile(r"the two files seem to be\s+(\w+)", re.IGNORECASE)
+
+# cached summaries for this process, keyed by path.
+_summaries = {}
+
+
+def _to_float(token):
+    try:
+        return float(token.replace('D', 'E').replace('d', 'e'))
+    except ValueError:
+        return None
+
+
+def parse_cprnc_output(lines):
+    """Parse an iterable of cprnc.out lines in one pass.
+
+    Returns a dict with the compared "files", the "verdict", e.g.
+    DIFFERENT or IDENTICAL, and the sorted list of differing "fields",
+    each a dict with name, dims, max_diff, rms, normalized_rms and
+    location.
+
+    """
+    files = []
+    verdict = None
+    fields = {}
+    field = None
+    # data lines seen in the current DIFFERENT block.
+    block_line = 0
+    for line in lines:
+        match = DIFFERENT_RE.match(line)
+        if match:
+            name = match.group(1)
+            field = fields.setdefault(name, {
+                "name": name, "dims": match.group(2), "max_diff": None,
+                "rms": None, "normalized_rms": None, "location": None})
+            block_line = 0
+            continue
+        match = RMS_RE.match(line)
+        if match:
+            name = match.group(1)
+            rms_field = fields.setdefault(name, {
+                "name": name, "dims": None, "max_diff": None,
+                "rms": None, "normalized_rms": None, "location": None})
+            rms_field["rms"] = _to_float(match.group(2))
+            rms_field["normalized_rms"] = _to_float(match.group(3))
+            field = None
+            continue
+        if field is not None:
+            block_line += 1
+            if block_line == 1:
+                # n1 n2 ndiffs max1 min1 diffmax ...
+                values = [t for t in line.split() if FLOAT_RE.match(t) and
+                          ('.' in t or 'E' in t.upper())]
+                if len(values) >= 3:
+                    field["max_diff"] = _to_float(values[2])
+            elif ('(' in line and ':' not in line and
+                  field["location"] is None):
+                field["location"] = " ".join(line.split())
+            match = RMS_DIFF_RE.search(line)
+            if match and field["rms"] is None:
+                field["rms"] = _to_float(match.group(1))
+            continue
+        match = FILE_RE.match(line)
+        if match and len(files) < 2:
+            files.append(match.group(1).strip())
+            continue
+        match = VERDICT_RE.search(line)
+        if match:
+            verdict = match.group(1).upper()
+
+    differing = [f for f in fields.values()
+                 if f["dims"] is not None or
+                 (f["rms"] is not None and f["rms"] > 0.0)]
+    differing.sort(key=severity_key)
+    return {"files": files, "verdict": verdict, "fields": differing}
+
+
+def severity_key(field):
+    """Sort key, largest normalized RMS first, then largest RMS and
+    maximum difference. Unknown values sort last.
+
+    """
+    def descending(value):
+        if value is None:
+            return (1, 0.0)
+        return (0, -abs(value))
+    return (descending(field["normalized_rms"]), descending(field["rms"]),
+            descending(field["max_diff"]), field["name"])
+
+
+def get_cprnc_summary(cprnc_out):
+    """Return the summary of a cprnc.out file, from the cache next to it
+    when cprnc.out has not changed since it was written.
+
+    """
+    stat = os.stat(cprnc_out)
+    key = [stat.st_size, stat.st_mtime]
+    cached = _summaries.get(cprnc_out)
+    if cached is not None and cached["key"] == key:
+        return cached
+
+    cache_file = cprnc_out + SUMMARY_SUFFIX
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as cfile:
+                cached = json.load(cfile)
+            if (cached.get("version") == SUMMARY_VERSION and
+                    cached.get("key") == key):
+                _summaries[cprnc_out] = cached
+                return cached
+        except ValueError:
+            pass
+
+    with open(cprnc_out, 'r') as cprnc_file:
+        summary = parse_cprnc_output(cprnc_file)
+    summary["version"] = SUMMARY_VERSION
+    summary["key"] = key
+    _summaries[cprnc_out] = summary
+    tmp_file = "{0}.{1}.tmp".format(cache_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as cfile:
+            json.dump(summary, cfile, indent=2, sort_keys=True)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        # e.g. a read only baseline directory, the summary is still
+        # returned.
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return summary
+
+
+def format_field_table(fields):
+    """Lines of a text table of the differing fields.
+    """
+    def fmt(value):
+        if value is None:
+            return "-"
+        return "{0:.4e}".format(value)
+
+    lines = ["{0:<24} {1:>12} {2:>12} {3:>14}  {4}".format(
+        "field", "max diff", "rms", "normalized rms", "location")]
+    for field in fields:
+        lines.append("{0:<24} {1:>12} {2:>12} {3:>14}  {4}".format(
+            field["name"], fmt(field["max_diff"]), fmt(field["rms"]),
+            fmt(field["normalized_rms"]), field["location"] or ""))
+    return lines
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""Edit the env_*.xml files of every case in a cime test root in one
+process, e.g. to move a suite to a faster queue with short wall clock
+limits:
+
+    edit-test-cases.py --test-root ${SCRATCH}/tests-clm-20150910-1723 \
+        --queue premium --walltime 00:10 --walltime ERI=00:30
+
+Replaces running speed-up-test.sh in each case directory. Changes are
+made to the xml entries by id, the same as xmlchange:
+
+    --queue : JOB_QUEUE of every batch job
+    --walltime [TEST=]HH:MM : JOB_WALLCLOCK_TIME of every batch job,
+        optionally only for one test type, e.g. ERS
+    --set KEY=VALUE : any entry in any env_*.xml file
+
+Cases are edited in parallel and each file is replaced atomically.
+Every change is reported. Comments in the files are kept; without lxml
+a file is left unchanged if rewriting it would drop any of them.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+#
+# built-in modules
+#
+import argparse
+import glob
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import tempfile
+import traceback
+
+try:
+    import lxml.etree as etree
+except:
+    import xml.etree.ElementTree as etree
+
+#
+# other modules in this package
+#
+from cime_rerun import read_testspec
+
+# -------------------------------------------------------------------------------
+#
+# User input
+#
+# -------------------------------------------------------------------------------
+
+def commandline_options():
+    """Process the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='edit the env_*.xml files of every case in a cime '
+        'test root.')
+
+    parser.add_argument('--backtrace', action='store_true',
+                        help='show exception backtraces as extra debugging '
+                        'output')
+
+    parser.add_argument('--debug', action='store_true',
+                        help='extra debugging output')
+
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report the changes without writing any files.')
+
+    cases = parser.add_mutually_exclusive_group(required=True)
+    cases.add_argument('--test-root', nargs=1,
+                       help='edit every case in the test root')
+    cases.add_argument('--testspec', nargs=1,
+                       help='edit the cases of a single testspec xml file')
+    cases.add_argument('--case', nargs='+',
+                       help='edit the given case directories')
+
+    parser.add_argument('--queue', nargs=1, default=[None],
+                        help='batch queue for all jobs, JOB_QUEUE')
+
+    parser.add_argument('--walltime', action='append', default=[],
+                        help='wall clock limit, JOB_WALLCLOCK_TIME, for all '
+                        'jobs as HH:MM, or for one test type as TEST=HH:MM, '
+                        'e.g. ERI=00:30. May be repeated.')
+
+    parser.add_argument('--set', action='append', default=[],
+                        help='xmlchange style KEY=VALUE for any entry in '
+                        'the env_*.xml files. May be repeated.')
+
+    parser.add_argument('--num-threads', nargs=1, type=int, default=[8],
+                        help='number of cases to edit at once')
+
+    options = parser.parse_args()
+    return options
+
+# -------------------------------------------------------------------------------
+#
+# work functions
+#
+# -------------------------------------------------------------------------------
+
+WALLTIME_RE = re.compile(r"^\d+:\d\d(:\d\d)?$")
+
+
+def get_case_dirs(test_root=None, testspec=None, cases=None):
+    """List the case directories to edit. The cases of a test root come
+    from its testspec files, or every directory with an env_batch.xml
+    if there are none.
+
+    """
+    if cases:
+        return [os.path.abspath(case) for case in cases]
+    if testspec:
+        test_root = os.path.dirname(os.path.abspath(testspec))
+        testspecs = [testspec]
+    else:
+        test_root = os.path.abspath(test_root)
+        testspecs = sorted(glob.glob(os.path.join(test_root,
+                                                  "testspec*.xml")))
+    case_dirs = []
+    for spec in testspecs:
+        junk, junk, spec_cases = read_testspec(spec)
+        case_dirs.extend(os.path.join(test_root, case) for case in spec_cases)
+    if not testspecs:
+        for case_dir in sorted(os.listdir(test_root)):
+            case_dir = os.path.join(test_root, case_dir)
+            if os.path.isfile(os.path.join(case_dir, "env_batch.xml")):
+                case_dirs.append(case_dir)
+    return case_dirs
+
+
+def parse_changes(queue, walltimes, settings):
+    """Convert the command line options into a list of (test type, key,
+    value) edits. A test type of None applies to every case. Test type
+    specific edits come last so they override the defaults.
+
+    """
+    changes = []
+    if queue:
+        changes.append((None, "JOB_QUEUE", queue))
+    typed = []
+    for walltime in walltimes:
+        test_type = None
+        if '=' in walltime:
+            test_type, walltime = walltime.split('=', 1)
+        if not WALLTIME_RE.match(walltime):
+            raise RuntimeError("Invalid wall clock time '{0}', expected "
+                               "HH:MM".format(walltime))
+        if test_type is None:
+            changes.append((None, "JOB_WALLCLOCK_TIME", walltime))
+        else:
+            typed.append((test_type, "JOB_WALLCLOCK_TIME", walltime))
+    for setting in settings:
+        if '=' not in setting:
+            raise RuntimeError("Invalid setting '{0}', expected "
+                               "KEY=VALUE".format(setting))
+        key, value = setting.split('=', 1)
+        changes.append((None, key.strip(), value.strip()))
+    return changes + typed
+
+
+def case_test_type(case_dir):
+    """Test type of a case, e.g. ERS for ERS_D_Ld5.f10_f10...
+    """
+    return os.path.basename(case_dir).split('.')[0].split('_')[0]
+
+
+def parse_env_file(filename):
+    """Parse an env_*.xml file keeping its comments. lxml keeps all of
+    them, ElementTree only from python 3.8 and only inside the root
+    element.
+
+    Returns the tree and True if it can be written back without losing
+    any comments.
+
+    """
+    if etree.__name__ == "lxml.etree":
+        return etree.parse(filename), True
+    try:
+        builder = etree.TreeBuilder(insert_comments=True, insert_pis=True)
+        tree = etree.parse(filename, etree.XMLParser(target=builder))
+    except TypeError:
+        tree = etree.parse(filename)
+    with open(filename, 'r') as env_file:
+        num_comments = env_file.read().count("<!--")
+    num_kept = sum(1 for node in tree.iter() if node.tag is etree.Comment)
+    return tree, num_kept == num_comments
+
+
+def edit_case(case_dir, changes, dry_run=False):
+    """Apply the changes to the env_*.xml files of one case.
+
+    Returns a list of (filename, key, old value, new value) for every
+    entry that changed, a list of keys that were not found, and a list
+    of files that were not written because their comments would be
+    lost.
+
+    """
+    test_type = case_test_type(case_dir)
+    values = {}
+    for change_type, key, value in changes:
+        if change_type is None or change_type == test_type:
+            values[key] = value
+
+    edits = []
+    found = set()
+    skipped = []
+    for env_file in sorted(glob.glob(os.path.join(case_dir, "env_*.xml"))):
+        tree, lossless = parse_env_file(env_file)
+        file_edits = []
+        for entry in tree.getroot().iter('entry'):
+            key = entry.get('id')
+            if key not in values:
+                continue
+            found.add(key)
+            old_value = entry.get('value')
+            if old_value != values[key]:
+                entry.set('value', values[key])
+                file_edits.append((os.path.basename(env_file), key,
+                                   old_value, values[key]))
+        if file_edits and not dry_run:
+            if not lossless:
+                skipped.append(os.path.basename(env_file))
+                continue
+            write_atomic(tree, env_file)
+        edits.extend(file_edits)
+    missing = sorted(set(values) - found)
+    return edits, missing, skipped
+
+
+def write_atomic(tree, filename):
+    """Write the xml tree to a temporary file in the same directory and
+    rename it over the original, so a case never sees a partial file.
+
+    """
+    handle, tmp_name = tempfile.mkstemp(
+        prefix=".{0}.".format(os.path.basename(filename)),
+        dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(handle, 'wb') as tmp_file:
+            tree.write(tmp_file, encoding="UTF-8", xml_declaration=True)
+        os.chmod(tmp_name, os.stat(filename).st_mode & 0o777)
+        os.rename(tmp_name, filename)
+    except:
+        os.remove(tmp_name)
+        raise
+
+# -------------------------------------------------------------------------------
+#
+# main
+#
+# -------------------------------------------------------------------------------
+
+def main(options):
+    changes = parse_changes(options.queue[0], options.walltime, options.set)
+    if not changes:
+        raise RuntimeError("No changes requested.")
+
+    test_root = options.test_root[0] if options.test_root else None
+    testspec = options.testspec[0] if options.testspec else None
+    case_dirs = get_case_dirs(test_root, testspec, options.case)
+    if options.debug:
+        print("Editing {0} cases :".format(len(case_dirs)))
+        for test_type, key, value in changes:
+            print("  {0} : {1} = {2}".format(test_type or "all", key, value))
+
+    pool = ThreadPool(max(1, options.num_threads[0]))
+    try:
+        results = pool.map(lambda case: edit_case(case, changes,
+                                                  options.dry_run),
+                           case_dirs)
+    finally:
+        pool.close()
+        pool.join()
+
+    num_edits = 0
+    num_cases = 0
+    status = 0
+    for case_dir, (edits, missing, skipped) in zip(case_dirs, results):
+        case = os.path.basename(case_dir)
+        for filename, key, old_value, new_value in edits:
+            print("{0} : {1} : {2} : {3} -> {4}".format(
+                case, filename, key, old_value, new_value))
+        for key in missing:
+            print("WARNING: {0} : no entry '{1}'".format(case, key))
+            status = 1
+        for filename in skipped:
+            print("WARNING: {0} : {1} not changed, writing it would drop "
+                  "its comments. Install lxml.".format(case, filename))
+            status = 1
+        num_edits += len(edits)
+        if edits:
+            num_cases += 1
+    action = "Would change" if options.dry_run else "Changed"
+    print("{0} {1} entries in {2} of {3} cases.".format(
+        action, num_edits, num_cases, len(case_dirs)))
+    return status
+
+
+if __name__ == "__main__":
+    options = commandline_options()
+    try:
+        status = main(options)
+        sys.exit(status)
+    except Exception as error:
+        print(str(error))
+        if options.backtrace:
+            traceback.print_exc()
+        sys.exit(1)
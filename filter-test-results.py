@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 
 """Script to filter cesm test suite output based on the test
-status. Test status is the results of the cs.status.xxxx
-scripts. Meaning of test status is in
-scripts/doc/usersguide/testing.xml
+status. Test status is read from the testspec and TestStatus files in
+the test root, the same information the cs.status scripts
+report. Meaning of test status is in scripts/doc/usersguide/testing.xml
 
   Remove:
     * PASS
@@ -20,7 +20,23 @@ scripts/doc/usersguide/testing.xml
   them individually and remove them from the list.
 
   Extra diagnostics :
-    * CFAIL : reruns the ${CASE}.test_build script and captures the output.
+    * CFAIL : reruns the ${CASE}.test_build scripts concurrently, each
+      logging to its case directory, and reports an excerpt of the errors.
+    * compare_hist : scans TestStatus.out once for all its comparison
+      blocks and summarizes each cprnc.out they refer to once.
+
+  Incremental mode (--incremental) caches the status and detailed
+  diagnostics of each case in the test root, keyed by its TestStatus
+  modification time and size, and only reprocesses the cases that
+  changed since the previous report.
+
+  Instead of a test info file, a test root launched by cime-tests.py,
+  or its launch-manifest.json, can be given. The machine, compilers,
+  testids and baseline are then read from the launch manifest.
+
+  Several test info files, e.g. one per compiler, are processed in
+  parallel. After the per compiler summaries, a cross compiler summary
+  lists the tests that fail on some compilers but not on the others.
 
   Requires python >= 2.7
     on yellowstone:
@@ -42,11 +58,10 @@ if sys.hexversion < 0x02060000:
     print(70 * "*")
     sys.exit(1)
 
-import copy
+from collections import deque
+import multiprocessing
 import os
 import re
-import shutil
-import subprocess
 import traceback
 # import xml.parsers.expat
 import xml.etree.ElementTree as ET
@@ -58,14 +73,32 @@ else:
 
 if sys.hexversion < 0x03000000:
     from ConfigParser import SafeConfigParser as config_parser
+    from StringIO import StringIO
 else:
     from configparser import ConfigParser as config_parser
+    from io import StringIO
 
 
 from cesm_machine import read_machine_config
+from cime_baseline import get_baseline_index
+from cime_manifest import MANIFEST_NAME, get_manifest_file
+from cime_manifest import read_launch_manifest
+from cime_status import collect_test_status, find_testspecs
+from cime_status import remove_known_failures
+from cime_status_out import read_status_output
+from cime_namelist import diff_namelist_files, find_namelist_files
+from cime_namelist import format_value
+from cime_report_cache import ReportCache, get_report_cache_file
+from cprnc_output import format_field_table, get_cprnc_summary
+from cime_xfail import (ExpectedFails, find_expected_fails_files,
+                        read_expected_fails)
+from process_supervisor import ProcessSupervisor
 
 debug = True
 
+# number of failed builds rerun at once for a detailed report.
+DEFAULT_DIAGNOSTIC_JOBS = 4
+
 
 def determine_test_info(test_info_file):
     """Determine what machine we are running on and extract the test
@@ -96,6 +129,57 @@ def determine_test_info(test_info_file):
     return machine, test_info
 
 
+def get_manifest_test_root(path):
+    """Return the test root if path is a test root or the launch manifest
+    written there by cime-tests.py, otherwise None.
+
+    """
+    if os.path.isdir(path):
+        return os.path.abspath(path)
+    if os.path.basename(path) == MANIFEST_NAME:
+        return os.path.dirname(os.path.abspath(path))
+    return None
+
+
+def read_test_root_manifest(test_root):
+    manifest = read_launch_manifest(test_root)
+    if manifest is None:
+        raise RuntimeError("ERROR: no launch manifest in {0}, use a test "
+                           "info file instead.".format(test_root))
+    return manifest
+
+
+def manifest_test_info(test_root, compiler):
+    """Build the test info of one compiler from the launch manifest of a
+    test root, instead of a hand written test info file.
+
+    """
+    manifest = read_test_root_manifest(test_root)
+    launches = [launch for launch in manifest["launches"]
+                if launch["compiler"] == compiler]
+    if not launches:
+        raise RuntimeError("ERROR: compiler '{0}' was not launched in "
+                           "{1}".format(compiler, test_root))
+    test_info = {
+        "compiler": compiler,
+        "scratch_dir": os.path.dirname(test_root),
+        "test_data_dir": os.path.basename(test_root),
+        "testid": [launch["testid"] for launch in launches],
+        "baseline": manifest["baseline"],
+        "baseline_root": manifest["baseline_root"],
+    }
+    print("Using launch manifest : {0}".format(get_manifest_file(test_root)))
+    for key in sorted(test_info):
+        print("    {0} : {1}".format(key, test_info[key]))
+    if test_info["baseline"] and test_info["baseline_root"]:
+        check_dir = os.path.join(test_info["baseline_root"],
+                                 test_info["baseline"])
+        if not os.path.isdir(check_dir):
+            raise RuntimeError("ERROR: Could not find baseline directory. "
+                               "Expected: {0}".format(check_dir))
+    return manifest["machine"], test_info
+
+
 def check_test_info(machine_config, test_info):
     """Run some basic sanity checks on the config info
     """
@@ -109,13 +193,6 @@ def check_test_info(machine_config, test_info):
             test_dir)
         raise Exception(message)
 
-    if "status" in test_info:
-        check_file = "{0}/{1}".format(test_dir, test_info['status'])
-        if not os.path.isfile(check_file):
-            message = "ERROR: Could not find status script. Expected: {0}".format(
-                check_file)
-            raise RuntimeError(message)
-
     if "expected_fail" in test_info:
         check_file = "{0}".format(test_info['expected_fail'])
         if not os.path.isfile(check_file):
@@ -138,34 +215,43 @@ def check_test_info(machine_config, test_info):
         raise RuntimeError(message)
 
 
-def generate_status_output_files(test_info):
-    """Call the cs.status script and generate the test status output
+def collect_status_records(test_info, outfile, report_cache=None):
+    """Read the status of every case in the test root, and drop the
+    known failures listed in the ExpectedTestFails.xml files of the
+    source tree, the same as cs.status. With a report_cache, only the
+    cases that changed since the previous report are read.
+
     """
-    print("Generating report files.")
-    status_list = []
+    print("Collecting test status.")
     test_dir = "{0}/{1}".format(test_info['scratch_dir'],
                                 test_info['test_data_dir'])
-
-    # existance of status file should have already been checked!
-    status_script = "{0}/{1}".format(test_dir, test_info['status'])
-    status_output = "{0}/{1}.status.out.txt".format(
-        test_dir, test_info['testid'])
-    with open(status_output, 'w') as status_file:
-        command = [status_script]
-        subprocess.call(command, stdout=status_file)
-
-    if os.path.isfile(status_output):
-        status_list.append(status_output)
-    else:
-        message = "ERROR: could not find status output. Expected: {0}".format(
-            status_output)
-        raise RuntimeError(message)
-
-    return status_list
-
-
-def get_test_status(status_output, machine, compiler):
-    """Read the status file and create a dict of tests and their state
+    testspecs = find_testspecs(test_dir, test_info.get('testid'))
+    cimeroot, records, reused = collect_test_status(
+        testspecs, report_cache=report_cache)
+
+    xfail_files = None
+    if report_cache is not None:
+        print("  Cases unchanged since the previous report : {0}".format(
+            reused), file=outfile)
+        xfail_files = report_cache.xfail_files(cimeroot)
+    if xfail_files is None:
+        xfail_files = find_expected_fails_files(cimeroot)
+        if report_cache is not None:
+            report_cache.set_xfail_files(cimeroot, xfail_files)
+    print("  Testspec files:", file=outfile)
+    for testspec in testspecs:
+        print("    {0}".format(testspec), file=outfile)
+    print("  ExpectedTestFails files:", file=outfile)
+    for xfail in xfail_files:
+        print("    {0}".format(xfail), file=outfile)
+    records, known = remove_known_failures(
+        records, read_expected_fails(xfail_files))
+    print("  Known failures removed : {0}".format(len(known)), file=outfile)
+    return records
+
+
+def get_test_status(records, machine, compiler):
+    """Sort the status records into a dict of tests by their state
 
     PASS =
     CFAIL = config/compile failure
@@ -184,7 +270,7 @@ def get_test_status(status_output, machine, compiler):
     UNKNOWN =
 
     """
-    print("Reading status report for {0} {1}.".format(machine, compiler))
+    print("Sorting test status for {0} {1}.".format(machine, compiler))
     test_status = {}
     test_status["PASS"] = []
     test_status["CFAIL"] = []
@@ -199,27 +285,24 @@ def get_test_status(status_output, machine, compiler):
     test_status["UNKNOWN"] = []
     # test_status[""] = []
 
-    with open(status_output, 'r') as report:
-        for tmp in report.readlines():
-            line = tmp.split()
-            if len(line) == 2:
-                status = line[0].strip()
-                name = line[1].strip()
-                if status in test_status:
-                    test_status[status].append(name)
-                else:
-                    test_status["UNKNOWN"].append((status, name))
+    for record in records:
+        if record.status in test_status:
+            test_status[record.status].append(record.test)
+        else:
+            test_status["UNKNOWN"].append((record.status, record.test))
 
     return test_status
 
 
 def get_expected_fail(expected_fail_file, outfile, machine, compiler):
     """open the expected fail xml file and extract the expected fail list
-    for this machine and compiler.
+    for this machine and compiler into an ExpectedFails index.
 
     """
     print("Extracting expected fail list")
-    expected_fails = {}
+    expected_fails = ExpectedFails()
+    if expected_fail_file is None:
+        return expected_fails
     xfail_path = os.path.abspath(expected_fail_file)
     if not os.path.isfile(xfail_path):
         print("Could not find expected fail file: {0}".format(xfail_path))
@@ -240,8 +323,8 @@ def get_expected_fail(expected_fail_file, outfile, machine, compiler):
         else:
             items = xfail_aux.iter("entry")
         for test in items:
-            expected_fails[
-                test.attrib["testId"].strip()] = test.attrib["failType"].strip()
+            expected_fails.add(test.attrib["failType"].strip(),
+                               test.attrib["testId"].strip())
     except Exception as error:
         print(error)
         print(
@@ -257,50 +340,146 @@ def process_expected_fail(test_info, machine, compiler, outfile,
     """
     print("Processing expected fails")
     expected_fail = get_expected_fail(
-        test_info['expected_fail'], outfile, machine, compiler)
+        test_info.get('expected_fail'), outfile, machine, compiler)
     print(80 * "=", file=outfile)
     print("  XFAIL tests\n", file=outfile)
     print("    removing expected failure tests :", file=outfile)
-    miscategorized = {}
-    for xfail in expected_fail:
-        status = expected_fail[xfail]
-        found = False
+    found = set()
+    for status in test_status:
+        if status == "UNKNOWN":
+            continue
+        remaining = []
         for test in test_status[status]:
-            if test.startswith(xfail):
-                found = True
-                print("      {0} : {1}".format(xfail, status), file=outfile)
-                test_status[status].remove(test)
-        if not found:
-            miscategorized[xfail] = status
-
+            xfail = expected_fail.match(status, test)
+            if xfail is not None and xfail.status == status:
+                found.add(xfail)
+                print("      {0} : {1}".format(xfail.test_name, status),
+                      file=outfile)
+            else:
+                remaining.append(test)
+        test_status[status] = remaining
+
+    miscategorized = [xfail for xfail in expected_fail.entries()
+                      if xfail not in found]
     if len(miscategorized) > 0:
         print("\n    miscategorized expected failure tests :", file=outfile)
-        for test in miscategorized:
+        for xfail in miscategorized:
             print("      {0} : {1}".format(
-                test, miscategorized[test]), file=outfile)
+                xfail.test_name, xfail.status), file=outfile)
+
+
+# lines of a build log worth showing in the summary.
+BUILD_ERROR_RE = re.compile(
+    r"error|fatal|undefined reference|cannot find|no such file|failed",
+    re.IGNORECASE)
+
+# maximum number of lines in a build error excerpt.
+BUILD_EXCERPT_LINES = 20
+
 
+def build_error_excerpt(logfile, max_lines=BUILD_EXCERPT_LINES):
+    """Condense a build log to the lines that look like errors, or its
+    last lines if none do.
 
-def process_cfail(outfile, detailed_report, cfail, test_root):
+    """
+    excerpt = []
+    tail = deque(maxlen=max_lines)
+    with open(logfile, 'r') as log:
+        for line in log:
+            line = line.rstrip()
+            tail.append(line)
+            if (len(excerpt) < max_lines and BUILD_ERROR_RE.search(line) and
+                    (not excerpt or excerpt[-1] != line)):
+                excerpt.append(line)
+    if not excerpt:
+        excerpt = list(tail)
+    return excerpt
+
+
+def write_diagnostics(outfile, report_cache, section, test, case_path,
+                      write_details):
+    """Write the detailed diagnostics of a test. With a report_cache, the
+    text from the previous report is reused when the case has not
+    changed, otherwise write_details(outfile) generates it.
+
+    """
+    if report_cache is None:
+        write_details(outfile)
+        return
+    text = report_cache.diagnostic(section, test, case_path)
+    if text is None:
+        details = StringIO()
+        write_details(details)
+        text = details.getvalue()
+        report_cache.set_diagnostic(section, test, case_path, text)
+    outfile.write(text)
+
+
+def write_build_details(outfile, build):
+    """Rerun status, log and error excerpt of a failed build.
+    """
+    print("      {0} : status {1}".format(" ".join(build.command),
+                                         build.status), file=outfile)
+    print("      full log : {0}".format(build.logfile), file=outfile)
+    print(80 * "*", file=outfile)
+    if os.path.isfile(build.logfile):
+        for line in build_error_excerpt(build.logfile):
+            print("      {0}".format(line), file=outfile)
+    print(80 * "*", file=outfile)
+    print("", file=outfile)
+
+
+def process_cfail(outfile, detailed_report, cfail, test_root, case_dirs=None,
+                  num_jobs=DEFAULT_DIAGNOSTIC_JOBS, report_cache=None):
     """
     configure / compilation errors
+
+    For a detailed report, rerun the test_build script of every failed
+    case, num_jobs at a time, each writing its own log in the case
+    directory. Builds already rerun for the previous report are not
+    rerun while the case is unchanged.
     """
+    if case_dirs is None:
+        case_dirs = {}
     print(80 * "=", file=outfile)
     print("  CFAIL tests - configure/compile failure\n", file=outfile)
+    if not detailed_report:
+        for test in cfail:
+            print("    {0}".format(test), file=outfile)
+        return
+
+    supervisor = ProcessSupervisor(max_parallel=num_jobs)
+    builds = {}
+    case_paths = {}
+    for test in cfail:
+        case = case_dirs.get(test, test)
+        case_dir = os.path.join(test_root, case)
+        if os.path.isdir(case_dir):
+            case_paths[test] = case_dir
+            if (report_cache is not None and report_cache.diagnostic(
+                    "CFAIL", test, case_dir) is not None):
+                continue
+            command = [os.path.join(case_dir, "{0}.test_build".format(case))]
+            logfile = os.path.join(case_dir, "{0}.diagnostic.log".format(
+                os.path.basename(command[0])))
+            builds[test] = supervisor.add(command, logfile, label=case,
+                                          cwd=case_dir)
+    if builds:
+        print("Rerunning {0} failed builds.".format(len(builds)))
+        supervisor.run()
+        if report_cache is not None:
+            # the build may rewrite TestStatus.
+            for test in builds:
+                report_cache.refresh_case_key(case_paths[test])
+
     for test in cfail:
         print("    {0}".format(test), file=outfile)
-        if not detailed_report:
+        if test not in case_paths:
             continue
-        case_dir = "{0}/{1}".format(test_root, test)
-        if os.path.isdir(case_dir):
-            os.chdir(case_dir)
-            command = "./{0}.test_build".format(test)
-            print("cd {0}".format(case_dir), file=outfile)
-            print("{0}".format(command), file=outfile)
-            print(80 * "*", file=outfile)
-            outfile.flush()
-            subprocess.call(command, stdout=outfile, stderr=outfile)
-            print(80 * "*", file=outfile)
-            print("", file=outfile)
+        write_diagnostics(
+            outfile, report_cache, "CFAIL", test, case_paths[test],
+            lambda details, build=builds.get(test): write_build_details(
+                details, build))
 
 
 def process_run_fail(outfile, detailed_report, runfail):
@@ -313,7 +492,46 @@ def process_run_fail(outfile, detailed_report, runfail):
         print("    {0}".format(test), file=outfile)
 
 
-def process_bfail(outfile, detailed_report, bfail, fail):
+# comparison failures that are reported on their own lines, e.g.
+# FAIL ERS.f10_f10.ICLM45.yellowstone_intel.C.12345.compare_hist. When a
+# name contains more than one, the first one in this list wins.
+FAIL_KINDS = ("generate", "nlcomp", "compare_hist", "memcomp", "tputcomp")
+
+
+def failure_kind(test):
+    """Return the comparison kind of a FAIL line, or None for other
+    failures.
+
+    """
+    for kind in FAIL_KINDS:
+        if kind in test:
+            return kind
+    return None
+
+
+def classify_failures(test_status):
+    """Split the FAIL list into report sections in a single pass. FAIL
+    lines for tests that are also BFAIL are dropped, comparison
+    failures are filed under their kind and everything else stays in
+    FAIL.
+
+    Returns a dict of section name : list of tests.
+
+    """
+    bfail = set(test_status["BFAIL"])
+    sections = dict((kind, []) for kind in FAIL_KINDS)
+    sections["FAIL"] = []
+    for test in test_status["FAIL"]:
+        if test in bfail:
+            continue
+        kind = failure_kind(test)
+        if kind is None:
+            kind = "FAIL"
+        sections[kind].append(test)
+    return sections
+
+
+def process_bfail(outfile, detailed_report, bfail):
     """
     ignore errors where the baseline does not exist
     """
@@ -322,53 +540,43 @@ def process_bfail(outfile, detailed_report, bfail, fail):
     print("    removing BFAIL tests from the FAIL list.", file=outfile)
     for test in bfail:
         print("      {0}".format(test), file=outfile)
-        if test in fail:
-            fail.remove(test)
 
 
-def process_tput(outfile, detailed_report, fail):
+def process_tput(outfile, detailed_report, tput):
     """
     ignore failures with throughput comparison errors (tputcomp)
     """
     print(80 * "=", file=outfile)
     print("  through put tests\n", file=outfile)
     print("    removing tput failures from the FAIL list.", file=outfile)
-    fail_list = copy.deepcopy(fail)
-    for test in fail_list:
-        if test.find("tputcomp") != -1:
-            fail.remove(test)
-            print("      {0}".format(test), file=outfile)
+    for test in tput:
+        print("      {0}".format(test), file=outfile)
 
 
-def process_generate(outfile, detailed_report, fail):
+def process_generate(outfile, detailed_report, generate):
     """
     remove baseline generation errors
     """
     print(80 * "=", file=outfile)
     print("  generate tests\n", file=outfile)
     print("    removing generate failures from the FAIL list.", file=outfile)
-    fail_list = copy.deepcopy(fail)
-    for test in fail_list:
-        if test.find("generate") != -1:
-            fail.remove(test)
-            print("      {0}".format(test), file=outfile)
+    for test in generate:
+        print("      {0}".format(test), file=outfile)
 
 
-def process_memcomp(outfile, detailed_report, fail):
+def process_memcomp(outfile, detailed_report, memcomp):
     """
     remove memcomp errors
     """
     print(80 * "=", file=outfile)
     print("  memcomp tests\n", file=outfile)
     print("    removing memcomp failures from the FAIL list.", file=outfile)
-    fail_list = copy.deepcopy(fail)
-    for test in fail_list:
-        if test.find("memcomp") != -1:
-            fail.remove(test)
-            print("      {0}".format(test), file=outfile)
+    for test in memcomp:
+        print("      {0}".format(test), file=outfile)
 
 
-def process_compare_hist(outfile, detailed_report, fail, test_root):
+def process_compare_hist(outfile, detailed_report, compare_hist, test_root,
+                         report_cache=None):
     """
     seperate out compare_hist errors
     """
@@ -377,185 +585,176 @@ def process_compare_hist(outfile, detailed_report, fail, test_root):
     print(
         "    separating compare_hist failures from the FAIL list.",
         file=outfile)
-    fail_list = copy.deepcopy(fail)
-    for test in fail_list:
-        if test.find("compare_hist") != -1:
-            fail.remove(test)
-            if not detailed_report:
-                print("      {0}".format(test), file=outfile)
-                continue
-
-            print("      {0}".format(len(test) * '.'), file=outfile)
+    for test in compare_hist:
+        if not detailed_report:
             print("      {0}".format(test), file=outfile)
-            print("      {0}".format(len(test) * '.'), file=outfile)
-            # check TestStatus file
-            test_name_as_list = test.split('.')
-            index = test_name_as_list.index('C')
-            name_list = test_name_as_list[0:index + 2]
-            test_name = ".".join(name_list)
-            test_dir = "{0}/{1}".format(test_root, test_name)
-            search_for_compare_hist_failure(test_dir, outfile)
-            search_for_restart_failure(test_dir, outfile)
-
+            continue
 
-def search_for_compare_hist_failure(test_dir, outfile):
-    """Try to identify info about history comparison failure
+        print("      {0}".format(len(test) * '.'), file=outfile)
+        print("      {0}".format(test), file=outfile)
+        print("      {0}".format(len(test) * '.'), file=outfile)
+        # check TestStatus file
+        test_name_as_list = test.split('.')
+        index = test_name_as_list.index('C')
+        name_list = test_name_as_list[0:index + 2]
+        test_name = ".".join(name_list)
+        test_dir = "{0}/{1}".format(test_root, test_name)
+        write_diagnostics(
+            outfile, report_cache, "compare_hist", test, test_dir,
+            lambda details, test_dir=test_dir: write_compare_hist_details(
+                details, test_dir))
+
+
+def write_compare_hist_details(outfile, test_dir):
+    """History and restart comparison details of one case, from a single
+    pass over its TestStatus.out.
     """
-    print("\nChecking for history comparison failure....", file=outfile)
     test_status = "{0}/TestStatus.out".format(test_dir)
-    print("        less {0}\n".format(test_status), file=outfile)
-    output_buffer = []
-    with open(test_status, 'r') as status_file:
-        record_output = False
-        hist_comp_fail = False
-        for line in status_file.readlines():
-            if line.find("Comparing hist file with baseline hist file") >= 0:
-                record_output = True
-            if record_output is True:
-                output_buffer.append(line)
-                if line.find("hist file comparison is FAIL") >= 0:
-                    record_output = False
-                    hist_comp_fail = True
-                elif line.find("PASS") >= 0:
-                    record_output = False
-                    hist_comp_fail = False
-
-    if hist_comp_fail is True:
-        for line in output_buffer:
-            print(line, file=outfile)
-        get_rms_from_cprnc(test_dir, outfile)
-    else:
-        print("PASS", file=outfile)
-
-
-def get_rms_from_cprnc(test_dir, outfile):
-    """Try to extract cprnc info about failure
-    """
-    # print("Retreiving RMS from cprnc")
-    cprnc_out = "{0}/cprnc.out".format(test_dir)
-    print("        less {0}\n".format(cprnc_out), file=outfile)
-    with open(cprnc_out, 'r') as cprnc_file:
-        print_next = 0
-        for line in cprnc_file.readlines():
-            # NOTE(2013-08) stripping whitespace removes a space from
-            # the front of every line and a newline from the end.
-            line = line.strip()
-            if print_next > 0:
-                print(line, file=outfile)
-                print_next -= 1
-            if line.find("file") == 0:
-                print(line, file=outfile)
-                print_next = 2
-            if line.find("RMS") == 0:
+    blocks = read_status_output(test_dir)
+    if blocks is None:
+        print("\n        no test status output found : {0}".format(
+            test_status), file=outfile)
+        return
+    reported_cprnc = set()
+    report_comparison(outfile, test_dir, test_status, blocks, "baseline_hist",
+                      "\nChecking for history comparison failure....",
+                      reported_cprnc)
+    report_comparison(outfile, test_dir, test_status, blocks, "restart_hist",
+                      "\nChecking for restart failure....", reported_cprnc)
+    other = [block for block in blocks if block.status == "FAIL" and
+             block.kind not in ("baseline_hist", "restart_hist")]
+    if other:
+        print("\nOther comparison failures....", file=outfile)
+        for block in other:
+            print("        {0} :".format(block.kind), file=outfile)
+            for line in block.lines:
                 print(line, file=outfile)
 
 
-def search_for_restart_failure(test_dir, outfile):
-    """Try to identify info about restart failure
+def report_comparison(outfile, test_dir, test_status, blocks, kind, title,
+                      reported_cprnc):
+    """Print the failed comparison blocks of one kind and the summary of
+    the cprnc output they refer to. Each cprnc.out is only summarized
+    once per case.
+
     """
-    print("\nChecking for restart failure....", file=outfile)
-    test_status = "{0}/TestStatus.out".format(test_dir)
+    print(title, file=outfile)
     print("        less {0}\n".format(test_status), file=outfile)
-    output_buffer = []
-    with open(test_status, 'r') as status_file:
-        record_output = False
-        restart_fail = False
-        for line in status_file.readlines():
-            if line.find("Comparing initial hist file with second hist file") >= 0:
-                record_output = True
-            if record_output is True:
-                output_buffer.append(line)
-                if line.find("hist file comparison is FAIL") >= 0:
-                    record_output = False
-                    restart_fail = True
-                elif line.find("PASS") >= 0:
-                    record_output = False
-                    restart_fail = False
-
-    if restart_fail is True:
-        for line in output_buffer:
-            print(line, file=outfile)
-        get_rms_from_cprnc(test_dir, outfile)
-    else:
+    failed = [block for block in blocks
+              if block.kind == kind and block.status == "FAIL"]
+    if not failed:
         print("PASS", file=outfile)
+        return
+    for block in failed:
+        for line in block.lines:
+            print(line, file=outfile)
+        cprnc_files = block.cprnc_files
+        if not cprnc_files:
+            cprnc_files = ["{0}/cprnc.out".format(test_dir)]
+        for cprnc_out in cprnc_files:
+            if cprnc_out in reported_cprnc:
+                print("        cprnc summary above : {0}".format(cprnc_out),
+                      file=outfile)
+                continue
+            reported_cprnc.add(cprnc_out)
+            get_rms_from_cprnc(cprnc_out, outfile)
 
 
-def process_nlcomp(outfile, detailed_report, fail, test_root, test_info):
+def get_rms_from_cprnc(cprnc_out, outfile):
+    """Report the fields that differ according to cprnc
+    """
+    print("        less {0}\n".format(cprnc_out), file=outfile)
+    if not os.path.isfile(cprnc_out):
+        print("        no cprnc output found.", file=outfile)
+        return
+    summary = get_cprnc_summary(cprnc_out)
+    for filename in summary["files"]:
+        print("        file : {0}".format(filename), file=outfile)
+    if summary["verdict"]:
+        print("        files are {0}".format(summary["verdict"]), file=outfile)
+    for line in format_field_table(summary["fields"]):
+        print("        {0}".format(line), file=outfile)
+
+
+def process_nlcomp(outfile, detailed_report, nlcomp, test_root, test_info,
+                   case_dirs=None, report_cache=None):
     """
     seperate out nlcomp failures
+
+    Every namelist file in the test run directory is compared to the
+    baseline CaseDocs copy in-process, reporting the groups and
+    variables that differ.
     """
-    debug = False
+    if case_dirs is None:
+        case_dirs = {}
     print(80 * "=", file=outfile)
     print("  nlcomp tests\n", file=outfile)
     print("    separating nlcomp failures from the FAIL list.", file=outfile)
-    nl_re = re.compile(r"_in[_\d]{0,4}$")
-    fail_list = copy.deepcopy(fail)
-    for test in fail_list:
-        if test.find("nlcomp") != -1:
-            fail.remove(test)
-            print("      {0}".format(test), file=outfile)
-            if not detailed_report:
-                continue
-            print(80 * "-", file=outfile)
-            # check TestStatus file
-            test_name = test[:test.rfind(".nlcomp")]
-
-            run_dir = os.path.normpath(
-                "{0}/../{1}/run".format(test_root, test_name))
-            if debug:
-                print("---> Run dir : {0}".format(run_dir))
-            namelist_files = []
-            for junk_root, junk_dirs, check_files in os.walk(run_dir):
-                for cfile in check_files:
-                    match = nl_re.search(cfile)
-                    if match:
-                        namelist_files.append(cfile)
-                        if debug:
-                            print("----> Found {0}".format(cfile))
-
-            for nlfile in namelist_files:
-                # How do we ignore the commands to generate the name list
-                # file....
-                if nlfile == "drv_in":
-                    # drv_in contains test and user names that will never be
-                    # the same.
-                    continue
-                if nlfile != "lnd_in":
-                    # for now assume we only care about land namelist files...
-                    continue
-
-                namelist_file = "{0}/{1}".format(run_dir, nlfile)
-                compiler_re = re.compile(
-                    "{0}_([a-z]+)".format(test_info["machine"]))
-                match = compiler_re.search(test)
-                if not match:
-                    raise RuntimeError(
-                        "ERROR : nlcomp : {0} : could not match compiler re.".format(test))
-                compiler = match.group(1)
-                # print("---> compiler : {0}".format(compiler))
-                # (\.(C|G)\.)?\.[\d]{8}
-                baseline_name_re = re.compile(
-                    r"(.+\.{0}_{1}(\.[\w_\-]{2})?)".format(test_info['machine'],
-                                                           compiler, "{2,}"))
-                baseline_name = baseline_name_re.match(test).group(1)
-                baseline_namelist_file = "{0}/{1}/{2}/CaseDocs/{3}".format(
-                    test_info['baseline_root'], test_info['baseline'],
-                    baseline_name, nlfile)
-
-                if not os.path.isfile(baseline_namelist_file):
-                    print("ERROR : nlcomp : {0} : could not find baseline namelist file : {1}".format(
-                        test, baseline_namelist_file), file=outfile)
-                if not os.path.isfile(namelist_file):
-                    print("ERROR : nlcomp : {0} : could not find test namelist file : {1}".format(
-                        test, namelist_file), file=outfile)
-                cmd = ["diff", baseline_namelist_file, namelist_file]
-                with open("tmp.stdout", "w") as run_stdout:
-                    status = subprocess.call(cmd, stdout=run_stdout)
-                    if status != 0:
-                        print("  diffing namelist files :\n    {0}".format(
-                            " ".join(cmd)), file=outfile)
-                        with open("tmp.stdout", 'r') as run_stdout:
-                            shutil.copyfileobj(run_stdout, outfile)
+    baseline_dir = os.path.join(test_info['baseline_root'],
+                                test_info['baseline'])
+    baseline_index = None
+    if detailed_report and nlcomp:
+        baseline_index = get_baseline_index(baseline_dir)
+    for test in nlcomp:
+        print("      {0}".format(test), file=outfile)
+        if not detailed_report:
+            continue
+        print(80 * "-", file=outfile)
+        case_path = None
+        if test in case_dirs:
+            case_path = os.path.join(test_root, case_dirs[test])
+        write_diagnostics(
+            outfile, report_cache, "nlcomp", test, case_path,
+            lambda details, test=test: write_nlcomp_details(
+                details, test, test_root, baseline_dir, baseline_index))
+
+
+def write_nlcomp_details(outfile, test, test_root, baseline_dir,
+                         baseline_index):
+    """Namelist differences between one test and its baseline.
+    """
+    test_name = test[:test.rfind(".nlcomp")]
+
+    run_dir = os.path.normpath(
+        "{0}/../{1}/run".format(test_root, test_name))
+    baseline_name = baseline_index.find_case(test_name)
+    if baseline_name is None:
+        print("ERROR : nlcomp : {0} : could not find baseline case in : {1}".format(
+            test, baseline_dir), file=outfile)
+        return
+
+    for nlfile in find_namelist_files(run_dir):
+        namelist_file = os.path.join(run_dir, nlfile)
+        baseline_namelist_file = baseline_index.casedocs_file(
+            baseline_name, nlfile)
+        if baseline_namelist_file is None:
+            print("ERROR : nlcomp : {0} : could not find baseline namelist file : {1}".format(
+                test, os.path.join(baseline_dir, baseline_name,
+                                   "CaseDocs", nlfile)), file=outfile)
+            continue
+        try:
+            differences = diff_namelist_files(baseline_namelist_file,
+                                              namelist_file)
+        except (IOError, OSError) as error:
+            print("ERROR : nlcomp : {0} : could not read namelist file : "
+                  "{1}".format(test, error), file=outfile)
+            continue
+        if not differences:
+            continue
+        print("  namelist differences : {0}".format(nlfile), file=outfile)
+        print("    baseline : {0}".format(baseline_namelist_file),
+              file=outfile)
+        print("    test     : {0}".format(namelist_file), file=outfile)
+        for group, variable, base_value, test_value in differences:
+            if variable is None:
+                print("    &{0} : baseline = {1} ; test = {2}".format(
+                    group, format_value(base_value),
+                    format_value(test_value)), file=outfile)
+            else:
+                print("    &{0} {1} :\n      baseline = {2}\n"
+                      "      test     = {3}".format(
+                          group, variable, format_value(base_value),
+                          format_value(test_value)), file=outfile)
 
 
 def process_default(outfile, detailed_report, name, test_list):
@@ -576,12 +775,17 @@ def commandline_options():
  and is standard cfg format. It should look something like:
 
 [yellowstone]
+cesm_src_dir = /glade/u/home/andre/scratch/src/controlMod_cpp_clm
 scratch_dir = /glade/u/home/andre/scratch
 test_data_dir = tests-20131009-19
-pgi_status = cs.status.20131009-191731.yellowstone
-intel_status = cs.status.20131009-191542.yellowstone
+compiler = intel
+testid = 20131009-191542-clmi
 expected_fail = /glade/u/home/andre/scratch/src/controlMod_cpp_clm/models/lnd/clm/bld/unit_testers/xFail/expectedClmTestFails.xml
 baseline = clm4_5_36
+baseline_root = /glade/p/cesmdata/cseg/ccsm_baselines
+
+The test status is read from the testspec and TestStatus files of the
+testid, or the newest testspec in the test root if testid is omitted.
 """
     if sys.hexversion < 0x02070000:
         parser = optparse.OptionParser(
@@ -591,7 +795,10 @@ baseline = clm4_5_36
         parser.add_option(
             '-f', '--test-info-file', nargs='+',
             help="path to the test info file, containing the paths to the "
-            "test directory, expected fails, status scripts, etc.")
+            "test directory, compiler, testid, expected fails, baseline, "
+            "etc. A test "
+            "root launched by cime-tests.py, or its launch-manifest.json, "
+            "can be given instead, reporting on each of its compilers.")
 
         parser.add_option(
             '-d', '--detailed-report', default=False, action="store_true",
@@ -599,6 +806,18 @@ baseline = clm4_5_36
             "diff and grep on various files. EXPERIMENTAL: This is "
             "somewhat(?) unreliable information.")
 
+        parser.add_option(
+            '-j', '--diagnostic-jobs', type='int',
+            default=DEFAULT_DIAGNOSTIC_JOBS,
+            help="Number of failed builds to rerun at once for a detailed "
+            "report.")
+
+        parser.add_option(
+            '-i', '--incremental', default=False, action="store_true",
+            help="Only reread and rediagnose the cases whose TestStatus "
+            "changed since the previous report, reusing the cached results "
+            "for the rest.")
+
         (options, args) = parser.parse_args()
         if options.test_info_file is None:
             raise RuntimeError(
@@ -614,7 +833,10 @@ baseline = clm4_5_36
         parser.add_argument(
             '-f', '--test-info-file', nargs='+', required=True,
             help="path to the test info file, containing the paths to the "
-            "test directory, expected fails, status scripts, etc.")
+            "test directory, compiler, testid, expected fails, baseline, "
+            "etc. A test "
+            "root launched by cime-tests.py, or its launch-manifest.json, "
+            "can be given instead, reporting on each of its compilers.")
 
         parser.add_argument(
             '-d', '--detailed-report', default=False, action="store_true",
@@ -622,78 +844,271 @@ baseline = clm4_5_36
             "diff and grep on various files. EXPERIMENTAL: This is "
             "somewhat(?) unreliable information.")
 
+        parser.add_argument(
+            '-j', '--diagnostic-jobs', type=int,
+            default=DEFAULT_DIAGNOSTIC_JOBS,
+            help="Number of failed builds to rerun at once for a detailed "
+            "report.")
+
+        parser.add_argument(
+            '-i', '--incremental', default=False, action="store_true",
+            help="Only reread and rediagnose the cases whose TestStatus "
+            "changed since the previous report, reusing the cached results "
+            "for the rest.")
+
         options = parser.parse_args()
     return options
 
 
-def main():
-    options = commandline_options()
-    for test_info_file in options.test_info_file:
-        machine, test_info = determine_test_info(
-            test_info_file)
-        compiler = test_info['compiler'].lower()
+# report sections that are real failures when comparing compilers.
+CROSS_COMPILER_FAILURES = ("CFAIL", "TFAIL", "SFAIL", "RUN", "FAIL",
+                           "generate", "nlcomp", "compare_hist")
+
+
+def filter_test_info_file(test_info_file, detailed_report, diagnostic_jobs,
+                          incremental=False, compiler=None):
+    """Write the failure summary for one test info file, or for one
+    compiler of a test root with a launch manifest. Only uses absolute
+    paths so several test info files can be processed at once. In
+    incremental mode the results of the previous report for the test
+    info file are reused for the cases that did not change.
+
+    Returns a dict with the machine, compiler, summary file name and
+    the report section of every test, or the error message if the
+    report could not be generated.
 
-        test_dir = "{0}/{1}".format(test_info['scratch_dir'],
-                                    test_info['test_data_dir'])
-        os.chdir(test_dir)
-        status_list = generate_status_output_files(test_info)
+    """
+    try:
+        manifest_root = get_manifest_test_root(test_info_file)
+        if manifest_root is not None:
+            machine, test_info = manifest_test_info(manifest_root, compiler)
+            short_name = "{0}.{1}".format(machine, compiler)
+        else:
+            machine, test_info = determine_test_info(test_info_file)
+            test_name = os.path.basename(test_info_file)
+            short_name = test_name[:test_name.rfind(".cfg")]
+        compiler = test_info['compiler'].lower()
 
-        detailed_report = options.detailed_report
+        test_dir = os.path.abspath("{0}/{1}".format(
+            test_info['scratch_dir'], test_info['test_data_dir']))
 
-        test_name = test_info_file
-        short_name = test_name[:test_name.rfind(".cfg")]
         summary_filename = "{0}/test-summary.{1}.txt".format(test_dir, short_name)
         if detailed_report:
             summary_filename = "{0}/test-details.{1}.txt".format(
                 test_dir, short_name)
 
+        report_cache = None
+        if incremental:
+            report_cache = ReportCache(get_report_cache_file(
+                test_dir, "{0}.{1}".format(
+                    short_name, "details" if detailed_report else "summary")))
+
         print("Writing failure summary to: {0}".format(summary_filename))
         with open(summary_filename, 'w') as summary_file:
-            for report in status_list:
-                print(80 * "=", file=summary_file)
-                print("  Report file:", file=summary_file)
-                print("    {0}".format(report), file=summary_file)
-                print(80 * "=", file=summary_file)
-                test_status = get_test_status(report, machine, compiler)
-                process_expected_fail(
-                    test_info, machine, compiler, summary_file, detailed_report,
-                    test_status)
-                process_cfail(
-                    summary_file, detailed_report, test_status["CFAIL"], test_dir)
-                process_bfail(
-                    summary_file, detailed_report, test_status["BFAIL"],
-                    test_status["FAIL"])
-                process_generate(
-                    summary_file, detailed_report, test_status["FAIL"])
-                process_nlcomp(
-                    summary_file, detailed_report, test_status["FAIL"], test_dir,
-                    test_info)
-                process_compare_hist(
-                    summary_file, detailed_report, test_status["FAIL"], test_dir)
-                process_run_fail(summary_file, detailed_report, test_status["RUN"])
-                process_default(
-                    summary_file, detailed_report, "TFAIL", test_status["TFAIL"])
-                process_default(
-                    summary_file, detailed_report, "SFAIL", test_status["SFAIL"])
-                process_default(
-                    summary_file, detailed_report, "UNKNOWN", test_status["UNKNOWN"])
-
-                process_default(
-                    summary_file, detailed_report, "GEN", test_status["GEN"])
-                process_default(
-                    summary_file, detailed_report, "PEND", test_status["PEND"])
-
-                process_memcomp(summary_file, detailed_report, test_status["FAIL"])
-                process_tput(summary_file, detailed_report, test_status["FAIL"])
-                process_default(
-                    summary_file, detailed_report, "BFAIL_NA", test_status["BFAIL_NA"])
-                process_default(
-                    summary_file, detailed_report, "FAIL", test_status["FAIL"])
-                process_default(
-                    summary_file, detailed_report, "PASS", test_status["PASS"])
-
-                print("\n\n", file=summary_file)
-    return 0
+            print(80 * "=", file=summary_file)
+            print("  Test root:", file=summary_file)
+            print("    {0}".format(test_dir), file=summary_file)
+            records = collect_status_records(test_info, summary_file,
+                                             report_cache)
+            print(80 * "=", file=summary_file)
+            test_status = get_test_status(records, machine, compiler)
+            case_dirs = dict((record.test, record.case_dir)
+                             for record in records)
+            process_expected_fail(
+                test_info, machine, compiler, summary_file, detailed_report,
+                test_status)
+            failures = classify_failures(test_status)
+            process_cfail(
+                summary_file, detailed_report, test_status["CFAIL"], test_dir,
+                case_dirs, diagnostic_jobs, report_cache)
+            process_bfail(
+                summary_file, detailed_report, test_status["BFAIL"])
+            process_generate(
+                summary_file, detailed_report, failures["generate"])
+            process_nlcomp(
+                summary_file, detailed_report, failures["nlcomp"], test_dir,
+                test_info, case_dirs, report_cache)
+            process_compare_hist(
+                summary_file, detailed_report, failures["compare_hist"],
+                test_dir, report_cache)
+            process_run_fail(summary_file, detailed_report, test_status["RUN"])
+            process_default(
+                summary_file, detailed_report, "TFAIL", test_status["TFAIL"])
+            process_default(
+                summary_file, detailed_report, "SFAIL", test_status["SFAIL"])
+            process_default(
+                summary_file, detailed_report, "UNKNOWN", test_status["UNKNOWN"])
+
+            process_default(
+                summary_file, detailed_report, "GEN", test_status["GEN"])
+            process_default(
+                summary_file, detailed_report, "PEND", test_status["PEND"])
+
+            process_memcomp(summary_file, detailed_report, failures["memcomp"])
+            process_tput(summary_file, detailed_report, failures["tputcomp"])
+            process_default(
+                summary_file, detailed_report, "BFAIL_NA", test_status["BFAIL_NA"])
+            process_default(
+                summary_file, detailed_report, "FAIL", failures["FAIL"])
+            process_default(
+                summary_file, detailed_report, "PASS", test_status["PASS"])
+
+            print("\n\n", file=summary_file)
+        if report_cache is not None:
+            report_cache.save()
+    except Exception as error:
+        traceback.print_exc()
+        return {"test_info_file": test_info_file, "error": str(error)}
+
+    sections = {}
+    for name in ("PASS", "CFAIL", "BFAIL", "TFAIL", "SFAIL", "RUN", "GEN",
+                 "PEND", "BFAIL_NA"):
+        for test in test_status[name]:
+            sections[test] = name
+    for name in failures:
+        for test in failures[name]:
+            sections[test] = name
+    return {"test_info_file": test_info_file, "error": None,
+            "machine": machine, "compiler": compiler, "test_dir": test_dir,
+            "summary_file": summary_filename, "sections": sections}
+
+
+def _filter_test_info_job(args):
+    return filter_test_info_file(*args)
+
+
+# the testid field of compare_hist, nlcomp and generate lines,
+# e.g. .C.20160101-1200-clmi, the testid contains the compiler.
+TESTID_FIELD_RE = re.compile(r"\.[CG]\.[^.]+(?=\.|$)")
+
+
+def cross_compiler_name(test, machine, compiler):
+    """Name of a status line test without the compiler and testid, so
+    the same test matches across compilers.
+
+    >>> cross_compiler_name(
+    ...     "ERS.f10_f10.I.yellowstone_intel.clm-default.C.0101-clmi.compare_hist",
+    ...     "yellowstone", "intel")
+    'ERS.f10_f10.I.yellowstone.clm-default.compare_hist'
+    >>> cross_compiler_name("SMS.T62_g16.C.yellowstone_pgi.G.0101-clmp",
+    ...                     "yellowstone", "pgi")
+    'SMS.T62_g16.C.yellowstone'
+
+    """
+    marker = ".{0}_{1}".format(machine, compiler)
+    index = test.find(marker)
+    if index < 0:
+        return test
+    suffix = test[index + len(marker):]
+    if suffix and suffix[0] != '.':
+        return test
+    return "{0}.{1}{2}".format(test[:index], machine,
+                               TESTID_FIELD_RE.sub("", suffix))
+
+
+def compare_compilers(results):
+    """Match the tests of several reports by name without the compiler
+    and testid, e.g. ERS_D.f10_f10.ICLM45BGC.yellowstone.clm-default,
+    and return a sorted list of (name, {compiler : section}) for the
+    tests that fail on some compilers but not on others.
+
+    >>> compare_compilers([
+    ...     {"machine": "yellowstone", "compiler": "intel", "sections": {
+    ...         "ERS.f10.I.yellowstone_intel.C.0101-clmi.compare_hist":
+    ...         "compare_hist"}},
+    ...     {"machine": "yellowstone", "compiler": "pgi", "sections": {
+    ...         "ERS.f10.I.yellowstone_pgi.C.0101-clmp.compare_hist":
+    ...         "PASS"}}])
+    [('ERS.f10.I.yellowstone.compare_hist', {'intel': 'compare_hist', 'pgi': 'PASS'})]
+
+    """
+    tests = {}
+    for result in results:
+        for test, section in result["sections"].items():
+            name = cross_compiler_name(test, result["machine"],
+                                       result["compiler"])
+            tests.setdefault(name, {})[result["compiler"]] = section
+    differences = []
+    for name in sorted(tests):
+        failing = [c for c in tests[name]
+                   if tests[name][c] in CROSS_COMPILER_FAILURES]
+        if failing and len(failing) < len(tests[name]):
+            differences.append((name, tests[name]))
+    return differences
+
+
+def write_cross_compiler_summary(summary_filename, results):
+    """Write the per compiler summary files and the tests that only fail
+    on some of the compilers.
+
+    """
+    differences = compare_compilers(results)
+    with open(summary_filename, 'w') as summary_file:
+        print(80 * "=", file=summary_file)
+        print("  Cross compiler summary\n", file=summary_file)
+        for result in results:
+            print("    {0} : {1}".format(result["compiler"],
+                                         result["summary_file"]),
+                  file=summary_file)
+        print(80 * "=", file=summary_file)
+        print("  tests failing on some compilers but not others\n",
+              file=summary_file)
+        for name, sections in differences:
+            print("      {0}".format(name), file=summary_file)
+            for compiler in sorted(sections):
+                print("        {0} : {1}".format(compiler, sections[compiler]),
+                      file=summary_file)
+        print("\n\n", file=summary_file)
+
+
+def main():
+    options = commandline_options()
+    jobs = []
+    for test_info_file in options.test_info_file:
+        compilers = [None]
+        manifest_root = get_manifest_test_root(test_info_file)
+        if manifest_root is not None:
+            # one report per compiler launched in the test root.
+            manifest = read_test_root_manifest(manifest_root)
+            compilers = []
+            for launch in manifest["launches"]:
+                if launch["compiler"] not in compilers:
+                    compilers.append(launch["compiler"])
+        for compiler in compilers:
+            jobs.append((test_info_file, options.detailed_report,
+                         options.diagnostic_jobs, options.incremental,
+                         compiler))
+    if len(jobs) > 1:
+        pool = multiprocessing.Pool(len(jobs))
+        try:
+            results = pool.map(_filter_test_info_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_filter_test_info_job(job) for job in jobs]
+
+    status = 0
+    for result in results:
+        if result["error"] is not None:
+            print("ERROR: {0} : {1}".format(result["test_info_file"],
+                                            result["error"]))
+            status = 1
+    results = [result for result in results if result["error"] is None]
+    if len(results) > 1:
+        test_dirs = set(result["test_dir"] for result in results)
+        summary_dir = os.getcwd()
+        if len(test_dirs) == 1:
+            summary_dir = test_dirs.pop()
+        summary_filename = os.path.join(summary_dir,
+                                        "test-summary.cross-compiler.txt")
+        if options.detailed_report:
+            summary_filename = os.path.join(
+                summary_dir, "test-details.cross-compiler.txt")
+        print("Writing cross compiler summary to: {0}".format(
+            summary_filename))
+        write_cross_compiler_summary(summary_filename, results)
+    return status
 
 if __name__ == "__main__":
     try:
@@ -21,7 +21,13 @@ if sys.hexversion < 0x02070000:
 # built-in modules
 #
 import argparse
+import fcntl
+import hashlib
+import multiprocessing
 import os
+import shutil
+import subprocess
+import tempfile
 import traceback
 
 if sys.version_info[0] == 2:
@@ -86,8 +92,27 @@ def read_config_file(filename):
 # -------------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 
-def build_cprnc(cprnc_path):
-    """
+# shared cache of cprnc builds, one directory per build key.
+CPRNC_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cime",
+                               "cprnc-cache")
+
+# FIXME(bja, 2015-01) need to get compilers and lib dirs from xml file.
+# Until then they can be overridden from the environment.
+CPRNC_FC = os.environ.get("FC", "mpif90")
+CPRNC_HDF5_DIR = os.environ.get("HDF5_DIR", "/usr/local")
+CPRNC_NETCDF_INCLUDE = os.path.join(os.environ.get("NETCDF", "/usr/local"),
+                                    "include")
+
+
+def build_cprnc(cprnc_path, scripts_dir=None, cache_dir=None):
+    """Make sure the cprnc used by the tests exists.
+
+    A cprnc path starting with $CCSMROOT is built in the sandbox,
+    tools/cprnc/build relative to the parent of the scripts directory.
+    Builds are shared between sandboxes through a cache keyed by the
+    cprnc sources, compiler and library paths, so identical builds are
+    only done once.
+
     """
     print(70*"=")
     print("Checking for cprnc...", end='')
@@ -109,46 +134,178 @@ def build_cprnc(cprnc_path):
         return
 
     # need to check for local cprnc in ccsmroot!
-    orig_dir = os.getcwd()
-    if orig_dir.split("/")[-1] != "scripts":
-        print("In directory : {0}".format(orig_dir))
-        raise RuntimeError("this program must be run from the scripts directory to build cprnc.")
+    if scripts_dir is None:
+        scripts_dir = os.getcwd()
+        if scripts_dir.split("/")[-1] != "scripts":
+            print("In directory : {0}".format(scripts_dir))
+            raise RuntimeError("this program must be run from the scripts directory to build cprnc.")
 
     # strip off the scripts dir
-    cesm_root = os.path.dirname(orig_dir)
+    cesm_root = os.path.dirname(os.path.abspath(scripts_dir))
     cprnc_dir = "{0}/tools/cprnc".format(cesm_root)
     build_dir = "{0}/build".format(cprnc_dir)
-    if os.path.isfile("{0}/cprnc".format(build_dir)):
+    cprnc = "{0}/cprnc".format(build_dir)
+    if os.path.isfile(cprnc):
         # don't rebuild cprnc if it already exists
 
         print("Found existing cprnc in CCSMROOT. Reusing instead of building.")
         print(70*"=")
         return
 
+    if cache_dir is None:
+        cache_dir = CPRNC_CACHE_DIR
+    cached_cprnc = get_cached_cprnc(cprnc_dir, cache_dir)
     if not os.path.isdir(build_dir):
-        os.mkdir(build_dir)
-    os.chdir(build_dir)
-    # FIXME(bja, 2015-01) need to get compilers and lib dirs from xml file.
-    command = ["cmake",
-               "-DCMAKE_Fortran_COMPILER=mpif90",
-               "-DHDF5_DIR=/usr/local",
-               "-DNetcdf_INCLUDE_DIR=/usr/local/include",
-               ".."]
-    status = run_command(command, logfile="cprnc.cmakelog.txt")
-    if status != 0:
-        raise RuntimeError("ERROR could not run cmake for cprnc")
-    command = ["make"]
-    status = run_command(command, logfile="cprnc.buildlog.txt")
-    if status != 0:
-        raise RuntimeError("ERROR could not build cprnc")
-    if not os.path.isfile("{0}/cprnc".format(build_dir)):
-        raise RuntimeError("ERROR could not find cprnc executable!")
-    else:
-        print("Built cprnc!")
-    os.chdir(orig_dir)
+        os.makedirs(build_dir)
+    _install(cached_cprnc, cprnc)
+    print("Using cprnc from cache : {0}".format(cached_cprnc))
     print(70*"=")
 
 
+def cprnc_build_key(cprnc_dir, fortran_compiler=None, hdf5_dir=None,
+                    netcdf_include=None):
+    """Hash of everything that goes into a cprnc build: the source files
+    (excluding any build directory), the resolved compiler and the
+    library paths.
+
+    """
+    if fortran_compiler is None:
+        fortran_compiler = CPRNC_FC
+    if hdf5_dir is None:
+        hdf5_dir = CPRNC_HDF5_DIR
+    if netcdf_include is None:
+        netcdf_include = CPRNC_NETCDF_INCLUDE
+
+    key = hashlib.sha1()
+    for name in (fortran_compiler, _which(fortran_compiler), hdf5_dir,
+                 netcdf_include):
+        key.update("{0}\n".format(name).encode('utf-8'))
+    for root, dirs, files in os.walk(cprnc_dir):
+        dirs[:] = sorted(d for d in dirs
+                         if d != "build" and not d.startswith('.'))
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            key.update(os.path.relpath(path, cprnc_dir).encode('utf-8'))
+            with open(path, 'rb') as source:
+                key.update(source.read())
+    return key.hexdigest()
+
+
+def get_cached_cprnc(cprnc_dir, cache_dir):
+    """Return the path of the cached cprnc for these sources, building
+    it first if needed. Concurrent builds of the same key wait on a
+    lock file instead of building twice.
+
+    """
+    if not os.path.isdir(cprnc_dir):
+        raise RuntimeError("ERROR could not find cprnc sources : {0}".format(
+            cprnc_dir))
+    key = cprnc_build_key(cprnc_dir)
+    key_dir = os.path.join(cache_dir, key)
+    cached_cprnc = os.path.join(key_dir, "cprnc")
+    if os.path.isfile(cached_cprnc):
+        return cached_cprnc
+
+    if not os.path.isdir(key_dir):
+        try:
+            os.makedirs(key_dir)
+        except OSError:
+            # created by a concurrent build
+            if not os.path.isdir(key_dir):
+                raise
+    with open(os.path.join(cache_dir, "{0}.lock".format(key)), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.isfile(cached_cprnc):
+                print()
+                print("Building cprnc in cache : {0}".format(key_dir))
+                _build_cprnc(cprnc_dir, key_dir)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return cached_cprnc
+
+
+def _build_cprnc(cprnc_dir, key_dir):
+    """cmake and parallel make in a temporary build directory, then move
+    the executable into the cache.
+
+    """
+    build_dir = tempfile.mkdtemp(prefix="build.", dir=key_dir)
+    try:
+        command = ["cmake",
+                   "-DCMAKE_Fortran_COMPILER={0}".format(CPRNC_FC),
+                   "-DHDF5_DIR={0}".format(CPRNC_HDF5_DIR),
+                   "-DNetcdf_INCLUDE_DIR={0}".format(CPRNC_NETCDF_INCLUDE),
+                   cprnc_dir]
+        status = run_command(command,
+                             os.path.join(key_dir, "cprnc.cmakelog.txt"),
+                             build_dir)
+        if status != 0:
+            raise RuntimeError("ERROR could not run cmake for cprnc")
+        command = ["make", "-j", str(_num_make_jobs())]
+        status = run_command(command,
+                             os.path.join(key_dir, "cprnc.buildlog.txt"),
+                             build_dir)
+        if status != 0:
+            raise RuntimeError("ERROR could not build cprnc")
+        built_cprnc = os.path.join(build_dir, "cprnc")
+        if not os.path.isfile(built_cprnc):
+            raise RuntimeError("ERROR could not find cprnc executable!")
+        os.rename(built_cprnc, os.path.join(key_dir, "cprnc"))
+    finally:
+        # the logs are kept in the cache directory
+        shutil.rmtree(build_dir, ignore_errors=True)
+    print("Built cprnc!")
+
+
+def _install(cached_cprnc, cprnc):
+    """Hard link the cached executable into the sandbox, or copy it if
+    the cache is on a different file system.
+
+    """
+    tmp_cprnc = "{0}.{1}.tmp".format(cprnc, os.getpid())
+    try:
+        os.link(cached_cprnc, tmp_cprnc)
+    except OSError:
+        shutil.copy2(cached_cprnc, tmp_cprnc)
+    os.rename(tmp_cprnc, cprnc)
+
+
+def run_command(command, logfile, cwd):
+    """Run a command in cwd, writing its output to logfile. Returns the
+    exit status.
+
+    """
+    with open(logfile, 'w') as log:
+        try:
+            return subprocess.call(command, cwd=cwd, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        except OSError as error:
+            print("ERROR: Running command :\n    '{0}'".format(
+                " ".join(command)), file=log)
+            print(error, file=log)
+            return 1
+
+
+def _num_make_jobs():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 4
+
+
+def _which(program):
+    """Resolved path of a program on the PATH, or the name itself.
+    """
+    if os.path.dirname(program):
+        return os.path.realpath(program)
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        candidate = os.path.join(path, program)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return os.path.realpath(candidate)
+    return program
+
+
 
 # -------------------------------------------------------------------------------
 #
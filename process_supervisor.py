@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""Reusable code to launch and supervise several child processes at
+once. Each child writes to its own log file. The supervisor wakes as
+soon as a child exits, follows the log files as they grow, shows a
+single multiplexed progress line and enforces an optional wall clock
+timeout on each command.
+
+The tools have to keep running on python 2.7, so asyncio is not
+available. Instead, a lightweight thread per child blocks in wait()
+and posts an exit event to a queue, and the supervisor blocks on that
+queue.
+
+Author: Ben Andre <andre@ucar.edu>
+
+"""
+
+from __future__ import print_function
+
+import sys
+
+if sys.hexversion < 0x02070000:
+    print(70 * "*")
+    print("ERROR: {0} requires python >= 2.7.x. ".format(sys.argv[0]))
+    print("It appears that you are running python {0}".format(
+        ".".join(str(x) for x in sys.version_info[0:3])))
+    print(70 * "*")
+    sys.exit(1)
+
+import os
+import subprocess
+import threading
+import time
+
+if sys.version_info[0] == 2:
+    import Queue as queue
+else:
+    import queue
+
+
+# seconds between log file checks and progress updates while waiting
+# for a child to exit.
+LOG_FOLLOW_INTERVAL = 1.0
+
+# seconds to wait after sending SIGTERM to a timed out child before
+# sending SIGKILL.
+TERMINATE_GRACE_PERIOD = 30.0
+
+
+class SupervisedCommand(object):
+    """State for a single command run by the supervisor.
+    """
+
+    def __init__(self, command, logfile, label=None, timeout=None, cwd=None):
+        self.command = command
+        self.logfile = logfile
+        self.cwd = cwd
+        self.label = label
+        if self.label is None:
+            self.label = os.path.basename(logfile)
+        self.timeout = timeout
+        self.proc = None
+        self.status = None
+        self.start_time = None
+        self.end_time = None
+        self.timed_out = False
+        self.last_line = ''
+        self._log = None
+        self._log_offset = 0
+        self._terminate_time = None
+
+    def elapsed(self):
+        """Wall clock seconds since the command was started.
+        """
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.time()
+        return end_time - self.start_time
+
+
+class ProcessSupervisor(object):
+    """Run a set of commands with at most max_parallel in flight.
+
+    Usage:
+
+        supervisor = ProcessSupervisor(max_parallel=3, timeout=3600.0)
+        supervisor.add(command, logfile)
+        status = supervisor.run()
+
+    If admission is given, admission.admit(cmd, running) must also
+    return True before the next pending command is started, see
+    batch_admission.AdmissionController.
+
+    """
+
+    def __init__(self, max_parallel=1, timeout=None, echo_logs=False,
+                 stream=None, admission=None):
+        self._max_parallel = max(1, max_parallel)
+        self._admission = admission
+        self._timeout = timeout
+        self._echo_logs = echo_logs
+        self._stream = stream
+        if self._stream is None:
+            self._stream = sys.stdout
+        self._tty = hasattr(self._stream, 'isatty') and self._stream.isatty()
+        self._commands = []
+        self._events = queue.Queue()
+        self._progress_width = 0
+
+    def add(self, command, logfile, label=None, timeout=None, cwd=None):
+        """Queue a command to be run. Commands are started in the order
+        they are added. The command runs in cwd if given, the
+        supervisor never changes its own working directory.
+
+        """
+        if timeout is None:
+            timeout = self._timeout
+        cmd = SupervisedCommand(command, logfile, label, timeout, cwd)
+        self._commands.append(cmd)
+        return cmd
+
+    def commands(self):
+        """Return the list of commands known to the supervisor.
+        """
+        return self._commands
+
+    def run(self):
+        """Run all queued commands and wait for them to finish. Returns
+        the list of exit statuses in the order the commands were added.
+
+        """
+        pending = list(self._commands)
+        running = []
+        try:
+            while pending or running:
+                while pending and len(running) < self._max_parallel:
+                    if (self._admission is not None and
+                            not self._admission.admit(pending[0], running)):
+                        break
+                    cmd = pending.pop(0)
+                    if self._start(cmd):
+                        running.append(cmd)
+                    self._update_progress(running, pending)
+
+                try:
+                    cmd = self._events.get(timeout=LOG_FOLLOW_INTERVAL)
+                except queue.Empty:
+                    cmd = None
+                while cmd is not None:
+                    self._finish(cmd)
+                    running.remove(cmd)
+                    try:
+                        cmd = self._events.get_nowait()
+                    except queue.Empty:
+                        cmd = None
+
+                for cmd in running:
+                    self._follow_log(cmd)
+                    self._check_timeout(cmd)
+                self._update_progress(running, pending)
+        except KeyboardInterrupt:
+            self._clear_progress()
+            print("Interrupted, terminating running commands.",
+                  file=self._stream)
+            for cmd in running:
+                _terminate(cmd.proc)
+            raise
+        self._clear_progress()
+        return [cmd.status for cmd in self._commands]
+
+    def _start(self, cmd):
+        """Launch a command and start a thread waiting for it to exit.
+        """
+        self._clear_progress()
+        try:
+            cmd._log = open(cmd.logfile, 'w')
+            cmd.proc = subprocess.Popen(cmd.command,
+                                        shell=False,
+                                        cwd=cmd.cwd,
+                                        stdout=cmd._log,
+                                        stderr=subprocess.STDOUT)
+        except Exception as error:
+            print("ERROR: Running command :\n    '{0}'".format(
+                " ".join(cmd.command)), file=self._stream)
+            print(error, file=self._stream)
+            if cmd._log is not None:
+                cmd._log.close()
+                cmd._log = None
+            cmd.status = 1
+            return False
+
+        cmd.start_time = time.time()
+        print("\nstarted as pid : {0}".format(cmd.proc.pid), file=cmd._log)
+        cmd._log.flush()
+        print("started as pid : {0} : {1}".format(cmd.proc.pid, cmd.label),
+              file=self._stream)
+        waiter = threading.Thread(target=self._wait_for_exit, args=(cmd,))
+        waiter.daemon = True
+        waiter.start()
+        return True
+
+    def _wait_for_exit(self, cmd):
+        """Thread target: block until the child exits, then notify the
+        supervisor.
+
+        """
+        cmd.proc.wait()
+        self._events.put(cmd)
+
+    def _finish(self, cmd):
+        """Record the final state of a command that has exited.
+        """
+        cmd.end_time = time.time()
+        cmd.status = abs(cmd.proc.returncode)
+        if cmd.timed_out and cmd.status == 0:
+            cmd.status = 1
+        self._follow_log(cmd)
+        cmd._log.close()
+        cmd._log = None
+
+        self._clear_progress()
+        message = "finished pid : {0} : {1} : status {2} : {3}".format(
+            cmd.proc.pid, cmd.label, cmd.status,
+            _format_elapsed(cmd.elapsed()))
+        if cmd.timed_out:
+            message += " : timed out after {0}".format(
+                _format_elapsed(cmd.timeout))
+        print(message, file=self._stream)
+
+    def _follow_log(self, cmd):
+        """Read anything appended to the command's log file since the
+        last check. Keeps the last non-empty line for the progress
+        display.
+
+        """
+        try:
+            with open(cmd.logfile, 'rb') as log:
+                log.seek(cmd._log_offset)
+                data = log.read()
+        except (IOError, OSError):
+            return
+        if not data:
+            return
+        # only consume complete lines, the rest is picked up next time.
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        cmd._log_offset += end + 1
+        lines = data[:end].decode('utf-8', 'replace').splitlines()
+        for line in lines:
+            if self._echo_logs:
+                self._clear_progress()
+                print("[{0}] {1}".format(cmd.label, line), file=self._stream)
+            if line.strip():
+                cmd.last_line = line.strip()
+
+    def _check_timeout(self, cmd):
+        """Terminate a command that has exceeded its wall clock limit.
+        """
+        if not cmd.timeout or cmd.proc.returncode is not None:
+            return
+        now = time.time()
+        if not cmd.timed_out and now - cmd.start_time > cmd.timeout:
+            cmd.timed_out = True
+            cmd._terminate_time = now
+            self._clear_progress()
+            print("timeout : terminating pid {0} : {1}".format(
+                cmd.proc.pid, cmd.label), file=self._stream)
+            _terminate(cmd.proc)
+        elif (cmd.timed_out and
+              now - cmd._terminate_time > TERMINATE_GRACE_PERIOD):
+            _kill(cmd.proc)
+
+    def _update_progress(self, running, pending):
+        """Write a single status line summarizing all commands. Only
+        redrawn in place when writing to a terminal.
+
+        """
+        if not self._tty:
+            return
+        done = len(self._commands) - len(running) - len(pending)
+        line = "[{0}/{1} done, {2} running".format(
+            done, len(self._commands), len(running))
+        if self._admission is not None and pending:
+            line += ", {0}".format(self._admission.describe())
+        line += "]"
+        for cmd in running:
+            line += " {0} {1}: {2} |".format(
+                cmd.label, _format_elapsed(cmd.elapsed()), cmd.last_line)
+        line = line.rstrip(" |")
+        width = _terminal_width() - 1
+        if len(line) > width:
+            line = line[:width - 3] + "..."
+        self._stream.write("\r" + line.ljust(self._progress_width))
+        self._stream.flush()
+        self._progress_width = len(line)
+
+    def _clear_progress(self):
+        """Erase the progress line before printing a regular message.
+        """
+        if self._tty and self._progress_width > 0:
+            self._stream.write("\r" + " " * self._progress_width + "\r")
+            self._stream.flush()
+            self._progress_width = 0
+
+
+def _terminate(proc):
+    try:
+        proc.terminate()
+    except OSError:
+        pass
+
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except OSError:
+        pass
+
+
+def _format_elapsed(seconds):
+    """Format seconds as H:MM:SS
+    """
+    seconds = int(seconds)
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600,
+                                        (seconds % 3600) // 60,
+                                        seconds % 60)
+
+
+def _terminal_width():
+    """Best guess at the terminal width without any extra dependencies.
+    """
+    try:
+        return int(os.environ["COLUMNS"])
+    except (KeyError, ValueError):
+        return 80
@@ -1,13 +1,29 @@
 #!/usr/bin/env bash
+#
+# Move the case in the current directory to the premium queue with a
+# ten minute wall clock limit. To edit every case of a test suite in
+# one go, use edit-test-cases.py --test-root directly.
+#
+# Uses edit-test-cases.py from the PATH or next to this script, and
+# falls back to editing env_batch.xml in place when this script was
+# copied into a case directory on its own.
+#
 BATCH_FILE=env_batch.xml
 
 
-if [ -f ./${BATCH_FILE} ]; then
-    perl -w -i -p -e 's/regular/premium/g' ${BATCH_FILE}
-    perl -w -i -p -e 's/[\d]+:00/00:10/g' ${BATCH_FILE}
-else
+if [ ! -f ./${BATCH_FILE} ]; then
     echo "ERROR: no ${BATCH_FILE} file in current directory."
     exit 1
 fi
 
-exit 0
+EDIT_TEST_CASES=$(command -v edit-test-cases.py)
+if [ -z "${EDIT_TEST_CASES}" -a -x "$(dirname "$0")/edit-test-cases.py" ]; then
+    EDIT_TEST_CASES="$(dirname "$0")/edit-test-cases.py"
+fi
+
+if [ -n "${EDIT_TEST_CASES}" ]; then
+    exec "${EDIT_TEST_CASES}" --case . --queue premium --walltime 00:10
+fi
+
+perl -w -i -p -e 's/regular/premium/g' ${BATCH_FILE}
+perl -w -i -p -e 's/[\d]+:00/00:10/g' ${BATCH_FILE}